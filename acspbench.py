@@ -0,0 +1,1009 @@
+#!/usr/bin/env python
+#
+# Benchmarks of acspmon hot paths, on synthetic AP fleets, no real AP is needed
+# Usage:
+#   ./acspbench.py -b nbr -n 500
+#
+
+
+import os, sys, optparse, time, random, socket, subprocess, resource, threading, json
+import acspmon
+from acspmon import AP, ACSPNbr, Radio, SSHNode, parse_nbrtab, calc_ap_coord_lsq, np, \
+    circles_cpoints, circles_cpoints_batch, distance, find_ap_at_xy, IFNAME_WIFI0, IFNAME_WIFI1
+from math import sqrt
+
+
+
+# Build a synthetic fleet of 'num' APs with 2 radios each, and register them
+# to acspmon.APS/RADIOS as if they were detected
+def synth_fleet(num):
+    acspmon.APS.clear()
+    acspmon.RADIOS.clear()
+    acspmon.NBR_LINKS.clear()
+    acspmon.FILTER.clear()
+    aps = []
+    for i in range(num):
+        ap = AP('10.%d.%d.%d' % ((i >> 16) & 255, (i >> 8) & 255, i & 255))
+        ap.name = 'AP%d' % i
+        ap.mac = '0019:%04x:0000' % i
+        ap.setup_radio(IFNAME_WIFI0, '0019:%04x:0010' % i, 'U', ap)
+        ap.setup_radio(IFNAME_WIFI1, '0019:%04x:0020' % i, 'U', ap)
+        for rd in ap.radios.values():
+            rd.mode = 'access'
+            rd.chnl = 11 if rd.name == IFNAME_WIFI0 else 149
+            rd.txpwr = 20
+        acspmon.APS[ap.ip] = ap
+        aps.append(ap)
+    acspmon.publish_fleet()
+    return aps
+
+# Build the raw output of 'show acsp neighbor' in which all radios of 'aps' are
+# heard, 'vaps' VAPs per radio
+def synth_nbrtab(aps, vaps=2):
+    lines = ['show acsp neighbor\r']
+    lines.append('Bssid           Mode    Ssid/Hive  Chan  Rssi(dBm)  Aerohive AP  Chan-width  CU  CRC  STA  Channel-utilization\r')
+    for n, ap in enumerate(aps):
+        for rd in ap.radios.values():
+            for v in range(vaps):
+                lines.append('%s%x  Access  hive0      %4d  %4d       yes          20          %2d  %d    %2d   %d\r' %
+                    (rd.mac[:-1], v, rd.chnl, -40 - n % 50, n % 90, n % 3, n % 20, n % 90))
+    lines.append('AH-000010#')
+    return '\n'.join(lines)
+
+# The nbr table scan before it's indexed by BSSID prefix, for comparison
+def legacy_nbr_scan(me, nbrtab):
+    found = {}
+    for ip, ap in acspmon.APS.items():
+        if ap is me.ap:
+            continue
+        for name, radio in ap.radios.items():
+            vaps = [vap for vap in nbrtab if radio.mac[:-1] in vap]
+            if vaps:
+                found[radio.mac] = vaps
+    return found
+
+def timeit(func, rounds):
+    start = time.time()
+    for i in range(rounds):
+        func()
+    return (time.time() - start) / rounds
+
+def bench_nbr(num, rounds):
+    aps = synth_fleet(num)
+    me = aps[0].radios[IFNAME_WIFI0]
+    nbrtab = SSHNode.out_lines(synth_nbrtab(aps[1:]))
+    batch = {}
+
+    def indexed_nbr_parse():
+        batch['show acsp neighbor\n'] = parse_nbrtab(nbrtab)
+        me.update_acsp_nbrs(aps[0], batch)
+
+    legacy = timeit(lambda: legacy_nbr_scan(me, nbrtab), rounds)
+    indexed = timeit(indexed_nbr_parse, rounds)
+    if sorted(me.nbrs.keys()) != sorted(legacy_nbr_scan(me, nbrtab).keys()):
+        print 'ERROR: indexed nbr parsing found different nbrs from the legacy scan'
+    print 'nbr table of %d APs(%d lines), %d nbrs found:' % (num, len(nbrtab), len(me.nbrs))
+    print '  legacy scan:    %8.2fms per radio per cycle' % (legacy * 1000)
+    print '  indexed parse:  %8.2fms per radio per cycle(incl. rssi/sta/crc/cu parsing)' % (indexed * 1000)
+
+
+# Cost of the hot path stats(see acspmon.PerfStats) when they're off and on: of
+# a timed stage alone, and of parsing the nbr table of 'num' APs with the stage
+# and ap_lock timed, as a poll cycle does
+def bench_perf(num, rounds, stages=100000):
+    aps = synth_fleet(num)
+    ap, me = aps[0], aps[0].radios[IFNAME_WIFI0]
+    batch = {'show acsp neighbor\n': parse_nbrtab(SSHNode.out_lines(synth_nbrtab(aps[1:])))}
+    perf = acspmon.PERF
+
+    def stage():
+        for i in xrange(stages):
+            perf.stop('bench', perf.start(), ap)
+
+    def parse():
+        start = perf.start()
+        ap.lock.acquire()
+        me.update_acsp_nbrs(ap, batch)
+        ap.lock.release()
+        perf.stop('parse', start, ap)
+
+    print 'hot path stats overhead, nbr table of %d APs:' % num
+    print '  %-4s %16s %22s' % ('', 'per stage', 'nbr parse per cycle')
+    base = None
+    for enabled in (False, True):
+        perf.enable(enabled)
+        cost = timeit(stage, rounds) / stages
+        parsed = timeit(parse, rounds)
+        base = base or parsed
+        print '  %-4s %14.3fus %19.3fms(%+.1f%%)' % ('on' if enabled else 'off', cost * 1e6, 
+            parsed * 1e3, (parsed / base - 1) * 100)
+    perf.enable(False)
+
+
+# Slowdown of parsing the nbr table of 'num' APs in 8 threads named as pollers,
+# while all threads are sampled by the profiler(see acspmon.SamplingProfiler)
+# every 10ms and 1ms, and whether the profile is labelled by thread name
+def bench_profile(num, rounds, threads=8):
+    import tempfile
+    aps = synth_fleet(num)
+    batch = {'show acsp neighbor\n': parse_nbrtab(SSHNode.out_lines(synth_nbrtab(aps[1:])))}
+
+    def parse_all():
+        def poller(ap):
+            for i in range(rounds):
+                ap.radios[IFNAME_WIFI0].update_acsp_nbrs(ap, batch)
+        pollers = [threading.Thread(target=poller, args=(ap,), name='apDetectThread_' + ap.ip) 
+            for ap in aps[:threads]]
+        start = time.time()
+        for t in pollers:
+            t.start()
+        for t in pollers:
+            t.join()
+        return time.time() - start
+
+    log, acspmon.LOG = acspmon.LOG, lambda level, fmt, *args: None
+    profile_path = acspmon.PROFILE_PATH
+    acspmon.PROFILE_PATH = os.path.join(tempfile.gettempdir(), 'acspbench-%Y%m%d-%H%M%S.folded')
+    print 'nbr table of %d APs parsed %d times by %d threads each:' % (num, rounds, threads)
+    base = parse_all()
+    print '  %-18s %8.3fs' % ('not profiled', base)
+    for interval in (0.01, 0.001):
+        profiler = acspmon.SamplingProfiler(interval)
+        profiler.start()
+        elapsed = parse_all()
+        path = profiler.stop()
+        with open(path) as f:
+            stacks = f.read().split('\n')
+        os.remove(path)
+        labelled = set(l.split(';')[0] for l in stacks if l.startswith('apDetectThread_'))
+        print '  %-18s %8.3fs(%+.1f%%), %d samples, %d stacks, %d threads labelled' % \
+            ('sampled every %.0fms' % (interval * 1e3), elapsed, (elapsed / base - 1) * 100, 
+             profiler.samples, len(stacks) - 1, len(labelled))
+    acspmon.PROFILE_PATH = profile_path
+    acspmon.LOG = log
+
+
+# Time 'threads' pollers spend in LOG() with debug enabled, when each poll logs
+# a 'size' bytes CLI output and a few short messages(of which one repeats every
+# poll), written at once as before, or queued for the log writer thread(see
+# acspmon.LogPipeline), the console is /dev/null. Pollers wait 'wait' seconds
+# between polls, as for SSH outputs
+def bench_log(num, rounds, threads=8, size=75000, polls=20, wait=0.02):
+    aps = synth_fleet(max(num, threads))[:threads]
+    output = '\n'.join(SSHNode.out_lines(synth_nbrtab(aps)))
+    output = (output * (size / len(output) + 1))[:size]
+
+    def poller(ap, spent):
+        for i in range(polls):
+            start = time.time()
+            ap.lock.acquire()
+            acspmon.LOG('DEBUG', '%s: output of "show acsp neighbor":\n%s', ap, output)
+            acspmon.LOG('INFO', '%s: poll %d done', ap, i)
+            acspmon.LOG('WARN', '[%s]SSH session lost, reconnecting', ap.ip)
+            ap.lock.release()
+            spent.append(time.time() - start)
+            time.sleep(wait)
+
+    def poll_all():
+        spent = []
+        pollers = [threading.Thread(target=poller, args=(ap, spent)) for ap in aps]
+        for t in pollers:
+            t.start()
+        for t in pollers:
+            t.join()
+        return sum(spent) / len(spent)
+
+    debug, acspmon.DEBUG_ENABLE = acspmon.DEBUG_ENABLE, True
+    logger, stdout = acspmon.LOGGER, sys.stdout
+    print '%d pollers logging a %dKB CLI output per poll with debug enabled:' % (threads, len(output) / 1000)
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        sync = sum(poll_all() for i in range(rounds)) / rounds
+        acspmon.LOGGER = acspmon.LogPipeline()
+        acspmon.LOGGER.start()
+        queued = sum(poll_all() for i in range(rounds)) / rounds
+        start = time.time()
+        acspmon.LOGGER.stop()
+        drained = time.time() - start
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+        pipeline, acspmon.LOGGER = acspmon.LOGGER, logger
+        acspmon.DEBUG_ENABLE = debug
+    print '  written at once:   %8.3fms per poll in LOG(), holding the AP lock' % (sync * 1e3)
+    print '  queued:            %8.3fms per poll in LOG(), %.3fs to drain at stop' % (queued * 1e3, drained)
+    print '  %d messages written, %d repeats suppressed, %d dropped, %d failed' % \
+        (pipeline.logged, pipeline.suppressed, pipeline.dropped, pipeline.failed)
+
+
+# Per cycle cost and memory of the persistent nbr links(see acspmon.NbrLinkStore)
+# of 'num' APs, each radio hears 'nbrs' radios, whose rssi has 'noise' dB of
+# noise per poll, plus an outlier 20dB off in 'outliers' permille of the polls,
+# and how much of the noise is left after each filter(see acspmon.SignalFilter)
+def bench_links(num, rounds, nbrs=100, noise=2.0, outliers=20, cycles=20):
+    aps = synth_fleet(num)
+    radios = [rd for ap in aps for rd in ap.radios.values()]
+    store = acspmon.NBR_LINKS
+    now = time.time()
+    links = dict((rd, [(nrd, random.randint(-90, -40)) for nrd in random.sample(radios, nbrs + 1)
+                       if nrd is not rd][:nbrs]) for rd in radios)
+    samples = dict((rd, [[(int(round(rssi + random.gauss(0, noise) + 
+                                    (-20 if random.randint(0, 999) < outliers else 0))), 20, 1, 5)
+                          for nrd, rssi in links[rd]] for i in range(cycles)]) for rd in radios)
+    total = sum(len(l) for l in links.values())
+
+    def cycle(i):
+        for rd in radios:
+            observed = store.observer(rd)
+            rd.filter_signals([store.link(observed, nrd, now) for nrd, rssi in links[rd]], list(samples[rd][i]))
+
+    print '%d nbr links of %d radios, rssi noise %.1fdB, %.1f%% outliers, window %d, %s:' % \
+        (total, len(radios), noise, outliers / 10.0, acspmon.RF_SMOOTH_WINDOW, 
+         'numpy' if np else 'pure python')
+    errs = [smp[0] - rssi for rd in radios for (nrd, rssi), smp in zip(links[rd], samples[rd][-1])]
+    mean = sum(errs) / float(len(errs))
+    print '  %-6s %50s %+.2fdB, noise     %.2fdB' % ('raw', 'rssi error', mean, 
+        sqrt(sum((e - mean)**2 for e in errs) / len(errs)))
+    rf_filter = acspmon.RF_FILTER
+    for acspmon.RF_FILTER in acspmon.SignalFilter.FILTERS:
+        store.clear()
+        cycle(0)
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        elapsed = timeit(lambda: [cycle(i) for i in range(1, cycles)], rounds) / (cycles - 1)
+        grown = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss
+        errs = [store.observer(rd)[nrd.mac].rssi - rssi for rd in radios for nrd, rssi in links[rd]]
+        mean = sum(errs) / float(len(errs))
+        std = sqrt(sum((e - mean)**2 for e in errs) / len(errs))
+        print '  %-6s %8.2fms per cycle(%.2fus per link), rssi error %+.2fdB, noise left %.2fdB, max RSS grown %dKB' % \
+            (acspmon.RF_FILTER, elapsed * 1e3, elapsed * 1e6 / total, mean, std, grown)
+    acspmon.RF_FILTER = rf_filter
+    f = acspmon.FILTER
+    slot = (f.raw.nbytes + f.count.nbytes + f.ewma.nbytes) / f.capacity if np else \
+        (f.raw.itemsize * len(f.raw) + f.count.itemsize * len(f.count) + f.ewma.itemsize * len(f.ewma)) / f.capacity
+    nbr = store.observer(radios[0]).values()[0]
+    print '  memory: %d bytes per link(record %d, filter slot %d), %d links created' % \
+        (sys.getsizeof(nbr) + slot, sys.getsizeof(nbr), slot, store.created)
+
+
+# Place 'aps' on a jittered grid of 'spacing' meters, each radio hears the 'nbrs'
+# nearest APs with FSPL rssi plus noise of 'noise' dB, return the real locations
+def synth_links(aps, spacing=12.0, nbrs=24, noise=2.0):
+    side = int(np.ceil(np.sqrt(len(aps))))
+    real = np.array([(i % side, i // side) for i in range(len(aps))], float) * spacing
+    real += np.random.uniform(-spacing/4, spacing/4, real.shape)
+    dists = np.sqrt(((real[:, None, :] - real[None, :, :])**2).sum(axis=2))
+    for i, ap in enumerate(aps):
+        for rd in ap.radios.values():
+            links = {}
+            for j in np.argsort(dists[i])[1:nbrs+1]:
+                nrd = aps[j].radios[rd.name]
+                nbr = ACSPNbr(nrd)
+                fspl = 32.44 + 20*np.log10(Radio.ieee2ghz(nrd.chnl)) + 20*np.log10(max(dists[i, j], 1))
+                nbr.rssi = int(round(nrd.txpwr - fspl + np.random.normal(0, noise)))
+                links[nrd.mac] = nbr
+            rd.nbrs = links
+            rd.c = [0, 0]
+    return real
+
+# Mean distance(m) between calculated and real AP locations, after the best
+# rotation/mirror/shift of the calculated layout, which is not fixed by nbr links
+def layout_error(aps, real):
+    calc = np.array([ap.radios[IFNAME_WIFI0].c for ap in aps], float) * acspmon.CANVAS_METER_PER_DOT
+    calc -= calc.mean(axis=0)
+    real = real - real.mean(axis=0)
+    u, s, vt = np.linalg.svd(np.dot(calc.T, real))
+    return np.sqrt(((np.dot(calc, np.dot(u, vt)) - real)**2).sum(axis=1)).mean()
+
+def bench_lsq(num, rounds):
+    if not np:
+        print 'lsq: python module numpy is required'
+        return
+    aps = synth_fleet(num)
+    real = synth_links(aps)
+    links = sum(len(rd.nbrs) for ap in aps for rd in ap.radios.values())
+    iters = []
+
+    def cold_solve():
+        for ap in aps:
+            for rd in ap.radios.values():
+                rd.c = [0, 0]
+        iters.append(calc_ap_coord_lsq(aps))
+
+    cold = timeit(cold_solve, rounds)
+    err = layout_error(aps, real)
+    warm = timeit(lambda: iters.append(calc_ap_coord_lsq(aps)), rounds)
+    res = [ap.coord_residual for ap in aps]
+    print 'lsq of %d APs by %d links:' % (num, links)
+    print '  cold start:     %8.2fms(%d iterations)' % (cold * 1000, iters[0])
+    print '  warm start:     %8.2fms(%d iterations)' % (warm * 1000, iters[-1])
+    print '  residual:       avg %.2fm, max %.2fm' % (sum(res) / len(res), max(res))
+    print '  layout error:   avg %.2fm from the real locations' % err
+
+
+# circles_cpoints() before it's closed-form, for comparison
+def legacy_circles_cpoints(c1, r1, c2, r2, compensate=False):
+    points = (-1, None); x1, y1 = c1; x2, y2 = c2
+    has_compensated = False
+
+    d = distance(c1, c2)
+    if d != 0:
+        if d < abs(r1 - r2) and compensate:
+            if r1 < r2:
+                r1 += (r2 - r1 - d)
+            else:
+                r2 += (r1 - r2 - d)
+            has_compensated = True
+
+        if d >= abs(r1 - r2) and d <= r1 + r2:
+            p1 = (((y1 - y2)*(-x1**2*y1 - x1**2*y2 + 2*x1*x2*y1 + 2*x1*x2*y2 - x2**2*y1 - x2**2*y2 - y1**3 + y1**2*y2 + y1*y2**2 + y1*r1**2 - y1*r2**2 - y2**3 - y2*r1**2 + y2*r2**2 + sqrt((x1 - x2)**2*(-x1**2 + 2*x1*x2 - x2**2 - y1**2 + 2*y1*y2 - y2**2 + r1**2 + 2*r1*r2 + r2**2)*(x1**2 - 2*x1*x2 + x2**2 + y1**2 - 2*y1*y2 + y2**2 - r1**2 + 2*r1*r2 - r2**2))) + (x1**2 - x2**2 + y1**2 - y2**2 - r1**2 + r2**2)*(x1**2 - 2*x1*x2 + x2**2 + y1**2 - 2*y1*y2 + y2**2))/(2*(x1 - x2)*(x1**2 - 2*x1*x2 + x2**2 + y1**2 - 2*y1*y2 + y2**2)), (sqrt((x1 - x2)**2*(-x1**2 + 2*x1*x2 - x2**2 - y1**2 + 2*y1*y2 - y2**2 + r1**2 + 2*r1*r2 + r2**2)*(x1**2 - 2*x1*x2 + x2**2 + y1**2 - 2*y1*y2 + y2**2 - r1**2 + 2*r1*r2 - r2**2))*(-x1**2 + 2*x1*x2 - x2**2 - y1**2 + 2*y1*y2 - y2**2) + (x1**2 - 2*x1*x2 + x2**2 + y1**2 - 2*y1*y2 + y2**2)*(x1**2*y1 + x1**2*y2 - 2*x1*x2*y1 - 2*x1*x2*y2 + x2**2*y1 + x2**2*y2 + y1**3 - y1**2*y2 - y1*y2**2 - y1*r1**2 + y1*r2**2 + y2**3 + y2*r1**2 - y2*r2**2))/(2*(x1**2 - 2*x1*x2 + x2**2 + y1**2 - 2*y1*y2 + y2**2)**2)) 
+            p2 = (-((y1 - y2)*(x1**2*y1 + x1**2*y2 - 2*x1*x2*y1 - 2*x1*x2*y2 + x2**2*y1 + x2**2*y2 + y1**3 - y1**2*y2 - y1*y2**2 - y1*r1**2 + y1*r2**2 + y2**3 + y2*r1**2 - y2*r2**2 + sqrt((x1 - x2)**2*(-x1**2 + 2*x1*x2 - x2**2 - y1**2 + 2*y1*y2 - y2**2 + r1**2 + 2*r1*r2 + r2**2)*(x1**2 - 2*x1*x2 + x2**2 + y1**2 - 2*y1*y2 + y2**2 - r1**2 + 2*r1*r2 - r2**2))) - (x1**2 - x2**2 + y1**2 - y2**2 - r1**2 + r2**2)*(x1**2 - 2*x1*x2 + x2**2 + y1**2 - 2*y1*y2 + y2**2))/(2*(x1 - x2)*(x1**2 - 2*x1*x2 + x2**2 + y1**2 - 2*y1*y2 + y2**2)), (x1**2*y1 + x1**2*y2 - 2*x1*x2*y1 - 2*x1*x2*y2 + x2**2*y1 + x2**2*y2 + y1**3 - y1**2*y2 - y1*y2**2 - y1*r1**2 + y1*r2**2 + y2**3 + y2*r1**2 - y2*r2**2 + sqrt((x1 - x2)**2*(-x1**2 + 2*x1*x2 - x2**2 - y1**2 + 2*y1*y2 - y2**2 + r1**2 + 2*r1*r2 + r2**2)*(x1**2 - 2*x1*x2 + x2**2 + y1**2 - 2*y1*y2 + y2**2 - r1**2 + 2*r1*r2 - r2**2)))/(2*(x1**2 - 2*x1*x2 + x2**2 + y1**2 - 2*y1*y2 + y2**2)))
+            if d == r1 + r2 or d == abs(r1 - r2):
+                points = (0 if has_compensated else 1, [p1])
+            else:
+                points = (2, [p1, p2])
+
+    return points
+
+# Random circle pairs, crossed or not, some with vertically aligned or equal
+# centers, tangent, or one inside the other
+def synth_circle_pairs(num):
+    pairs = []
+    for i in range(num):
+        c1 = (random.uniform(0, 800), random.uniform(0, 600))
+        r1 = random.uniform(10, 300)
+        kind = i % 8
+        if kind == 0:       # vertically aligned
+            c2 = (c1[0], c1[1] + random.uniform(-300, 300))
+        elif kind == 1:     # horizontally aligned
+            c2 = (c1[0] + random.uniform(-300, 300), c1[1])
+        elif kind == 2:     # the same center
+            c2 = c1
+        else:
+            c2 = (c1[0] + random.uniform(-300, 300), c1[1] + random.uniform(-300, 300))
+        d = distance(c1, c2)
+        if kind == 3:       # tangent externally
+            r2 = max(d - r1, 1)
+        elif kind == 4:     # inside circle 1
+            r2 = r1 + d + random.uniform(1, 50)
+        else:
+            r2 = random.uniform(10, 300)
+        pairs.append((c1, r1, c2, r2, kind == 4))
+    return pairs
+
+def bench_cpoints(num, rounds):
+    pairs = synth_circle_pairs(num * 20)
+    errors, legacy_failed, legacy_pairs = [], 0, []
+
+    # properties: the points are on both circles, the upper one first, and the
+    # same as the legacy one if it could compute them(centers not vertical)
+    for pair in pairs:
+        c1, r1, c2, r2, comp = pair
+        code, points = circles_cpoints(c1, r1, c2, r2, compensate=comp)
+        if code < 0:
+            if points or (distance(c1, c2) != 0 and abs(r1 - r2) <= distance(c1, c2) <= r1 + r2):
+                errors.append(('no cross point', c1, r1, c2, r2, code, points))
+            continue
+        rr1, rr2, d = r1, r2, distance(c1, c2)
+        if comp and d < abs(r1 - r2):
+            rr1, rr2 = (r2 - d, r2) if r1 < r2 else (r1, r1 - d)
+        for p in points:
+            if abs(distance(p, c1) - rr1) > 1e-6 * rr1 or abs(distance(p, c2) - rr2) > 1e-6 * rr2:
+                errors.append(('not on circles', c1, r1, c2, r2, code, points))
+        if code == 2 and (points[0][1], points[0][0]) > (points[1][1], points[1][0]):
+            errors.append(('not upper first', c1, r1, c2, r2, code, points))
+        if c1[0] != c2[0]:
+            try:
+                lcode, lpoints = legacy_circles_cpoints(c1, r1, c2, r2, compensate=comp)
+            except ValueError:  # math domain error of rounding, e.g. tangent circles
+                legacy_failed += 1
+                continue
+            legacy_pairs.append(pair)
+            if lcode != code or [1 for p, lp in zip(points, lpoints) if distance(p, lp) > 1e-6 * (r1 + r2)]:
+                errors.append(('legacy differs', c1, r1, c2, r2, code, points, lcode, lpoints))
+
+    legacy = timeit(lambda: [legacy_circles_cpoints(*pr) for pr in legacy_pairs], rounds) / len(legacy_pairs)
+    scalar = timeit(lambda: [circles_cpoints(*pr) for pr in pairs], rounds) / len(pairs)
+    print 'circles cross points of %d circle pairs, %d errors:' % (len(pairs), len(errors))
+    for e in errors[:5]:
+        print '  ERROR: %s: %s' % (e[0], e[1:])
+    print '  legacy:         %8.3fus per pair(%d pairs failed, vertically aligned ones not tried)' % \
+        (legacy * 1e6, legacy_failed)
+    print '  closed-form:    %8.3fus per pair' % (scalar * 1e6)
+
+    if np:
+        c1, r1, c2, r2, comp = [np.array(col) for col in zip(*pairs)]
+        codes, points = circles_cpoints_batch(c1, r1, c2, r2)
+        ccodes, cpoints = circles_cpoints_batch(c1, r1, c2, r2, compensate=True)
+        codes[comp], points[comp] = ccodes[comp], cpoints[comp]
+        mismatch = 0
+        for i, (pc1, pr1, pc2, pr2, pcomp) in enumerate(pairs):
+            code, pts = circles_cpoints(pc1, pr1, pc2, pr2, compensate=pcomp)
+            if code != codes[i] or (pts and abs(np.array(pts) - points[i][:len(pts)]).max() > 1e-6 * (pr1 + pr2)):
+                mismatch += 1
+        batch = timeit(lambda: circles_cpoints_batch(c1, r1, c2, r2), rounds) / len(pairs)
+        print '  batch:          %8.3fus per pair(%d differ from closed-form)' % (batch * 1e6, mismatch)
+
+
+# find_ap_at_xy() before the circles are indexed, for comparison
+def legacy_find_ap_at_xy(x, y):
+    for ap in acspmon.FLEET.aps:
+        if len(ap.radios) == 0:
+            continue
+        elif len(ap.radios) == 1:
+            rd = ap.radios[IFNAME_WIFI0]
+        else:
+            if ap.radios[IFNAME_WIFI0].r > ap.radios[IFNAME_WIFI1].r and ap.radios[IFNAME_WIFI1].r:
+                rd = ap.radios[IFNAME_WIFI1]
+            else:
+                rd = ap.radios[IFNAME_WIFI0]
+        if sqrt((x - rd.c[0])**2 + (y - rd.c[1])**2) < rd.r:
+            return ap
+    return None
+
+def bench_hit(num, rounds):
+    acspmon.CANVAS_FREEZE = True    # circles are indexed, but not drawn
+    acspmon.CANVAS_GRID = acspmon.CircleGrid()
+    aps = synth_fleet(num)
+    w, h = acspmon.CANVAS_WIDTH * 2, acspmon.CANVAS_HEIGHT * 2
+    for ap in aps:
+        c = [random.uniform(0, w), random.uniform(0, h)]
+        for rd in ap.radios.values():
+            rd.draw(c, random.randint(10, 120))
+    points = [(random.uniform(0, w), random.uniform(0, h)) for i in range(num * 10)]
+
+    # the AP found must own the smallest circle under the point
+    radios = [rd for ap in aps for rd in ap.radios.values()]
+    errors = 0
+    for x, y in points[:1000]:
+        under = [rd for rd in radios if (x - rd.c[0])**2 + (y - rd.c[1])**2 < rd.r**2]
+        ap = find_ap_at_xy(x, y)
+        if (ap and min(under, key=lambda rd: rd.r).ap is not ap) or (not ap and under):
+            errors += 1
+
+    legacy = timeit(lambda: [legacy_find_ap_at_xy(x, y) for x, y in points], rounds) / len(points)
+    grid = timeit(lambda: [find_ap_at_xy(x, y) for x, y in points], rounds) / len(points)
+    rect = timeit(lambda: [acspmon.CANVAS_GRID.query_rect(x, y, x + 100, y + 100) for x, y in points], 
+                  rounds) / len(points)
+    print 'hit-testing %d circles, %d errors:' % (len(acspmon.CANVAS_GRID), errors)
+    print '  legacy scan:    %8.2fus per click' % (legacy * 1e6)
+    print '  grid index:     %8.2fus per click' % (grid * 1e6)
+    print '  grid rect:      %8.2fus per 100x100 rectangle' % (rect * 1e6)
+
+
+# Tk canvas stand-in which only counts the item operations
+class CountingCanvas(object):
+    def __init__(self):
+        self.ops = 0
+        self.items = 0
+        self.opts = {}              # key: item id, value: options as Tk would keep them
+
+    def create(self, *args, **kw):
+        self.ops += 1
+        self.items += 1
+        self.itemconfig(self.items, **kw)
+        return self.items
+    create_oval = create_text = create
+
+    # Tkinter drops the None options, the item keeps its old value of them
+    def itemconfig(self, item, **kw):
+        self.ops += 1
+        self.opts.setdefault(item, {}).update((k, v) for k, v in kw.items() if v is not None)
+
+    def op(self, *args, **kw):
+        self.ops += 1
+    delete = coords = tag_raise = op
+
+# An inactive circle is drawn dashed, it must turn solid again once it's active
+def check_render_dash():
+    acspmon.CANVAS, acspmon.RENDERER = CountingCanvas(), acspmon.CanvasRenderer()
+    circle = acspmon.GUICircle()
+    for active in (False, True):
+        circle.draw([100, 100], 50, color='green', text='test', text_loc=circle.UP, 
+                    text_color='red', active=active)
+        acspmon.RENDERER.flush()
+    oval, text = acspmon.CANVAS.opts[circle.oval_id], acspmon.CANVAS.opts[circle.text_id]
+    assert not oval.get('dash'), 'active circle still dashed: %s' % oval
+    assert text['fill'] == 'red', 'active circle text color not restored: %s' % text
+
+# How a radio was redrawn after each poll before the renderer: all its canvas
+# items deleted and created again, texts configured once more
+def legacy_redraw(rd, canvas, items):
+    for item in items.pop(rd, ()):
+        canvas.delete(item)
+    new = [canvas.create_oval(rd.xy0[0], rd.xy0[1], rd.xy1[0], rd.xy1[1], 
+                width=rd.width, fill=rd.color, stipple=rd.stipple)]
+    for xy, text in ((rd.text_xy, rd.text), (rd.c, rd.cname)):
+        if text:
+            item = canvas.create_text(xy, text=text, font=('arial', 7))
+            canvas.coords(item, xy[0], xy[1])
+            canvas.itemconfig(item, text=text, font=('arial', 7))
+            new.append(item)
+    items[rd] = new
+
+# Poll all APs once, the radios of 'changes' percent of them change tx power,
+# and show them as Radio.update_radio_stats does
+def synth_poll(aps, changes):
+    for ap in aps:
+        if random.random() * 100 < changes:
+            ap.radios[IFNAME_WIFI0].txpwr = random.randint(10, 20)
+        rd0, rd1 = ap.radios[IFNAME_WIFI0], ap.radios[IFNAME_WIFI1]
+        apname = ap.name + '/' + ap.mac
+        if rd0.r > rd1.r:
+            rd0.show(rd0.c)
+            rd1.show(rd0.c, apname=apname)
+        else:
+            rd1.show(rd0.c)
+            rd0.show(rd0.c, apname=apname)
+
+def bench_render(num, rounds, changes=5):
+    acspmon.CANVAS_FREEZE = False
+    acspmon.CANVAS_GRID = acspmon.CircleGrid()
+    check_render_dash()
+    aps = synth_fleet(num)
+    for ap in aps:
+        ap.active = True
+        c = [random.uniform(0, acspmon.CANVAS_WIDTH), random.uniform(0, acspmon.CANVAS_HEIGHT)]
+        for rd in ap.radios.values():
+            rd.c = c
+            rd.chnl_state = rd.pwr_state = acspmon.ACSP.CHNL_STATE_RUN
+            rd.phymode = '11ng' if rd.name == IFNAME_WIFI0 else '11ac'
+    # each poll round(an AP poll interval) spans this num of frames
+    frames = max(1, int(acspmon.GUI_FRAME_RATE * acspmon.AP_POLL_INTERVAL))
+    radios = [rd for ap in aps for rd in ap.radios.values()]
+
+    legacy_canvas, items = CountingCanvas(), {}
+    def legacy():
+        synth_poll(aps, changes)
+        for rd in radios:
+            legacy_redraw(rd, legacy_canvas, items)
+    acspmon.CANVAS = CountingCanvas()
+    def rendered():
+        synth_poll(aps, changes)
+        for i in range(frames):
+            acspmon.RENDERER.flush()
+
+    # the initial drawing creates all items, the AP name moves to the smaller radio in the 2nd
+    rendered()
+    rendered()
+    acspmon.CANVAS.ops = 0
+    acspmon.RENDERER = acspmon.CanvasRenderer()     # the canvas items are kept by the circles
+    render_time = timeit(rendered, rounds)
+    render_ops, r = acspmon.CANVAS.ops, acspmon.RENDERER
+    acspmon.RENDERER = acspmon.CanvasRenderer()
+    legacy_time = timeit(legacy, rounds)
+    print 'redrawing %d APs after each poll, %d%% of them changed, %d frames per poll round:' % \
+        (num, changes, frames)
+    print '  legacy erase/show: %8.2fms per round, %6.2f canvas ops per AP poll' % \
+        (legacy_time * 1e3, legacy_canvas.ops / float(num * rounds))
+    print '  renderer:          %8.2fms per round, %6.2f canvas ops per AP poll' % \
+        (render_time * 1e3, render_ops / float(num * rounds))
+    print '  renderer queue:    %d states posted, %d coalesced, depth max %d, drain %.2fms per frame' % \
+        (r.posts, r.coalesced, r.depth_max, r.drain_time * 1e3 / r.frames)
+
+
+# Record 'samples' samples of the fleet, the nbr rssi of each is the average of
+# the last RF_SMOOTH_WINDOW polls, each with 'noise' dB of noise, as the pollers
+# smooth it, and 'changes' permille of the radios change tx power per sample
+def bench_record(num, rounds, samples=720, noise=2.0, changes=1):
+    if not np:
+        print 'record: numpy is not installed, skipped'
+        return
+    import tempfile, os
+    aps = synth_fleet(num)
+    synth_links(aps)
+    radios = [rd for ap in aps for rd in ap.radios.values()]
+    for ap in aps:
+        ap.active = True
+    links = [nbr for rd in radios for nbr in rd.nbrs.values()]
+    base = np.array([nbr.rssi for nbr in links], float)
+    window = acspmon.RF_SMOOTH_WINDOW
+
+    path = tempfile.mktemp(suffix='.acsprec')
+    recorder = acspmon.ACSPRecorder(path)
+    t = time.time()
+    for i in range(samples):
+        rssi = base + np.random.normal(0, noise / sqrt(window), len(base))
+        for nbr, r in zip(links, rssi.round().astype(int).tolist()):
+            nbr.rssi = r
+        for rd in random.sample(radios, len(radios) * changes // 1000):
+            rd.txpwr = random.randint(10, 20)
+        recorder.record(radios, t + i * recorder.interval)
+    recorder.close()
+    size = os.path.getsize(path)
+    hours = samples * recorder.interval / 3600.0
+
+    # replay it all, the radio states must be the last ones recorded, and the
+    # same after seeking to the middle
+    reader = acspmon.ACSPRecordReader(path)
+    replay = timeit(lambda: [x for x in reader.samples()], 1)
+    errors = 0
+    for rd in radios:
+        state = reader.states[rd.mac]
+        if state['txpwr'] != rd.txpwr or state['chnl'] != rd.chnl or \
+                set(state['nbrs']) != set(n.radio.mac for n in rd.nbrs.values()) or \
+                max(abs(state['nbrs'][mac] - int(round(v))) for mac, v in recorder.rssi[rd.mac].items()) \
+                    >= recorder.deadband:
+            errors += 1
+    final = dict((mac, dict(st)) for mac, st in reader.states.items())
+    reader.seek(t + samples * recorder.interval / 2)
+    seeked = [x[0] for x in reader.samples()]
+    if final != reader.states:
+        errors += 1
+    reader.close()
+    os.remove(path)
+    os.remove(path + '.idx')
+
+    print 'recording %d radios, %d nbr links, %d samples(%.1f hours) every %.0fs, keyframe every %ds:' % \
+        (len(radios), len(links), samples, hours, recorder.interval, recorder.keyframe_interval)
+    print '  size:      %8.1fKB per hour, %.1fMB per 24 hours, %.1f bytes per sample per radio' % \
+        (size / 1024.0 / hours, size * 24 / hours / 1024 / 1024, float(size) / samples / len(radios))
+    print '  recording: %8.2fms per sample, by the recorder thread' % (recorder.busy * 1e3 / samples)
+    print '  replaying: %8.2fms per sample, seek to the middle replays %d samples, %d errors' % \
+        (replay * 1e3 / samples, len(seeked), errors)
+
+
+# Record a synthetic ACSP convergence run of 'num' APs, 'samples' samples long:
+# all radios start in Init state, go through Scanning and Listening, and end up
+# in Enable state with a random channel and tx power, each at a random time in
+# the first half of the run. Nbr rssi has noise as in bench_record()
+def synth_recording(path, num, samples, noise=2.0):
+    aps = synth_fleet(num)
+    synth_links(aps)
+    radios = [rd for ap in aps for rd in ap.radios.values()]
+    chnls = {IFNAME_WIFI0: [1, 6, 11], IFNAME_WIFI1: [36, 44, 52, 60, 149, 157, 165]}
+    run_at = {}
+    for ap in aps:
+        ap.active = True
+        for rd in ap.radios.values():
+            rd.phymode = '11ng' if rd.name == IFNAME_WIFI0 else '11ac'
+            rd.nfloor = -95
+            run_at[rd] = random.randint(3, max(3, samples // 2))
+    links = [nbr for rd in radios for nbr in rd.nbrs.values()]
+    base = np.array([nbr.rssi for nbr in links], float)
+    states = [acspmon.ACSP.CHNL_STATE_INIT, acspmon.ACSP.CHNL_STATE_SCAN, acspmon.ACSP.CHNL_STATE_LISTEN]
+
+    recorder = acspmon.ACSPRecorder(path)
+    t = time.time()
+    for i in range(samples):
+        rssi = base + np.random.normal(0, noise / sqrt(acspmon.RF_SMOOTH_WINDOW), len(base))
+        for nbr, r in zip(links, rssi.round().astype(int).tolist()):
+            nbr.rssi = r
+        for rd in radios:
+            if i < run_at[rd]:
+                rd.chnl_state = rd.pwr_state = states[i * len(states) // run_at[rd]]
+            elif i == run_at[rd]:
+                rd.chnl_state = rd.pwr_state = acspmon.ACSP.CHNL_STATE_RUN
+                rd.chnl = random.choice(chnls[rd.name])
+                rd.txpwr = random.randint(10, 20)
+        recorder.record(radios, t + i * recorder.interval)
+    recorder.close()
+
+    # the replay sets up its own APs
+    acspmon.APS.clear()
+    acspmon.RADIOS.clear()
+    acspmon.publish_fleet()
+
+# Replay a synthetic convergence run as fast as possible, the GUI is rendered
+# after each sample, to see how many times of real time could be kept up with
+def bench_replay(num, rounds, samples=120, output=None):
+    if not np:
+        print 'replay: numpy is not installed, skipped'
+        return
+    import tempfile, os
+    path = output or tempfile.mktemp(suffix='.acsprec')
+    synth_recording(path, num, samples)
+
+    acspmon.CANVAS_FREEZE = False
+    acspmon.CANVAS_GRID = acspmon.CircleGrid()
+    acspmon.RENDERER = acspmon.CanvasRenderer()
+    acspmon.CANVAS = CountingCanvas()
+    replay = acspmon.ACSPReplay(path, speed=0)
+    reader = replay.reader
+    feed = render = 0.0
+    for t, macs in reader.samples():
+        start = time.time()
+        replay.feed(t, macs)
+        feed += time.time() - start
+        start = time.time()
+        acspmon.RENDERER.flush()
+        render += time.time() - start
+    coord = None
+    aps = [ap for ap in acspmon.FLEET.aps if ap.radios]
+    if aps:
+        coord = timeit(lambda: calc_ap_coord_lsq(aps), 1)
+    reader.close()
+    if not output:
+        os.remove(path)
+        os.remove(path + '.idx')
+
+    interval = acspmon.RECORD_INTERVAL
+    print 'replaying %d APs, %d samples every %.0fs, as fast as possible:' % (len(aps), samples, interval)
+    print '  feeding:   %8.2fms per sample' % (feed * 1e3 / samples)
+    print '  rendering: %8.2fms per sample, %d canvas ops' % (render * 1e3 / samples, acspmon.CANVAS.ops)
+    print '  lsq coord: %8.2fms per calculation of all APs' % (coord * 1e3)
+    print '  could keep up with %.0f times of real time' % (interval / ((feed + render) / samples))
+    if output:
+        print '  recording kept in %s, replay it with: ./acspmon.py --replay %s' % (output, output)
+
+
+# AP whose SSH transaction takes 'latency' seconds, 'fails' percent of them
+# reject the CLIs
+class SlowAP(AP):
+    def __init__(self, ip, latency, fail):
+        AP.__init__(self, ip)
+        self.latency = latency
+        self.fail = fail
+
+    def ssh_cmd(self, cmd, delay=acspmon.SSH_CMD_DELAY_DEFAULT):
+        time.sleep(self.latency)
+        out = '        ^-- unknown keyword or invalid input\n' if self.fail else ''
+        return cmd + out + 'AH-000010#'
+
+# How the menu sent CLIs to all APs before the CLI job engine: one by one, by
+# the GUI thread
+def legacy_cli_cmd(clis, aps):
+    for ap in aps:
+        for cli in clis:
+            ap.ssh_cmd(cli+'\n')
+
+def bench_cli(num, rounds, latency=0.3, fails=1):
+    log, acspmon.LOG = acspmon.LOG, lambda level, fmt, *args: None
+    aps = [SlowAP('10.0.%d.%d' % (i >> 8, i & 255), latency, i % 100 >= 100 - fails) for i in range(num)]
+    clis = ['interface wifi0 radio channel auto']
+    engine = acspmon.CLIJobEngine()
+
+    legacy = timeit(lambda: legacy_cli_cmd(clis, aps[:20]), 1) * num / 20
+    submit = timeit(lambda: engine.submit(clis, aps), 1)
+    job = engine.history[-1]
+    while not job.end:
+        time.sleep(0.01)
+    waves = engine.submit(clis, aps, wave=num // 10)
+    while not waves.end:
+        time.sleep(0.01)
+    acspmon.LOG = log
+    print 'sending %d CLIs to %d APs, %.1fs per SSH transaction, %d%% of APs reject it:' % \
+        (len(clis), num, latency, fails)
+    print '  legacy:         %8.1fs, the GUI thread is blocked all the time(extrapolated from 20 APs)' % legacy
+    print '  job engine:     %8.1fs by %d workers, the GUI thread is blocked %.2fms, %d failed' % \
+        (job.end - job.start, engine.workers, submit * 1e3, len(job.failed()))
+    print '  in waves:       %8.1fs, %d APs per wave, %d failed, %d skipped' % \
+        (waves.end - waves.start, waves.wave, len(waves.failed()), len(waves.skipped))
+
+
+# Probe a loopback range of 'num' * 8 addresses by TCP connect, none of which
+# has SSH service, to see how the probes back off. The full rescans every
+# NEW_NODE_DETECT_INTERVAL before, probed all addresses every 6 seconds(incl.
+# the probe timeout) forever
+def bench_discovery(num, rounds, window=2.0):
+    monitor_node = acspmon.monitor_node
+    acspmon.monitor_node = lambda ip: None
+    acspmon.SSH_PORT = 1    # tcpmux, rarely listened on
+    start_ip = acspmon.struct.unpack('!I', acspmon.inet_aton('127.2.0.1'))[0]
+    addrs = [acspmon.inet_ntoa(acspmon.struct.pack('!I', ip)) for ip in range(start_ip, start_ip + num * 8)]
+    d = acspmon.NodeDiscovery(addrs, 'connect')
+    start, cpu0 = time.time(), os.times()
+    d.start()
+    print 'discovering %d addresses by TCP connect, %d probes per second at most:' % \
+        (len(addrs), acspmon.DISCOVERY_RATE)
+    for i in range(rounds):
+        probes = d.probes
+        time.sleep(window * 2 ** i)
+        cpu = os.times()
+        print '  %6.0fs: %8.1f probes per second, %5.1f%% cpu' % (time.time() - start, 
+            (d.probes - probes) / (window * 2 ** i), (cpu[0] + cpu[1] - cpu0[0] - cpu0[1]) / (window * 2 ** i) * 100)
+        cpu0 = cpu
+    print '  full rescans: %8.1f probes per second' % (len(addrs) / 6.0)
+    acspmon.monitor_node = monitor_node
+
+
+# Keep 'num'(at most 8, twice the poll engine workers) dead APs, which accept
+# TCP connections but never answer SSH(e.g. rebooting), in the event loop poll
+# engine for 'rounds' times of 'window' seconds. Count the reconnects and the
+# worker time they cost in each round, by reconnecting every poll as before,
+# and with backoff
+def bench_reconnect(num, rounds, window=4.0):
+    import logging
+    logging.getLogger('paramiko').addHandler(logging.NullHandler())
+    log, acspmon.LOG = acspmon.LOG, lambda level, fmt, *args: None
+    num = min(num, 8)
+    socks = [socket.socket() for i in range(num)]
+    socks[0].bind(('127.3.0.1', 0))
+    port = socks[0].getsockname()[1]
+    for i, sock in enumerate(socks):
+        if i:
+            sock.bind(('127.3.0.%d' % (i + 1), port))
+        sock.listen(128)
+    acspmon.SSH_PORT = port
+    acspmon.SSH_LOST_TIMEOUT = 0.5
+
+    opens = [0, 0.0]
+    ssh_open = SSHNode.ssh_open
+    def timed_ssh_open(node):
+        start = time.time()
+        try:
+            return ssh_open(node)
+        finally:
+            opens[0] += 1
+            opens[1] += time.time() - start
+    SSHNode.ssh_open = timed_ssh_open
+
+    backoff = acspmon.SSH_RECONNECT_BACKOFF
+    results = []
+    for acspmon.SSH_RECONNECT_BACKOFF in (0, backoff):
+        engine = acspmon.PollEngine()
+        engine.start()
+        aps = [AP('127.3.0.%d' % (i + 1)) for i in range(num)]
+        for ap in aps:
+            ap.active = True    # were polled before
+            engine.new_sessions.put(acspmon.PollSession(ap))
+        rows = []
+        for i in range(rounds):
+            opens[:] = [0, 0.0]
+            time.sleep(window)
+            rows.append((opens[0], opens[1] / (engine.workers * window)))
+        engine.sessions = []    # stop polling them
+        states = {}
+        for ap in aps:
+            states[ap.state] = states.get(ap.state, 0) + 1
+        results.append((rows, ', '.join('%d %s' % (states[st], st) for st in sorted(states.keys()))))
+        time.sleep(acspmon.SSH_LOST_TIMEOUT * 2)    # in-flight reconnects
+    SSHNode.ssh_open = ssh_open
+    acspmon.SSH_RECONNECT_BACKOFF = backoff
+    acspmon.LOG = log
+    for sock in socks:
+        sock.close()
+
+    print '%d dead APs in the event loop poll engine of %d workers, reconnect attempts and worker busy:' % \
+        (num, acspmon.POLL_ENGINE_WORKERS)
+    print '  %6s %21s %21s' % ('', 'every poll', 'backoff')
+    for i in range(rounds):
+        print '  %5.0fs %14d %5.0f%% %14d %5.0f%%' % ((i + 1) * window, results[0][0][i][0], 
+            results[0][0][i][1] * 100, results[1][0][i][0], results[1][0][i][1] * 100)
+    print '  states: %s / %s' % (results[0][1], results[1][1])
+
+
+# Poll a fleet of 'num' simulated APs(see hivesim.py) at 'port' for 'rounds'
+# times of 'window' seconds, by the 'engine' poll engine of acspmon. Run in a
+# child process of bench_fleet(), so the CPU and memory are of this fleet size
+# only. Print the result as a JSON line
+def fleet_child(num, rounds, port, engine, window=2.0):
+    import hivesim
+    hivesim.raise_nofile_limit()
+    acspmon.SSH_PORT = port
+    acspmon.HEADLESS = True
+    if engine == 'event':
+        acspmon.POLL_ENGINE = acspmon.PollEngine()
+        acspmon.POLL_ENGINE.start()
+
+    # times each AP's poll cycles end, by both poll engines
+    polled = dict((ip, []) for ip in hivesim.sim_ips(num))
+    update_radios = AP.update_radios
+    def timed_update_radios(ap, batch):
+        update_radios(ap, batch)
+        polled[ap.ip].append(time.time())
+    AP.update_radios = timed_update_radios
+
+    start = time.time()
+    for ip in hivesim.sim_ips(num):
+        acspmon.monitor_node(ip)
+    # wait until all APs are set up, and polled once
+    while [1 for times in polled.values() if not times] and time.time() - start < 30 + num:
+        time.sleep(0.1)
+    setup = time.time() - start
+
+    cpu0, start = os.times(), time.time()
+    time.sleep(rounds * window)
+    cpu1, elapsed = os.times(), time.time() - start
+    periods = []
+    for times in polled.values():
+        # from the last poll cycle before the window to the last one in it
+        before = [t for t in times if t < start][-1:]
+        times = before + [t for t in times if t >= start]
+        if len(times) >= 2:
+            periods.append((times[-1] - times[0]) / (len(times) - 1))
+    periods.sort()
+    print 'FLEET ' + json.dumps({
+        'aps': len(acspmon.FLEET.aps), 'setup': setup, 'periods': periods, 'stalled': num - len(periods),
+        'cpu': (cpu1[0] + cpu1[1] - cpu0[0] - cpu0[1]) / elapsed,
+        'rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+        'threads': threading.active_count()})
+    sys.stdout.flush()
+    os._exit(0)     # AP threads are blocked in SSH I/O
+
+# End-to-end benchmark: acspmon polls a simulated AP fleet over SSH, growing
+# through 'sizes' up to 'num' APs. Reported per fleet size: the refresh period of
+# an AP(seconds between 2 poll cycles), the CPU and peak memory of acspmon, and
+# the CPU of the simulator, which should not be saturated to trust the periods
+def bench_fleet(num, rounds, engine='thread', latency=None, sizes=(10, 30, 100, 300, 1000)):
+    here = os.path.dirname(os.path.abspath(__file__))
+    sizes = [n for n in sizes if n < num] + [num]
+    print 'polling simulated AP fleets by %s poll engine, %d rounds of 2s each:' % (engine, rounds)
+    print '  %5s %7s %21s %7s %6s %8s %7s %8s' % \
+        ('APs', 'setup', 'period avg/p95/max', 'stalled', 'cpu', 'rss', 'threads', 'sim cpu')
+    for n in sizes:
+        # a free port for the simulator
+        sock = socket.socket()
+        sock.bind(('', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+
+        cmd = [sys.executable, os.path.join(here, 'hivesim.py'), '-n', str(n), '-p', str(port)]
+        if latency:
+            cmd += ['-l', latency]
+        sim = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+        sim.stdout.readline()   # ready
+        child = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--fleet_child', str(n),
+            '-r', str(rounds), '-p', str(port), '-e', engine], stdout=subprocess.PIPE)
+        start = time.time()
+        out = child.communicate()[0]
+        elapsed = time.time() - start
+        ru0 = resource.getrusage(resource.RUSAGE_CHILDREN)
+        sim.terminate()
+        sim.wait()
+        ru1 = resource.getrusage(resource.RUSAGE_CHILDREN)
+        sim_cpu = (ru1.ru_utime + ru1.ru_stime - ru0.ru_utime - ru0.ru_stime) / elapsed
+
+        lines = [l for l in out.split('\n') if l.startswith('FLEET ')]
+        if not lines:
+            print '  %5d ERROR: acspmon exited with no result' % n
+            continue
+        r = json.loads(lines[-1][len('FLEET '):])
+        p = r['periods'] or [float('nan')]
+        print '  %5d %6.1fs %6.2f/%6.2f/%6.2fs %7d %5.0f%% %6.1fMB %7d %7.0f%%' % \
+            (n, r['setup'], sum(p) / len(p), p[int(len(p) * 0.95)], p[-1], r['stalled'],
+             r['cpu'] * 100, r['rss'], r['threads'], sim_cpu * 100)
+
+
+BENCHMARKS = {
+    'nbr': bench_nbr,
+    'lsq': bench_lsq,
+    'cpoints': bench_cpoints,
+    'hit': bench_hit,
+    'render': bench_render,
+    'record': bench_record,
+    'replay': bench_replay,
+    'fleet': bench_fleet,
+    'cli': bench_cli,
+    'discovery': bench_discovery,
+    'reconnect': bench_reconnect,
+    'perf': bench_perf,
+    'profile': bench_profile,
+    'links': bench_links,
+    'log': bench_log,
+}
+
+# Main entry
+if __name__ == '__main__':
+    p = optparse.OptionParser(description='Benchmarks of acspmon hot paths on synthetic AP fleets')
+    p.add_option('-b', '--bench', action='append', type='choice', dest='benches',
+        choices=sorted(BENCHMARKS.keys()),
+        help='Benchmark to run, could be given multiple times(default: all), ' +
+             'supported are: ' + ', '.join(sorted(BENCHMARKS.keys())))
+    p.add_option('-e', '--poll_engine', action='store', type='choice', dest='poll_engine',
+        choices=['thread', 'event'], default='thread',
+        help='Set how acspmon polls APs in the "fleet" benchmark, see acspmon -l(default: thread)')
+    p.add_option('-l', '--latency', action='store', type='string', dest='latency', default=None,
+        help='Set seconds a simulated AP takes to run a CLI in the "fleet" benchmark, see hivesim -l')
+    p.add_option('-n', '--num_aps', action='store', type='int', dest='num_aps', default=500,
+        help='Set the num of APs of the synthetic fleet(default: 500)')
+    p.add_option('-o', '--output', action='store', type='string', dest='output', default=None,
+        help='Keep the synthetic recording of the "replay" benchmark in the file, to be replayed by acspmon')
+    p.add_option('-p', '--port', action='store', type='int', dest='port', default=None,
+        help=optparse.SUPPRESS_HELP)
+    p.add_option('-r', '--rounds', action='store', type='int', dest='rounds', default=5,
+        help='Set how many rounds each benchmark runs, the average is reported(default: 5)')
+    p.add_option('--fleet_child', action='store', type='int', dest='fleet_child', default=None,
+        help=optparse.SUPPRESS_HELP)
+    opts, args = p.parse_args()
+
+    if opts.fleet_child:
+        fleet_child(opts.fleet_child, opts.rounds, opts.port, opts.poll_engine)
+
+    # the 'fleet' benchmark takes minutes to set up 1000 APs, only run it on demand
+    for name in opts.benches or sorted(set(BENCHMARKS.keys()) - set(['fleet'])):
+        if name == 'fleet':
+            bench_fleet(opts.num_aps, opts.rounds, opts.poll_engine, opts.latency)
+        elif name == 'replay':
+            bench_replay(opts.num_aps, opts.rounds, output=opts.output)
+        else:
+            BENCHMARKS[name](opts.num_aps, opts.rounds)
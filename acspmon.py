@@ -2,7 +2,7 @@
 #
 # Aerohive AP ACSP monitor, show ACSP process graphically in real-time
 # Note:
-#   (1) Need to run the tool as root user(e.g. sudo ...)
+#   (1) Run the tool as root user(e.g. sudo ...) to probe APs by TCP SYN, otherwise TCP connect is used
 #   (2) All APs to be monitored should be connected to the same subnet
 #   (3) By default, all APs should use the same username('admin') and password('aerohive')
 #   (4) Assume the IP address of an AP doens't change, this is normally true if using DHCP
@@ -14,26 +14,116 @@
 #
 
 
-import os, sys, optparse, signal, time, threading, re
-import paramiko, tkMessageBox, tkSimpleDialog, functools
-from signal import signal, SIGINT
-from socket import inet_aton
-from scapy.all import sr, IP, TCP
-from random import randint
+import os, sys, optparse, signal, time, threading, re, socket, select, Queue, collections, weakref
+import paramiko, functools, json, struct, mmap, bisect, heapq, errno, atexit
+from signal import signal, SIGINT, SIGUSR1
+from socket import inet_aton, inet_ntoa
+from random import randint, uniform
 from math import *
-from Tkinter import *
 from datetime import datetime
+from array import array
+try:
+    import numpy as np
+except ImportError:
+    np = None                   # only needed by the 'lsq' coord method
+try:
+    from scapy.all import sr, IP, TCP
+except ImportError:
+    sr = None                   # only needed by the 'syn' node probe
+
+
+
+# threading.Lock with contention instrumentation: how long threads wait to get
+# it and how long it's held, see lock_stats_report(). The stats are updated
+# only by the lock holder, thus need no extra lock
+class StatLock(object):
+    all_locks = weakref.WeakSet()   # all instances alive, for reporting
+
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.acquired_at = 0
+        self.stats = [0, 0.0, 0.0, 0.0, 0.0]    # count, wait total/max, hold total/max
+        StatLock.all_locks.add(self)
+
+    def acquire(self, blocking=True):
+        start = time.time()
+        if not self.lock.acquire(blocking):
+            return False
+        self.acquired_at = time.time()
+        wait = self.acquired_at - start
+        self.stats[0] += 1
+        self.stats[1] += wait
+        self.stats[2] = max(self.stats[2], wait)
+        if PERF.enabled:
+            PERF.add('lock wait ' + self.name, wait)
+        return True
+
+    def release(self):
+        hold = time.time() - self.acquired_at
+        self.stats[3] += hold
+        self.stats[4] = max(self.stats[4], hold)
+        if PERF.enabled:
+            PERF.add('lock hold ' + self.name, hold)
+        self.lock.release()
+
+    def locked(self):
+        return self.lock.locked()
+
+# Immutable, versioned view of all detected APs and their radios. Writers(under
+# APS_LOCK) build a new one whenever an AP or radio is added, i.e. copy-on-write,
+# and publish it by one reference assignment. Readers just take the latest FLEET
+# and iterate it without any lock, thus never block the pollers or each other.
+# The nbr links of a radio are published the same way, see update_acsp_nbrs()
+class FleetSnapshot(object):
+    def __init__(self, version=0, aps=(), radios=()):
+        self.version = version
+        self.aps = aps          # tuple of AP instances
+        self.radios = radios    # tuple of Radio instances of all APs
+
+    def __len__(self):
+        return len(self.aps)
 
 
 
 # Tunable constants
 DEBUG_ENABLE = False
+LOG_FLUSH_INTERVAL = 0.1        # interval(seconds) between 2 writes of the queued log messages
+LOG_QUEUE_MAX = 10000           # max num of log messages queued, more are dropped(counted)
+LOG_MAX_LEN = 4096              # max length of a message on the console, longer ones(e.g. CLI outputs) are cut
+LOG_RATE_BURST = 5              # max num of repeats of a message of an AP per LOG_RATE_INTERVAL, more are suppressed
+LOG_RATE_INTERVAL = 60          # interval(seconds) repeats of a message are counted in
+LOG_FILE_MAX = 10 * 1024 * 1024 # size(bytes) at which the log file is rotated
+LOG_FILE_BACKUPS = 3            # num of rotated log files kept(FILE.1, FILE.2...)
+SSH_PORT = 22                   # SSH port of all nodes, e.g. another one of a simulated AP fleet
 SSH_LOST_TIMEOUT = 3            # max timeout, SSH lost(e.g. node rebooted, power off)
 SSH_NODE_PROBE_TIMEOUT = 3
-NEW_NODE_DETECT_INTERVAL = 3
+SSH_KEEPALIVE_INTERVAL = 5      # interval(seconds) of keepalives on an idle SSH transport, 0 to disable
+SSH_RECONNECT_BACKOFF = 1       # interval to reconnect a lost SSH session, doubled per failed reconnect
+SSH_RECONNECT_MAX_BACKOFF = 60  # max interval to reconnect a lost SSH session
+SSH_DOWN_FAILS = 3              # num of consecutive SSH failures after which a node is considered down
+NEW_NODE_DETECT_INTERVAL = 3    # interval to probe a node again after it doesn't answer the 1st time
 SSH_CMD_DELAY_DEFAULT = 0.5
 SSH_CMD_DELAY_EXTRA = 0.0
-SSH_CMD_BUF_LEN = 98304         # 96KB, since 'show acsp _nbr' could be > 75KB
+SSH_RECV_CHUNK_LEN = 8192       # SSH output is read in chunks of this size until complete
+SSH_CMD_READ_MODE = 'prompt'    # 'prompt': read until shell prompt back, 'delay': fixed delay then read
+SSH_CMD_TIMEOUT = 10            # overall deadline of a command transaction in 'prompt' read mode
+SSH_PROMPT_TAIL_LEN = 128       # how many trailing output chars are searched for the shell prompt
+AP_POLL_INTERVAL = 0.5          # interval between 2 poll cycles of an AP
+
+POLL_ENGINE = None              # PollEngine instance if APs are polled by event loop, or thread per AP
+POLL_ENGINE_WORKERS = 4         # num of threads doing blocking SSH setup for the event loop
+POLL_ENGINE_TICK = 0.1          # max time the event loop waits for SSH output
+SCHED_MAX_HANDSHAKES = 8        # max num of concurrent SSH handshakes(connection setup)
+SCHED_MAX_INFLIGHT = 64         # max num of concurrent in-flight SSH cmd transactions
+DISCOVERY_PROBE = 'auto'        # how nodes are probed, 'syn': TCP SYN by scapy(root), 'connect': TCP connect
+DISCOVERY_RATE = 200            # max num of node probes sent per second
+DISCOVERY_INFLIGHT = 256        # max num of node probes waiting for answer
+DISCOVERY_MAX_BACKOFF = 300     # max interval to probe a node again, which doesn't answer or isn't an AP
+DISCOVERY_MAX_ADDRS = 65536     # max num of addresses probed, e.g. of a /16 subnet
+CLI_JOB_WORKERS = 16            # num of threads sending bulk CLIs to APs in parallel
+CLI_JOB_RATE = 0                # max num of APs per second bulk CLIs are started on, 0 for no limit
+CLI_JOB_WAVE = 0                # num of APs per wave of bulk CLIs, 0 for all APs in one wave
 
 HIVEAP_USERNAME = 'admin'
 HIVEAP_PASSWORD = 'aerohive'
@@ -42,14 +132,22 @@ IFNAME_WIFI1 = 'wifi1'
 
 # All nodes found in the subnet, could be AP or non-AP
 NODES = {}                      # indexed by IP
-NODES_LOCK = threading.Lock()   # lock to protect the global node list
+NODES_LOCK = StatLock('NODES_LOCK')     # lock to protect the global node list
 
 # All detected APs in the subnet, could be active or inactive(e.g. powered off)
 APS = {}                        # indexed by IP
-APS_LOCK = threading.Lock()     # lock to protect the global AP list
+APS_LOCK = StatLock('APS_LOCK') # lock to serialize writers of the global AP list
+RADIOS = {}                     # radios of all APs, indexed by BSSID prefix(mac[:-1]), written by APS_LOCK
+FLEET = FleetSnapshot()         # latest snapshot of APS, readers use it instead of APS_LOCK
 
-APS_COORD_METHOD = 'auto'       # AP coordinates calculation method, could be auto/manual/random
+APS_COORD_METHOD = 'auto'       # AP coordinates calculation method, could be auto/lsq/manual/random
 APS_COORD_NBRSCORE_ORDER = False    # Calculate APs coordinates in the order of nbr their scores
+COORD_RSSI_THRESHOLD = 3        # min nbr rssi change(dB) to re-calculate coordinates of the radio's AP
+COORD_TXPWR_THRESHOLD = 1       # min txpwr change(dB) to re-calculate coordinates of the radio's AP
+COORD_LSQ_MAX_ITER = 20         # max num of Gauss-Newton iterations of the 'lsq' coord method
+COORD_LSQ_CG_ITER = 50          # max num of conjugate gradient iterations per Gauss-Newton iteration
+COORD_LSQ_LANDMARKS = 16        # num of landmark APs for the initial layout of the 'lsq' coord method
+COORD_LSQ_TOL = 0.5             # 'lsq' stops when no AP moves more than this(dots) in an iteration
 
 # the Tk canvas in which radio circles are drawn
 CANVAS = None
@@ -59,12 +157,35 @@ CANVAS_COLOR = 'white'
 CANVAS_COLOR_TRANSP = False     # fill oval color(not transparent)? 
 CANVAS_METER_PER_DOT = 0.1        # how many meters are represented by one dot-size on canvas
 CANVAS_FREEZE = False           # Freeze GUI updating
+CANVAS_GRID_CELL = 64           # cell size(dots) of the spatial index of circles on canvas
+GUI_FRAME_RATE = 10             # max num of frames per second the changed circles are redrawn
+PERF_BUCKETS_PER_OCTAVE = 4     # resolution of the hot path latency histograms, buckets per doubling
+PERF_OVERLAY_INTERVAL = 1.0     # interval(seconds) between 2 refreshes of the hot path stats overlay
+PERF_DUMP_INTERVAL = 10.0       # interval(seconds) between 2 dumps of the hot path stats to file
+PROFILE_INTERVAL = 0.01         # interval(seconds) between 2 samples of all threads' stacks by the profiler
+PROFILE_PATH = './acspmon-%Y%m%d-%H%M%S.folded'   # file profiles are written to, strftime() format
+
+HEADLESS = False                # no GUI, radio states and AP positions are written as JSON lines
+STATE_STREAM = None             # StateStream instance of the headless mode
+STREAM_FLUSH_INTERVAL = 1.0     # interval(seconds) between 2 writes of the buffered JSON lines
+
+RECORDER = None                 # ACSPRecorder instance if the ACSP session is recorded
+RECORD_INTERVAL = 5.0           # interval(seconds) between 2 samples of all radios recorded
+RECORD_KEYFRAME_INTERVAL = 600  # interval(seconds) between 2 full samples(keyframes) recorded
+RECORD_RSSI_SMOOTH = 0.25       # weight of the latest sample in the nbr rssi recorded(moving average)
+RECORD_RSSI_DEADBAND = 3        # min change(dB) of the nbr rssi average recorded between keyframes
+DISCOVERY = None                # NodeDiscovery instance, which detects new APs in the subnet
+REPLAY = None                   # ACSPReplay instance if a recording is replayed instead of polling APs
+REPLAY_SPEED = 1.0              # replay speed, N times of real time, 0 for as fast as possible
 
 # average noise floor detected by all APs
 RF_AVR_NFLOOR = -90
 RF_AVR_NFLOOR_MARGIN = 50       # safe margin to nfloor
 RF_ABSORB_FACT = 10             # average RF signal absorb factor
 RF_SMOOTH_WINDOW = 3            # RF signal smooth window(average of the num of samples is used) 
+RF_SMOOTH_WINDOW_MAX = 8        # num of samples kept per RF signal, RF_SMOOTH_WINDOW is capped by it
+RF_FILTER = 'avg'               # RF signal filter: 'avg'(moving average), 'ewma', 'median'(outliers rejected)
+NBR_LINK_TTL = 300              # seconds a nbr link not heard is kept(with its samples) before evicted
 
 ACSP_RUN_TIMESTAMP = False      # show the timestamp that radio ACSP becomes RUN
 RADIO_DISPLAYED = 'a'           # which radio of an AP should be displayed(0: wifi0, 1: wifi1, a: all)
@@ -80,15 +201,211 @@ def cprint(color, fmt, *args):
     CSTART = CEND = '\033[0m'
     if color in CCODES:
         CSTART = CCODES[color]
-    print ('\n' + CSTART + fmt + CEND) % args
+    # stdout is left to the JSON lines if they're written there
+    out = sys.stderr if STATE_STREAM and STATE_STREAM.file is sys.stdout else sys.stdout
+    print >>out, ('\n' + CSTART + fmt + CEND) % args
+
+PTN_LOG_IP = re.compile(r'^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}$')
+LOG_LEVELS = {'DEBUG':'gray', 'INFO':None, 'WARN':'yellow', 'ERROR':'red', 'ALERT':'cyan'}
 
 def LOG(level, fmt, *args):
-    LEVELS = {'DEBUG':'gray', 'INFO':None, 'WARN':'yellow', 'ERROR':'red', 'ALERT':'cyan'}
-    if level not in LEVELS:
+    if level not in LOG_LEVELS:
         level = 'INFO'
     if level == 'DEBUG' and not DEBUG_ENABLE:
         return
-    cprint(LEVELS[level], '['+level+']: '+fmt, *args)
+    # the AP of the message is found before the objects(e.g. nodes, radios, lists of
+    # CLI output lines) are str()'ed, they could change before the writer formats them
+    LOGGER.put(level, fmt, LogPipeline.snapshot(args), LogPipeline.node_ip(args))
+
+# Asynchronous log pipeline: LOG() only queues the message and a snapshot of its
+# arguments, a writer thread formats them, rate limits and writes them every
+# LOG_FLUSH_INTERVAL, thus the pollers never wait for the console, even with
+# debug enabled while holding an AP's lock. Repeats of a message of an AP(the
+# same format, and the same AP by its SSHNode, Radio or IP argument) beyond
+# LOG_RATE_BURST per LOG_RATE_INTERVAL are suppressed, and counted in one message
+# when it's over. Messages without such an argument are never suppressed.
+# Messages are written to the console(cut at LOG_MAX_LEN), and in full to the log
+# file if given, rotated at LOG_FILE_MAX. Until started, messages are written at
+# once, e.g. when acspmon is imported by acspbench. A message which fails to be
+# written is counted and skipped, the writer thread keeps running
+class LogPipeline(object):
+    PRIMITIVES = (basestring, int, long, float, type(None))
+
+    def __init__(self):
+        self.queue = collections.deque()    # (time, level, thread name, fmt, args, AP IP)
+        self.running = False
+        self.thread = None
+        self.path = None
+        self.file = None
+        self.repeats = {}       # key: (fmt, first arg), value: [since, count, suppressed, last message]
+        self.pruned = time.time()
+        self.logged = 0         # num of messages written
+        self.suppressed = 0     # num of messages suppressed as repeats
+        self.dropped = 0        # num of messages dropped as the queue is full
+        self.dropped_logged = 0
+        self.failed = 0         # num of messages failed to be written
+
+    def __str__(self):
+        return "LogPipeline(%s, %d queued, %d logged, %d suppressed, %d dropped, %d failed)" % \
+            ('running' if self.running else 'stopped', len(self.queue), self.logged, self.suppressed, 
+             self.dropped, self.failed)
+
+    def __repr__(self):
+        return self.__str__()
+
+    def start(self, path=None):
+        if path:
+            self.path = path
+            self.file = open(path, 'a')
+        self.running = True
+        self.thread = threading.Thread(target=self.loop, name="logWriterThread")
+        self.thread.setDaemon(True)
+        self.thread.start()
+        atexit.register(self.stop)
+
+    # write all messages queued and stop queueing, could be called more than once
+    def stop(self):
+        if self.running:
+            self.running = False
+            self.thread.join()
+        # all repeats counted are over, the suppressed ones are written too
+        self.drain(time.time() + LOG_RATE_INTERVAL)
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    # ip: IP of the AP the message is about, None if it's about no AP
+    def put(self, level, fmt, args, ip=None):
+        if not self.running:
+            self.write(time.time(), level, threading.current_thread().name, fmt, args)
+        elif len(self.queue) < LOG_QUEUE_MAX:
+            self.queue.append((time.time(), level, threading.current_thread().name, fmt, args, ip))
+        else:
+            self.dropped += 1
+
+    def loop(self):
+        while self.running:
+            time.sleep(LOG_FLUSH_INTERVAL)
+            try:
+                self.drain(time.time())
+            except Exception:       # e.g. the log file can't be flushed, keep logging to the console
+                self.failed += 1
+
+    def drain(self, now):
+        queue = self.queue
+        while queue:
+            t, level, name, fmt, args, ip = queue.popleft()
+            try:
+                if not self.repeated(t, level, name, fmt, args, ip):
+                    self.write(t, level, name, fmt, args)
+            except Exception:
+                self.failed += 1
+        if self.dropped > self.dropped_logged:
+            self.write(now, 'WARN', 'logWriterThread', '%d log messages dropped, the log queue is full', 
+                       (self.dropped - self.dropped_logged,))
+            self.dropped_logged = self.dropped
+        if now - self.pruned >= LOG_RATE_INTERVAL:
+            self.prune(now)
+        if self.file:
+            self.file.flush()
+
+    # count a message as a repeat, return whether it's suppressed
+    def repeated(self, t, level, name, fmt, args, ip):
+        if level == 'DEBUG':
+            return False
+        if ip is None:
+            return False
+        key = (fmt, ip)
+        r = self.repeats.get(key)
+        if r is None or t - r[0] >= LOG_RATE_INTERVAL:
+            if r:
+                self.write_suppressed(r)
+            self.repeats[key] = [t, 1, 0, None]
+            return False
+        r[1] += 1
+        if r[1] <= LOG_RATE_BURST:
+            return False
+        r[2] += 1
+        r[3] = (t, level, name, fmt, args)
+        self.suppressed += 1
+        return True
+
+    # IP of the AP a message is about, by its first SSHNode, Radio or IP argument,
+    # None if it's about no AP
+    @staticmethod
+    def node_ip(args):
+        for arg in args:
+            if isinstance(arg, SSHNode):
+                return arg.ip
+            if isinstance(arg, Radio) and arg.ap:
+                return arg.ap.ip
+            if isinstance(arg, str) and PTN_LOG_IP.match(arg):
+                return arg
+        return None
+
+    # the arguments with the objects str()'ed, numbers and strings are kept for
+    # the format, e.g. '%d'
+    @staticmethod
+    def snapshot(args):
+        return tuple(arg if isinstance(arg, LogPipeline.PRIMITIVES) else LogPipeline.safe(str, arg) 
+                     for arg in args)
+
+    # func(obj), which never raises, e.g. of an object whose __str__ raises
+    @staticmethod
+    def safe(func, obj):
+        try:
+            return func(obj)
+        except Exception as e:
+            return '<%s: %s() failed, %s>' % (type(obj).__name__, func.__name__, type(e).__name__)
+
+    # forget repeats counted before the last LOG_RATE_INTERVAL, with a message of
+    # how many were suppressed
+    def prune(self, now):
+        self.pruned = now
+        for key, r in self.repeats.items():
+            if now - r[0] >= LOG_RATE_INTERVAL:
+                self.write_suppressed(r)
+                del self.repeats[key]
+
+    def write_suppressed(self, r):
+        if r[2]:
+            t, level, name, fmt, args = r[3]
+            self.write(t, level, name, '(%d repeats in %.0fs suppressed, the last one:) ' % (r[2], t - r[0]) + fmt, 
+                       args)
+
+    def write(self, t, level, name, fmt, args):
+        try:
+            msg = fmt % args
+        except Exception:
+            msg = '%s %s' % (self.safe(str, fmt), ', '.join(self.safe(repr, arg) for arg in args))
+        self.logged += 1
+        if len(msg) > LOG_MAX_LEN:
+            cprint(LOG_LEVELS[level], '%s', '[%s]: %s... (%d more chars)' % 
+                   (level, msg[:LOG_MAX_LEN], len(msg) - LOG_MAX_LEN))
+        else:
+            cprint(LOG_LEVELS[level], '%s', '[' + level + ']: ' + msg)
+        if self.file:
+            self.file.write('%s.%03d %-5s %s: %s\n' % (time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(t)), 
+                            int(t * 1000) % 1000, level, name, msg))
+            if self.file.tell() >= LOG_FILE_MAX:
+                self.rotate()
+
+    # FILE -> FILE.1 -> FILE.2 ..., at most LOG_FILE_BACKUPS are kept
+    def rotate(self):
+        self.file.close()
+        for i in range(LOG_FILE_BACKUPS - 1, 0, -1):
+            if os.path.exists('%s.%d' % (self.path, i)):
+                os.rename('%s.%d' % (self.path, i), '%s.%d' % (self.path, i + 1))
+        if LOG_FILE_BACKUPS > 0:
+            os.rename(self.path, self.path + '.1')
+        self.file = open(self.path, 'w')
+
+def log_stats_report():
+    if LOGGER.running:
+        LOG('INFO', 'Log: %d messages, %d repeats suppressed, %d dropped(queue full), %d failed, %d queued', 
+            LOGGER.logged, LOGGER.suppressed, LOGGER.dropped, LOGGER.failed, len(LOGGER.queue))
+
+LOGGER = LogPipeline()
 
 # fill un-needed white spaces to make string splitting correct
 def fillwhite(text, start, end, c='-'):
@@ -117,13 +434,164 @@ def fillwhite(text, start, end, c='-'):
 
 
 
+# Central admission control of SSH work, it caps the num of concurrent SSH
+# handshakes and in-flight cmd transactions of all nodes, so that starting on a
+# large subnet converges predictably instead of in a thundering herd. Waiting
+# jobs are granted in FIFO order per kind of work
+class PollScheduler(object):
+    HANDSHAKE = 'handshake'
+    CMD = 'cmd'
+
+    def __init__(self, max_handshakes=SCHED_MAX_HANDSHAKES, max_inflight=SCHED_MAX_INFLIGHT):
+        self.cond = threading.Condition()
+        self.limits = {self.HANDSHAKE: max_handshakes, self.CMD: max_inflight}
+        self.running = {self.HANDSHAKE: 0, self.CMD: 0}
+        self.queues = {self.HANDSHAKE: collections.deque(), self.CMD: collections.deque()}
+
+    def __str__(self):
+        return ', '.join(['%s %d/%d(queued %d)' % (kind, self.running[kind], self.limits[kind], 
+                len(self.queues[kind])) for kind in sorted(self.limits.keys())])
+
+    def __repr__(self):
+        return self.__str__()
+
+    # num of jobs waiting for the 'kind' of work
+    def depth(self, kind):
+        return len(self.queues[kind])
+
+    # queue a job for the 'kind' of work, return its ticket to be granted later
+    def enqueue(self, kind):
+        ticket = [kind]
+        self.cond.acquire()
+        self.queues[kind].append(ticket)
+        self.cond.release()
+        return ticket
+
+    def grant_locked(self, ticket):
+        kind = ticket[0]
+        if self.queues[kind][0] is ticket and self.running[kind] < self.limits[kind]:
+            self.queues[kind].popleft()
+            self.running[kind] += 1
+            self.cond.notify_all()  # the next one in queue might be granted too
+            return True
+        return False
+
+    # grant the queued 'ticket' without blocking if it's its turn, for event loop
+    def try_grant(self, ticket):
+        self.cond.acquire()
+        granted = self.grant_locked(ticket)
+        self.cond.release()
+        return granted
+
+    # block until the 'kind' of work is granted
+    def acquire(self, kind):
+        ticket = self.enqueue(kind)
+        self.cond.acquire()
+        while not self.grant_locked(ticket):
+            self.cond.wait()
+        self.cond.release()
+
+    def release(self, kind):
+        self.cond.acquire()
+        self.running[kind] -= 1
+        self.cond.notify_all()
+        self.cond.release()
+
+SCHEDULER = PollScheduler()
+
+
 class SSHLostException(Exception):
     pass
 
-# Abstraction of SSH operation to a node
+PTN_SSH = {
+    # HiveOS shell prompt at the end of output, e.g. 'AH-1a2b3c#'
+    'prompt': re.compile(r'(^|\n)([^\s#]+#[ \t]*)$'),
+    # HiveOS CLI error, e.g. '      ^-- unknown keyword or invalid input'
+    'cli_error': re.compile(r'\^--[ \t]*(.+)'),
+}
+
+# Split the output stream of pipelined cmds into lines as chunks arrive, and
+# dispatch the complete lines of each cmd to its sink, or collect them.
+# A cmd's output starts with its echoed cmd line, and ends with the shell
+# prompt, which is followed by the echo of the next cmd in the same line.
+# 'sinks': key: cmd, value: an object with feed(line) and reset() methods
+class SSHOutputStream(object):
+    def __init__(self, node, cmds, sinks=None):
+        self.node = node
+        self.cmds = cmds
+        self.sinks = sinks or {}
+        self.lines = [[] for cmd in cmds]   # collected lines of each cmd without sink
+        self.index = 0          # index of the cmd whose output is being received
+        self.echoed = False     # whether the echo line of current cmd is received
+        self.misordered = False # cmds not echoed in order, can't be pipelined
+        self.pending = ''       # received incomplete last line
+        self.tail = ''          # last received output chars, see SSHNode.prompt_scan()
+        self.nprompts = 0       # num of prompts received
+        self.size = 0           # num of received output chars
+        self.error = None       # the first exception raised by sinks
+
+    # feed a received output chunk, return True when all cmds' output received
+    def feed(self, data):
+        self.size += len(data)
+        self.tail, n, prompted = self.node.prompt_scan(self.tail, data)
+        self.nprompts += n
+        lines = (self.pending + data).split('\n')
+        self.pending = lines.pop()
+        for line in lines:
+            self.feed_line(line)
+        return prompted and (len(self.cmds) <= 1 or self.nprompts >= len(self.cmds))
+
+    def feed_line(self, line):
+        prompt = self.node.prompt
+        if prompt and line.startswith(prompt) and self.index + 1 < len(self.cmds):
+            self.index += 1
+            self.echoed = False
+            line = line[len(prompt):]
+        if not self.echoed:
+            self.echoed = True
+            if line.strip() != self.cmds[self.index].strip():
+                self.misordered = True
+            return
+
+        cmd = self.cmds[self.index]
+        if cmd in self.sinks:
+            try:
+                self.sinks[cmd].feed(line)
+            except Exception as e:
+                if not self.error:
+                    self.error = e
+        else:
+            self.lines[self.index].append(line)
+
+    # return a list of outputs in the same order as cmds, a list of pure output
+    # lines for cmd without sink, or its sink
+    def outs(self):
+        return [self.sinks.get(cmd, lines) for cmd, lines in zip(self.cmds, self.lines)]
+
+    def reset(self):
+        for sink in self.sinks.values():
+            sink.reset()
+        self.__init__(self.node, self.cmds, self.sinks)
+
+
+# Abstraction of SSH operation to a node. The SSH session of a node is in one of
+# the states:
+#   connecting: SSH is being opened
+#   up: SSH is open, the last transaction succeeded
+#   degraded: SSH is lost, and reconnected after backoff, the node is still
+#       considered online with its last known info
+#   down: SSH failed SSH_DOWN_FAILS times in a row, the node is offline, and
+#       reconnected after backoff up to SSH_RECONNECT_MAX_BACKOFF seconds
+# A lost session is reconnected when it's due, with its console setup restored,
+# see ssh_reconnect()
 class SSHNode(object):
+    CONNECTING = 'connecting'
+    UP = 'up'
+    DEGRADED = 'degraded'
+    DOWN = 'down'
+
     def __init__(self, ip='0.0.0.0'):
-        self.ssh_lock = threading.Lock() # lock to protect SSH transaction
+        self.ssh_lock = StatLock('ssh_lock')   # lock to protect SSH transaction
         try:
             inet_aton(ip)       # validation
             self.ip = ip
@@ -132,80 +600,305 @@ class SSHNode(object):
         self.ssh = None         # paramiko.SSHClient handle
         self.shell = None       # send()/recv() shell, get by invoke_shell()
         self.active = False     # online or offline
+        self.state = SSHNode.DOWN   # SSH session state, see above
+        self.settled = SSHNode.DOWN # the latest state other than connecting
+        self.fails = 0          # num of consecutive SSH failures
+        self.retry_at = 0       # time the lost SSH session could be reconnected
+        self.reconnects = 0     # num of reconnects of lost SSH sessions
+        self.prompt = None      # shell prompt, learned from the latest output in 'prompt' read mode
+        self.pipelined = True   # whether commands could be sent in batch, see ssh_cmd_batch()
+        self.cmd_stats = {}     # key: cmd, value: [count, total latency, max latency, last latency]
 
     def __str__(self):
-        return "SSH to %s, %s" % (self.ip, 'open' if self.shell else 'closed')
+        return "SSH to %s, %s" % (self.ip, self.state)
         
     def __repr__(self):
         return self.__str__()
 
+    # changes between the states other than connecting are logged
+    def set_state(self, state):
+        if state == SSHNode.CONNECTING:
+            self.state = state
+        elif state != self.settled:
+            LOG('INFO', 'Node %s SSH %s -> %s', self.ip, self.settled, state)
+            self.state = self.settled = state
+        else:
+            self.state = state
+        if state == SSHNode.UP:
+            self.active = True
+        elif state == SSHNode.DOWN:
+            self.active = False
+
+    # SSH is open or failed to(including lost), on failure the node is reconnected
+    # after exponential backoff with jitter, from SSH_RECONNECT_BACKOFF up to
+    # SSH_RECONNECT_MAX_BACKOFF seconds
+    def ssh_up(self):
+        self.fails = 0
+        self.set_state(SSHNode.UP)
+
+    def ssh_failed(self):
+        self.fails += 1
+        delay = min(SSH_RECONNECT_BACKOFF * 2 ** min(self.fails - 1, 16), SSH_RECONNECT_MAX_BACKOFF)
+        self.retry_at = time.time() + delay * uniform(0.75, 1.25)
+        if self.active and self.fails < SSH_DOWN_FAILS:
+            self.set_state(SSHNode.DEGRADED)
+        else:
+            self.set_state(SSHNode.DOWN)
+
     def ssh_open(self):
+        self.set_state(SSHNode.CONNECTING)
+        if self.ssh:
+            self.ssh.close()
         self.ssh = paramiko.SSHClient()
         self.ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        SCHEDULER.acquire(PollScheduler.HANDSHAKE)
         try:
             self.ssh_lock.acquire() 
-            self.ssh.connect(self.ip, username=HIVEAP_USERNAME, password=HIVEAP_PASSWORD,
-                    timeout=SSH_LOST_TIMEOUT)
+            self.ssh.connect(self.ip, port=SSH_PORT, username=HIVEAP_USERNAME, 
+                    password=HIVEAP_PASSWORD, timeout=SSH_LOST_TIMEOUT, banner_timeout=SSH_LOST_TIMEOUT)
+            # a dead transport is found by keepalives while idle, instead of
+            # at the next cmd after SSH_LOST_TIMEOUT
+            if SSH_KEEPALIVE_INTERVAL:
+                self.ssh.get_transport().set_keepalive(SSH_KEEPALIVE_INTERVAL)
             self.shell = self.ssh.invoke_shell()
             self.shell.settimeout(SSH_LOST_TIMEOUT)
-            time.sleep(SSH_CMD_DELAY_DEFAULT + SSH_CMD_DELAY_EXTRA)
-            self.shell.recv(SSH_CMD_BUF_LEN)    # read out welcome info
-            self.active = True
+            # read out welcome info
+            if SSH_CMD_READ_MODE == 'prompt':
+                self.ssh_recv_prompt()
+            else:
+                time.sleep(SSH_CMD_DELAY_DEFAULT + SSH_CMD_DELAY_EXTRA)
+                self.ssh_drain()
+            # backoff is reset by the first successful cmd, in case of a node
+            # which accepts SSH but then fails it again
+            self.set_state(SSHNode.UP)
             self.ssh_lock.release() 
+            SCHEDULER.release(PollScheduler.HANDSHAKE)
             LOG('INFO', "Node %s connected through SSH", self.ip)
             return True
         except Exception:
             self.shell = None
-            self.active = False
+            self.ssh.close()
+            self.ssh_failed()
             self.ssh_lock.release() 
+            SCHEDULER.release(PollScheduler.HANDSHAKE)
             LOG('WARN', "Node %s CANNOT SSH to", self.ip)
             return False
 
+    # set up the console of a newly opened SSH session for polling
+    def ssh_setup(self):
+        self.ssh_cmd("console timeout 0\n")
+        self.ssh_cmd("console page 0\n")
+
+    # reopen the lost SSH session if it's due, and restore its console setup,
+    # return True if it's up again. Until then, a node which can't be connected
+    # (e.g. rebooting) costs nothing, instead of SSH_LOST_TIMEOUT every poll
+    def ssh_reconnect(self):
+        if time.time() < self.retry_at:
+            return False
+        LOG('ALERT', '%s: try to open SSH', self)
+        if not self.ssh_open():
+            return False
+        try:
+            self.ssh_setup()
+        except SSHLostException:
+            return False
+        self.reconnects += 1
+        return True
+
+    # read out whatever already received without blocking, e.g. garbage that
+    # left last time
+    def ssh_drain(self):
+        chunks = []
+        self.shell.settimeout(0)
+        try:
+            while True:
+                data = self.shell.recv(SSH_RECV_CHUNK_LEN)
+                if not data:
+                    break
+                chunks.append(data)
+        except Exception:
+            pass
+        self.shell.settimeout(SSH_LOST_TIMEOUT)
+        return ''.join(chunks)
+
+    # keep reading until the node's shell prompt comes back at the end of the
+    # output, or the overall deadline 'timeout' expires, return the whole output
+    def ssh_recv_prompt(self, timeout=SSH_CMD_TIMEOUT):
+        chunks = []
+        tail = ['']
+        def feed(data):
+            chunks.append(data)
+            tail[0], n, prompted = self.prompt_scan(tail[0], data)
+            return prompted
+        self.ssh_recv(feed, timeout)
+        return ''.join(chunks)
+
+    # keep reading output chunks and pass them to 'feed', until 'feed' returns
+    # True, or the overall deadline 'timeout' expires. If nothing is received
+    # within SSH_LOST_TIMEOUT, the SSH connection is considered lost
+    def ssh_recv(self, feed, timeout=SSH_CMD_TIMEOUT):
+        deadline = time.time() + timeout
+        received = False
+        while True:
+            left = deadline - time.time()
+            if left <= 0:
+                LOG('WARN', 'Node %s no prompt in %ss, output might be truncated', self.ip, timeout)
+                break
+            self.shell.settimeout(min(left, SSH_LOST_TIMEOUT))
+            try:
+                data = self.shell.recv(SSH_RECV_CHUNK_LEN)
+            except socket.timeout:
+                if received and time.time() >= deadline:
+                    LOG('WARN', 'Node %s no prompt in %ss, output might be truncated', self.ip, timeout)
+                    break
+                raise
+            if not data:
+                raise EOFError('Node ' + self.ip + ' SSH channel closed')
+            received = True
+            if feed(data):
+                break
+        self.shell.settimeout(SSH_LOST_TIMEOUT)
+
+    # scan a newly received output chunk 'data' for shell prompts, 'tail' is the
+    # last received output chars. Return tuple (tail, prompts, prompted):
+    #   tail: the new last received output chars, to be passed in next time
+    #   prompts: number of known prompts in the chunk(prompts could be split between 2 chunks)
+    #   prompted: whether the output ends with the shell prompt
+    def prompt_scan(self, tail, data):
+        prompts = 0
+        if self.prompt:
+            carry = tail[max(0, len(tail) - len(self.prompt) + 1):]
+            prompts = (carry + data).count(self.prompt)
+        tail = (tail + data)[-SSH_PROMPT_TAIL_LEN:]
+        match = PTN_SSH['prompt'].search(tail)
+        if match:
+            self.prompt = match.group(2)
+        return tail, prompts, bool(match)
+
+    # record the latency(seconds) of a command transaction
+    def ssh_cmd_stat(self, cmd, latency):
+        stat = self.cmd_stats.setdefault(cmd.strip(), [0, 0.0, 0.0, 0.0])
+        stat[0] += 1
+        stat[1] += latency
+        stat[2] = max(stat[2], latency)
+        stat[3] = latency
+        if PERF.enabled:
+            PERF.add('cmd', latency, self)
+            PERF.add('cmd ' + cmd.strip(), latency)
+        LOG('DEBUG', '%s cmd "%s" took %.3fs', self.ip, cmd.strip(), latency)
+
     def ssh_cmd(self, cmd, delay=SSH_CMD_DELAY_DEFAULT):
         if self.shell:
+            SCHEDULER.acquire(PollScheduler.CMD)
             try:
                 self.ssh_lock.acquire() 
-                # ready out whatever garbage that left last time
-                self.shell.settimeout(0)
-                try:
-                    self.shell.recv(SSH_CMD_BUF_LEN)
-                except Exception:
-                    pass
-                self.shell.settimeout(SSH_LOST_TIMEOUT)
+                start = time.time()
+                self.ssh_drain()    # ready out whatever garbage that left last time
                 self.shell.send(cmd)
-                if delay > 0:
-                    time.sleep(delay + SSH_CMD_DELAY_EXTRA)
-                out = self.shell.recv(SSH_CMD_BUF_LEN)
+                if SSH_CMD_READ_MODE == 'prompt':
+                    # 'delay' is only used by the fixed delay read mode
+                    out = self.ssh_recv_prompt()
+                else:
+                    if delay > 0:
+                        time.sleep(delay + SSH_CMD_DELAY_EXTRA)
+                    # wait for the first chunk, and read out the rest already received
+                    out = self.shell.recv(SSH_RECV_CHUNK_LEN) + self.ssh_drain()
                 self.ssh_lock.release() 
-                self.active = True
+                SCHEDULER.release(PollScheduler.CMD)
+                self.ssh_cmd_stat(cmd, time.time() - start)
+                self.ssh_up()
                 LOG('DEBUG', '%s >>>>>>>>>>>>>>>>>>>', self.ip)
                 LOG('DEBUG', '%s', out)
                 LOG('DEBUG', '%s <<<<<<<<<<<<<<<<<<<', self.ip)
                 return out
             except Exception:
-                self.active = False
-                self.shell = None
-                self.ssh.close()
-                self.ssh_lock.release() 
-                LOG('ALERT', 'Node %s SSH timeout at cmd "%s"', self.ip, cmd)
-                raise SSHLostException('Node '+self.ip+' SSH timeout at cmd "'+cmd+'"')
+                self.ssh_lost(cmd)
         else:
-            # connection lost, try to open SSH, ignore return code
-            LOG('ALERT', '%s: try to open SSH', self)
-            if self.ssh_open():
-                node.ssh_cmd("console timeout 0\n")
-                node.ssh_cmd("console page 0\n")
+            # connection lost, try to reopen SSH when it's due, ignore return code
+            self.ssh_reconnect()
             return None;
 
-    def ssh_cmd_lines(self, cmd, delay=SSH_CMD_DELAY_DEFAULT):
-        out = self.ssh_cmd(cmd, delay)
+    # SSH transaction failed at 'cmd' with ssh_lock and scheduler cmd slot held,
+    # close the connection, it's reconnected after backoff
+    def ssh_lost(self, cmd):
+        self.shell = None
+        self.ssh.close()
+        self.ssh_failed()
+        self.ssh_lock.release() 
+        SCHEDULER.release(PollScheduler.CMD)
+        LOG('ALERT', 'Node %s SSH timeout at cmd "%s"', self.ip, cmd)
+        raise SSHLostException('Node '+self.ip+' SSH timeout at cmd "'+cmd+'"')
+
+    # Send all commands in 'cmds' in one go, and split the combined output back
+    # by the shell prompts as it arrives, see SSHOutputStream. Return a list of
+    # outputs in the same order as 'cmds', a list of pure output lines(see
+    # ssh_cmd_lines()) for a cmd without sink, or the sink which all output lines
+    # of the cmd are fed to. 'delays' are only used when falling back to one
+    # command per transaction
+    def ssh_cmd_batch(self, cmds, delays=None, sinks=None):
+        if not delays:
+            delays = [SSH_CMD_DELAY_DEFAULT] * len(cmds)
+        if not self.shell:
+            return self.ssh_cmd(cmds[0])   # try to open SSH, return None
+        stream = SSHOutputStream(self, cmds, sinks)
+        if SSH_CMD_READ_MODE != 'prompt' or not self.prompt or not self.pipelined:
+            return self.ssh_cmd_seq(stream, delays)
+
+        txn = ' + '.join([cmd.strip() for cmd in cmds])
+        SCHEDULER.acquire(PollScheduler.CMD)
+        try:
+            self.ssh_lock.acquire() 
+            start = time.time()
+            self.ssh_drain()    # ready out whatever garbage that left last time
+            self.shell.send(''.join(cmds))
+            self.ssh_recv(stream.feed, timeout=SSH_CMD_TIMEOUT * len(cmds))
+            self.ssh_lock.release() 
+            SCHEDULER.release(PollScheduler.CMD)
+        except Exception:
+            self.ssh_lost(txn)
+        self.ssh_cmd_stat(txn, time.time() - start)
+        self.ssh_up()
+        LOG('DEBUG', '%s: %d chars output of "%s"', self.ip, stream.size, txn)
+
+        # each output starts with its own echoed cmd, otherwise the node's shell
+        # doesn't handle type-ahead cmds one by one, so can't be pipelined
+        if stream.misordered:
+            LOG('WARN', 'Node %s echoes cmds out of order, stop pipelining cmds', self.ip)
+            self.pipelined = False
+            stream.reset()
+            return self.ssh_cmd_seq(stream, delays)
+        if stream.error:
+            raise stream.error
+        return stream.outs()
+
+    # run cmds of 'stream' one per transaction, see ssh_cmd_batch()
+    def ssh_cmd_seq(self, stream, delays):
+        for cmd, delay in zip(stream.cmds, delays):
+            stream.echoed = True    # echo line is removed by ssh_cmd_lines()
+            for line in self.ssh_cmd_lines(cmd, delay) or []:
+                stream.feed_line(line)
+            stream.index += 1
+        if stream.error:
+            raise stream.error
+        return stream.outs()
+
+    # out always contains the original cmd in the first line, and the node's
+    # shell prompt in the last line, remove these 2 lines, and return a list of
+    # pure output lines
+    @staticmethod
+    def out_lines(out):
         if out:
-            # out always contains the original cmd in the first line, and the
-            # node's shell prompt in the last line, remove these 2 lines, and
-            # return a list of pure output lines
             out = out.split("\n")[1:-1]
         return out
 
+    # if 'sink' is given, output lines are fed to it as they arrive in 'prompt'
+    # read mode, instead of being returned
+    def ssh_cmd_lines(self, cmd, delay=SSH_CMD_DELAY_DEFAULT, sink=None):
+        if sink:
+            outs = self.ssh_cmd_batch([cmd], [delay], sinks={cmd: sink})
+            return outs[0] if outs else None
+        return SSHNode.out_lines(self.ssh_cmd(cmd, delay))
+
     def ssh_close(self):
         if self.ssh:
             self.ssh_lock.acquire() 
@@ -214,6 +907,1069 @@ class SSHNode(object):
             LOG('INFO', "Node %s SSH closed", self.ip)
 
 
+# Summarize the command latency of all APs, e.g. to compare SSH read modes
+def ssh_cmd_stats_report():
+    stats = {}
+    for ap in FLEET.aps:
+        for cmd, stat in ap.cmd_stats.items():
+            tot = stats.setdefault(cmd, [0, 0.0, 0.0])
+            tot[0] += stat[0]
+            tot[1] += stat[1]
+            tot[2] = max(tot[2], stat[2])
+
+    for cmd in sorted(stats.keys()):
+        cnt, total, maxl = stats[cmd]
+        LOG('INFO', 'cmd "%s": count %d, avg %.3fs, max %.3fs (read mode %s)',
+            cmd, cnt, total / cnt, maxl, SSH_CMD_READ_MODE)
+
+# Summarize the SSH session states of all APs
+def ssh_sessions_report():
+    states = collections.Counter(ap.state for ap in FLEET.aps)
+    if states:
+        LOG('INFO', 'SSH sessions: %s, %d reconnects', 
+            ', '.join('%d %s' % (states[s], s) for s in sorted(states.keys())),
+            sum(ap.reconnects for ap in FLEET.aps))
+
+# Summarize the contention of all locks, the same kind of per node locks(e.g.
+# 'ssh_lock') are merged
+def lock_stats_report():
+    stats = {}
+    for lock in list(StatLock.all_locks):
+        tot = stats.setdefault(lock.name, [0, 0.0, 0.0, 0.0, 0.0])
+        cnt, wait, maxw, hold, maxh = lock.stats
+        tot[0] += cnt
+        tot[1] += wait
+        tot[2] = max(tot[2], maxw)
+        tot[3] += hold
+        tot[4] = max(tot[4], maxh)
+
+    for name in sorted(stats.keys()):
+        cnt, wait, maxw, hold, maxh = stats[name]
+        if cnt:
+            LOG('INFO', 'lock "%s": acquired %d, wait avg %.6fs max %.3fs total %.3fs, hold avg %.6fs max %.3fs',
+                name, cnt, wait / cnt, maxw, wait, hold / cnt, maxh)
+
+
+# Latency histogram of log scale buckets, PERF_BUCKETS_PER_OCTAVE buckets per
+# doubling from 1us, so a percentile is within a bucket(19% by default) of the
+# real one, whatever the num of samples
+class PerfHistogram(object):
+    def __init__(self):
+        self.buckets = [0] * (PERF_BUCKETS_PER_OCTAVE * 28)   # up to 2**28us(268s)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        i = int(log(seconds * 1e6, 2) * PERF_BUCKETS_PER_OCTAVE) if seconds > 1e-6 else 0
+        self.buckets[min(i, len(self.buckets) - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    # upper bound(seconds) of the bucket the 'p'(0-1) percentile falls in
+    def percentile(self, p):
+        rank = p * self.count
+        n = 0
+        for i, cnt in enumerate(self.buckets):
+            n += cnt
+            if cnt and n >= rank:
+                return min(2 ** ((i + 1.0) / PERF_BUCKETS_PER_OCTAVE) / 1e6, self.max)
+        return self.max
+
+    def summary(self):
+        return {'count': self.count, 'avg': self.total / self.count if self.count else 0, 
+                'p50': self.percentile(0.5), 'p99': self.percentile(0.99), 'max': self.max}
+
+# Timers and counters of the hot path stages of all APs, e.g.:
+#   'cmd': SSH transactions, and 'cmd <cmds>' of each kind of them
+#   'poll': poll cycles, 'parse': parsing poll cycle outputs, 'filter': filtering RF signals
+#   'lock wait <name>'/'lock hold <name>': the StatLocks
+#   'draw': radio circle updates, 'render': frames drawn by the Tk main loop
+#   'coord': AP coordinates calculation rounds
+# Stages of an AP are also kept per AP. It's off by default, then a stage costs
+# only a check of 'enabled'. Samples are added by many threads without a lock,
+# a sample could be lost by a race, which is fine for stats
+class PerfStats(object):
+    def __init__(self):
+        self.enabled = False
+        self.overlay = False    # whether the stats overlay is shown on canvas
+        self.path = None        # file the stats are dumped to
+        self.since = 0          # time the stats are collected from
+        self.stages = {}        # key: stage, value: PerfHistogram
+        self.aps = {}           # key: AP ip, value: {stage: PerfHistogram}
+        self.text_id = None     # canvas text item of the overlay
+        self.after_id = None    # next refresh of the overlay
+
+    def __str__(self):
+        return "PerfStats(%s, %d stages, %d APs)" % ('on' if self.enabled else 'off', 
+            len(self.stages), len(self.aps))
+
+    def __repr__(self):
+        return self.__str__()
+
+    def enable(self, enabled):
+        if enabled and not self.enabled:
+            self.since = self.since or time.time()
+        self.enabled = enabled
+
+    # start timing a stage, return the start time to be passed to stop(), or 0
+    # if not enabled
+    def start(self):
+        return time.time() if self.enabled else 0
+
+    def stop(self, stage, start, ap=None):
+        if start:
+            self.add(stage, time.time() - start, ap)
+
+    def add(self, stage, seconds, ap=None):
+        hist = self.stages.get(stage) or self.stages.setdefault(stage, PerfHistogram())
+        hist.add(seconds)
+        if ap:
+            stages = self.aps.get(ap.ip) or self.aps.setdefault(ap.ip, {})
+            hist = stages.get(stage) or stages.setdefault(stage, PerfHistogram())
+            hist.add(seconds)
+
+    def report(self):
+        return {'since': round(self.since, 3), 'ts': round(time.time(), 3),
+            'stages': dict((st, h.summary()) for st, h in self.stages.items()),
+            'aps': dict((ip, dict((st, h.summary()) for st, h in stages.items())) 
+                for ip, stages in self.aps.items())}
+
+    # dump the stats to 'path' every PERF_DUMP_INTERVAL seconds, and on quit
+    def start_dump(self, path):
+        self.path = path
+        self.enable(True)
+        t = threading.Thread(target=self.loop, name="perfDumpThread")
+        t.setDaemon(True)
+        t.start()
+
+    def loop(self):
+        while True:
+            time.sleep(PERF_DUMP_INTERVAL)
+            self.dump()
+
+    # the file is replaced as a whole, so readers never see a partial dump
+    def dump(self):
+        if not self.path:
+            return
+        try:
+            with open(self.path + '.tmp', 'w') as f:
+                json.dump(self.report(), f, sort_keys=True, indent=1)
+            os.rename(self.path + '.tmp', self.path)
+        except Exception as e:
+            LOG('ERROR', 'Failed to dump hot path stats to %s: %s', self.path, e)
+
+    # the overlay text: p50/p99/max(ms) of each stage, and the APs with the
+    # slowest poll cycles
+    def overlay_text(self):
+        lines = ['%-36s %7s %8s %8s %8s' % ('stage(ms)', 'count', 'p50', 'p99', 'max')]
+        for stage in sorted(self.stages.keys()):
+            h = self.stages[stage]
+            lines.append('%-36s %7d %8.2f %8.2f %8.2f' % (stage[:36], h.count, 
+                h.percentile(0.5) * 1e3, h.percentile(0.99) * 1e3, h.max * 1e3))
+        polls = [(stages['poll'].percentile(0.99), ip) for ip, stages in self.aps.items() if 'poll' in stages]
+        if polls:
+            lines.append('slowest polls(p99): ' + 
+                ', '.join('%s %.0fms' % (ip, p * 1e3) for p, ip in sorted(polls, reverse=True)[:3]))
+        return '\n'.join(lines)
+
+    # toggle the overlay, stats are collected while it's shown(or dumped to file)
+    def toggle_overlay(self):
+        self.overlay = not self.overlay
+        self.enable(self.overlay or bool(self.path))
+        if self.after_id:
+            CANVAS.after_cancel(self.after_id)
+            self.after_id = None
+        self.draw_overlay()
+
+    # called in the Tk main loop only
+    def draw_overlay(self):
+        if not self.overlay:
+            if self.text_id:
+                CANVAS.delete(self.text_id)
+                self.text_id = None
+            return
+        self.after_id = CANVAS.after(int(PERF_OVERLAY_INTERVAL * 1000), self.draw_overlay)
+        text = self.overlay_text()
+        if self.text_id:
+            CANVAS.itemconfig(self.text_id, text=text)
+        else:
+            self.text_id = CANVAS.create_text(5, 5, text=text, anchor='nw', font=('courier', 8), fill='blue')
+        CANVAS.tag_raise(self.text_id)
+
+def perf_stats_report():
+    if PERF.enabled:
+        PERF.dump()
+        for stage in sorted(PERF.stages.keys()):
+            h = PERF.stages[stage]
+            LOG('INFO', 'stage "%s": count %d, avg %.6fs, p50 %.6fs, p99 %.6fs, max %.3fs', 
+                stage, h.count, h.total / h.count, h.percentile(0.5), h.percentile(0.99), h.max)
+
+PERF = PerfStats()
+
+
+# Sampling profiler of all threads(pollers, coords calculation, Tk main loop...),
+# started and stopped at any time by shortcut key 'P'(or signal SIGUSR1), so the
+# state which makes the tool slow isn't lost by restarting it under cProfile.
+# The profiler's own thread samples the stacks of all threads every 'interval'
+# seconds, the profile is written to PROFILE_PATH as folded stacks, one line
+# 'thread;func (file:line);...;func (file:line) samples' per distinct stack,
+# rooted at the thread name(e.g. apDetectThread_<ip>), which flame graph viewers
+# load, e.g. speedscope, flamegraph.pl
+class SamplingProfiler(object):
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self.running = False
+        self.thread = None
+        self.stacks = {}        # key: (thread name, code objects from the outermost), value: samples
+        self.samples = 0        # num of times all threads are sampled
+        self.cost = 0.0         # time spent on sampling
+        self.since = 0
+
+    def __str__(self):
+        return "SamplingProfiler(%s, %d samples, %d stacks)" % \
+            ('running' if self.running else 'stopped', self.samples, len(self.stacks))
+
+    def __repr__(self):
+        return self.__str__()
+
+    def toggle(self):
+        if self.running:
+            return self.stop()
+        self.start()
+
+    def start(self):
+        self.stacks = {}
+        self.samples = 0
+        self.cost = 0.0
+        self.since = time.time()
+        self.running = True
+        self.thread = threading.Thread(target=self.loop, name="profilerThread")
+        self.thread.setDaemon(True)
+        self.thread.start()
+        LOG('INFO', 'Profiling all threads, sampled every %.0fms', self.interval * 1e3)
+
+    def loop(self):
+        me = threading.current_thread().ident
+        names = {}      # key: thread ident, value: thread name
+        while self.running:
+            start = time.time()
+            frames = sys._current_frames()
+            if [ident for ident in frames if ident not in names]:
+                names = dict((t.ident, t.name) for t in threading.enumerate())
+            for ident, frame in frames.items():
+                if ident == me:
+                    continue
+                codes = []
+                while frame:
+                    codes.append(frame.f_code)
+                    frame = frame.f_back
+                codes.reverse()
+                key = (names.get(ident, 'thread_%s' % ident), tuple(codes))
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+            self.samples += 1
+            self.cost += time.time() - start
+            time.sleep(self.interval)
+
+    @staticmethod
+    def frame_name(code):
+        return '%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+    # stop sampling, write the profile, and log the functions most samples are in,
+    # return the file written
+    def stop(self):
+        self.running = False
+        self.thread.join()
+        path = datetime.now().strftime(PROFILE_PATH)
+        try:
+            with open(path, 'w') as f:
+                for (name, codes), n in sorted(self.stacks.items()):
+                    f.write('%s %d\n' % (';'.join([name] + [self.frame_name(c) for c in codes]), n))
+        except Exception as e:
+            LOG('ERROR', 'Failed to write profile to %s: %s', path, e)
+            path = None
+        elapsed = time.time() - self.since
+        LOG('INFO', 'Profiled %.1fs, %d samples of all threads, sampling took %.1f%% of the time, written to %s',
+            elapsed, self.samples, self.cost / elapsed * 100 if elapsed else 0, path)
+
+        funcs = {}      # key: code object, value: num of thread samples it's on the stack
+        total = 0
+        for (name, codes), n in self.stacks.items():
+            total += n
+            for code in set(codes):
+                funcs[code] = funcs.get(code, 0) + n
+        for code in sorted(funcs, key=funcs.get, reverse=True)[:10]:
+            LOG('INFO', '  %5.1f%% %s', funcs[code] * 100.0 / total, self.frame_name(code))
+        return path
+
+PROFILER = SamplingProfiler()
+
+
+# Uniform grid spatial index of the circles on canvas, for hit-testing without
+# scanning all circles: a circle is put into every cell its border rectangle
+# overlaps, and moved only when that cell range changes. Circles are drawn by
+# poller threads as well as the Tk main loop, thus the lock
+class CircleGrid(object):
+    def __init__(self, cell=CANVAS_GRID_CELL):
+        self.lock = StatLock('grid_lock')
+        self.cell = cell
+        self.cells = {}         # key: (col, row), value: set of circles in the cell
+        self.circles = {}       # key: circle, value: (cell range, insertion seq)
+        self.seq = 0
+
+    def __len__(self):
+        return len(self.circles)
+
+    def cell_range(self, x0, y0, x1, y1):
+        return (int(x0 // self.cell), int(y0 // self.cell), int(x1 // self.cell), int(y1 // self.cell))
+
+    # index the circle at its current location, or remove it if it has no size
+    def update(self, circle):
+        if circle.r <= 0:
+            self.remove(circle)
+            return
+        rng = self.cell_range(circle.xy0[0], circle.xy0[1], circle.xy1[0], circle.xy1[1])
+        self.lock.acquire()
+        old = self.circles.get(circle)
+        if not old or old[0] != rng:
+            if old:
+                self.unlink(circle, old[0])
+                seq = old[1]
+            else:
+                seq = self.seq
+                self.seq += 1
+            for key in self.range_keys(rng):
+                self.cells.setdefault(key, set()).add(circle)
+            self.circles[circle] = (rng, seq)
+        self.lock.release()
+
+    def remove(self, circle):
+        self.lock.acquire()
+        old = self.circles.pop(circle, None)
+        if old:
+            self.unlink(circle, old[0])
+        self.lock.release()
+
+    def unlink(self, circle, rng):
+        for key in self.range_keys(rng):
+            cell = self.cells.get(key)
+            if cell:
+                cell.discard(circle)
+                if not cell:
+                    del self.cells[key]
+
+    @staticmethod
+    def range_keys(rng):
+        return [(col, row) for col in range(rng[0], rng[2] + 1) for row in range(rng[1], rng[3] + 1)]
+
+    # sort found circles by size, smaller first since a smaller circle on top of
+    # a larger one is the one to pick; equal ones by the order they were indexed
+    def sorted_circles(self, found):
+        return sorted(found, key=lambda c: (c.r, self.circles[c][1]))
+
+    # circles which contain point (x, y), smaller first
+    def query_point(self, x, y):
+        self.lock.acquire()
+        cell = self.cells.get((int(x // self.cell), int(y // self.cell)), ())
+        found = [c for c in cell if (x - c.c[0])**2 + (y - c.c[1])**2 < c.r**2]
+        found = self.sorted_circles(found)
+        self.lock.release()
+        return found
+
+    # circles which overlap rectangle (x0, y0)-(x1, y1), smaller first
+    def query_rect(self, x0, y0, x1, y1):
+        x0, x1 = min(x0, x1), max(x0, x1)
+        y0, y1 = min(y0, y1), max(y0, y1)
+        self.lock.acquire()
+        found = set()
+        for key in self.range_keys(self.cell_range(x0, y0, x1, y1)):
+            for c in self.cells.get(key, ()):
+                # the distance from the circle center to its nearest point in the rectangle
+                dx = c.c[0] - min(max(c.c[0], x0), x1)
+                dy = c.c[1] - min(max(c.c[1], y0), y1)
+                if dx**2 + dy**2 < c.r**2:
+                    found.add(c)
+        found = self.sorted_circles(found)
+        self.lock.release()
+        return found
+
+CANVAS_GRID = CircleGrid()
+
+
+# Pollers update the circles at the rate APs are polled, but never touch Tk: a
+# circle drawn or erased posts its new state to the renderer queue, in which only
+# the latest state per circle is kept, and the queue is drained in one batch per
+# frame by the Tk main loop, thus the GUI cost is bounded by the frame rate, and
+# neither pollers wait for Tk nor the GUI waits for SSH
+class CanvasRenderer(object):
+    def __init__(self):
+        self.lock = StatLock('render_lock')
+        self.pending = {}       # key: circle, value: [state, time of the earliest post not drained]
+        self.root = None
+        self.frames = 0         # num of frames which rendered any circle
+        self.ops = 0            # num of canvas item operations(create/delete/coords/config/raise)
+        self.posts = 0          # num of states posted
+        self.coalesced = 0      # num of states replaced by later ones before drained
+        self.depth_max = 0      # max num of circles pending when drained
+        self.latency = 0.0      # total time from post to drain of the drained circles
+        self.latency_max = 0.0
+        self.drained = 0        # num of circles drained
+        self.drain_time = 0.0   # total time spent on draining
+
+    def __len__(self):
+        return len(self.pending)
+
+    # state: the canvas items of the circle, see GUICircle.render_state(), or None to erase it
+    def post(self, circle, state):
+        self.lock.acquire()
+        self.posts += 1
+        old = self.pending.get(circle)
+        if old:
+            old[0] = state
+            self.coalesced += 1
+        else:
+            self.pending[circle] = [state, time.time()]
+        self.lock.release()
+
+    def start(self, root):
+        self.root = root
+        self.frame()
+
+    def frame(self):
+        self.root.after(int(1000 / GUI_FRAME_RATE), self.frame)
+        if not CANVAS_FREEZE:
+            self.flush()
+
+    # render all pending circles now, larger ones first so that new smaller ones are
+    # on top, and restack the circles of any moved or created one
+    def flush(self):
+        self.lock.acquire()
+        pending, self.pending = self.pending, {}
+        self.lock.release()
+        if not pending:
+            return
+
+        start = time.time()
+        restack = set()
+        for circle in sorted(pending, key=lambda c: c.r, reverse=True):
+            if circle.render(pending[circle][0]):
+                restack.update(circle.stack_peers())
+        for circle in sorted(restack, key=lambda c: c.r, reverse=True):
+            circle.restack()
+
+        now = time.time()
+        if PERF.enabled:
+            PERF.add('render', now - start)
+        self.frames += 1
+        self.drained += len(pending)
+        self.depth_max = max(self.depth_max, len(pending))
+        self.drain_time += now - start
+        for state, posted in pending.values():
+            self.latency += now - posted
+            self.latency_max = max(self.latency_max, now - posted)
+
+def gui_stats_report():
+    r = RENDERER
+    if r.frames:
+        LOG('INFO', 'GUI: %d frames, %.3fms per frame, %d canvas ops, %d states posted, %d coalesced, ' +
+            'queue depth avg %.1f max %d, latency avg %.3fs max %.3fs', r.frames, r.drain_time * 1e3 / r.frames, 
+            r.ops, r.posts, r.coalesced, float(r.drained) / r.frames, r.depth_max, 
+            r.latency / r.drained, r.latency_max)
+
+RENDERER = CanvasRenderer()
+
+
+# JSON lines of radio state changes and AP position updates, written instead of
+# drawing in the headless mode, one object per line with 'event' and 'ts' keys.
+# Lines are buffered and written by the stream's own thread every 'interval'
+# seconds, thus pollers never wait for the output file
+class StateStream(object):
+    def __init__(self, path='-', interval=STREAM_FLUSH_INTERVAL):
+        self.lock = StatLock('stream_lock')
+        self.file = sys.stdout if path == '-' else open(path, 'a')
+        self.interval = interval
+        self.lines = []
+        self.radios = {}        # key: radio, value: state last written
+        self.positions = {}     # key: AP, value: position last written
+
+    def start(self):
+        t = threading.Thread(target=self.loop, name="streamFlushThread")
+        t.setDaemon(True)
+        t.start()
+
+    def loop(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+    def flush(self):
+        self.lock.acquire()
+        lines, self.lines = self.lines, []
+        self.lock.release()
+        if lines:
+            self.file.write('\n'.join(lines) + '\n')
+            self.file.flush()
+
+    def write(self, event, fields):
+        fields['event'] = event
+        fields['ts'] = round(time.time(), 3)
+        line = json.dumps(fields, sort_keys=True)
+        self.lock.acquire()
+        self.lines.append(line)
+        self.lock.release()
+
+    # write the radio's state if any of it changed since last written
+    def radio(self, rd):
+        state = (rd.ap.active, rd.mode, rd.phymode, rd.chnl, rd.chnl_state, 
+                 rd.chnl_disabled_reason, rd.pwr_state, rd.txpwr)
+        if self.radios.get(rd) == state:
+            return
+        self.radios[rd] = state
+        self.write('radio', {'ip': rd.ap.ip, 'ap': rd.ap.name, 'radio': rd.name, 'mac': rd.mac, 
+            'active': state[0], 'mode': state[1], 'phymode': state[2], 'chnl': state[3], 
+            'chnl_state': state[4], 'chnl_disabled_reason': state[5], 'pwr_state': state[6], 
+            'txpwr': state[7]})
+
+    # write the AP's position(in meters) if it moved since last written
+    def position(self, ap):
+        rd = ap.radios.get(IFNAME_WIFI0)
+        if not rd:
+            return
+        pos = (round(rd.c[0] * CANVAS_METER_PER_DOT, 2), round(rd.c[1] * CANVAS_METER_PER_DOT, 2))
+        if self.positions.get(ap) == pos:
+            return
+        self.positions[ap] = pos
+        fields = {'ip': ap.ip, 'ap': ap.name, 'x': pos[0], 'y': pos[1], 'method': APS_COORD_METHOD}
+        if APS_COORD_METHOD == 'lsq' and ap.coord_residual is not None:
+            fields['residual'] = round(ap.coord_residual, 2)
+        self.write('position', fields)
+
+# Variable-length integers of the ACSP recording format: 7 bits per byte, low
+# bits first, the high bit set on all bytes but the last. Signed integers are
+# zigzag encoded first(0, -1, 1, -2 ... -> 0, 1, 2, 3 ...), so small ones of
+# either sign take one byte
+def put_uvarint(buf, n):
+    while n > 0x7f:
+        buf.append((n & 0x7f) | 0x80)
+        n >>= 7
+    buf.append(n)
+
+def put_svarint(buf, n):
+    put_uvarint(buf, (n << 1) if n >= 0 else ((-n << 1) - 1))
+
+def put_bytes(buf, s):
+    s = s.encode('utf-8') if isinstance(s, unicode) else str(s or '')
+    put_uvarint(buf, len(s))
+    buf.extend(s)
+
+def get_uvarint(data, pos):
+    n = shift = 0
+    while True:
+        b = ord(data[pos])
+        pos += 1
+        n |= (b & 0x7f) << shift
+        if b < 0x80:
+            return n, pos
+        shift += 7
+
+def get_svarint(data, pos):
+    n, pos = get_uvarint(data, pos)
+    return (n >> 1) if not n & 1 else -((n + 1) >> 1), pos
+
+def get_bytes(data, pos):
+    n, pos = get_uvarint(data, pos)
+    return data[pos:pos+n], pos + n
+
+
+# Recording of an ACSP session, e.g. a convergence run after a mass reboot, for
+# later analysis and replay. The file is append-only, starts with MAGIC, then
+# records of [type(1 byte)][payload length(uvarint)][payload]:
+#   BEGIN:    starts a new epoch, all string/radio ids are re-assigned
+#   STRING:   id(uvarint), string(bytes), a string field value
+#   RADIO:    id(uvarint), AP ip, AP name, radio name, radio mac(bytes)
+#   KEYFRAME: time(ms, uvarint), num of radios, then each radio: radio id delta,
+#             fields, num of nbr links, links(nbr radio id delta, rssi(svarint))
+#   DELTA:    time delta(ms), num of changed radios, then each radio: radio id
+#             delta, bitmask of changed fields(bit 0 for nbr links), changed
+#             fields, links changed(nbr id delta, rssi delta(svarint)), links
+#             gone(nbr id delta)
+# A field is coded as a uvarint, 0 for None, string id + 1 for string fields,
+# zigzag + 1 for numbers. Radio/nbr ids of a record are in ascending order, and
+# each is coded as the delta to the previous one
+# Every keyframe starts a new epoch, thus it's self-contained and replay could
+# start from it, the file '<path>.idx' indexes them by fixed size entries of
+# (time(ms), offset of the BEGIN record)
+# The nbr rssi recorded is an exponential moving average of the samples, and a
+# change less than 'deadband' isn't recorded between keyframes, otherwise the
+# jitter of thousands of links would take most of the recording
+class ACSPRecorder(object):
+    MAGIC = 'ACSPREC1'
+    BEGIN, STRING, RADIO, KEYFRAME, DELTA = 'B', 'S', 'R', 'K', 'D'
+    INDEX_ENTRY = struct.Struct('<QQ')
+    # in the order of how often they change, the bitmask of the most changed ones fits in a byte
+    FIELDS = ('txpwr', 'chnl', 'chnl_state', 'pwr_state', 'nfloor', 'active', 'chnl_disabled_reason', 
+              'pwr_disabled_reason', 'mode', 'phymode')
+    STRING_FIELDS = ('mode', 'phymode', 'chnl_state', 'chnl_disabled_reason', 'pwr_state', 
+                     'pwr_disabled_reason')
+    LINKS = 1                   # field bitmask bit of nbr links, bit i + 1 is FIELDS[i]
+
+    def __init__(self, path, interval=RECORD_INTERVAL, keyframe_interval=RECORD_KEYFRAME_INTERVAL,
+                 smooth=RECORD_RSSI_SMOOTH, deadband=RECORD_RSSI_DEADBAND):
+        self.file = open(path, 'ab')
+        if not self.file.tell():
+            self.file.write(self.MAGIC)
+        else:
+            # only append to a recording, not to any file given by mistake
+            with open(path, 'rb') as f:
+                magic = f.read(len(self.MAGIC))
+            if magic != self.MAGIC:
+                self.file.close()
+                raise ValueError('%s is not an ACSP recording, refuse to append to it' % path)
+        self.index = open(path + '.idx', 'ab')
+        self.interval = interval
+        self.keyframe_interval = keyframe_interval
+        self.smooth = smooth
+        self.deadband = deadband
+        self.rssi = {}          # key: radio mac, value: {nbr radio mac: moving average of rssi}
+        self.string_fields = [f in self.STRING_FIELDS for f in self.FIELDS]
+        self.keyframe_ms = None
+        self.samples = 0        # num of samples recorded
+        self.bytes = 0          # num of bytes written
+        self.busy = 0.0         # total time spent on recording
+
+    # new epoch, ids are assigned from 0
+    def reset(self):
+        self.strings = {}       # key: string, value: id
+        self.radio_ids = {}     # key: radio mac, value: id
+        self.recorded = {}      # key: radio id, value: (field codes, {nbr radio id: rssi}) recorded
+        self.last_ms = None
+
+    def start(self):
+        t = threading.Thread(target=self.loop, name="acspRecorderThread")
+        t.setDaemon(True)
+        t.start()
+
+    # the recorder samples radios by itself, from the fleet snapshot, pollers are not involved
+    def loop(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.record(FLEET.radios)
+            except Exception as e:
+                LOG('ERROR', 'ACSP recording failed: %s', e)
+
+    def record_bytes(self, out, rtype, payload):
+        out.append(rtype)
+        put_uvarint(out, len(payload))
+        out.extend(payload)
+
+    def string_id(self, s, defs):
+        sid = self.strings.get(s)
+        if sid is None:
+            sid = self.strings[s] = len(self.strings)
+            payload = bytearray()
+            put_uvarint(payload, sid)
+            put_bytes(payload, s)
+            self.record_bytes(defs, self.STRING, payload)
+        return sid
+
+    def radio_id(self, rd, defs):
+        rid = self.radio_ids.get(rd.mac)
+        if rid is None:
+            rid = self.radio_ids[rd.mac] = len(self.radio_ids)
+            payload = bytearray()
+            put_uvarint(payload, rid)
+            for s in (rd.ap.ip, rd.ap.name, rd.name, rd.mac):
+                put_bytes(payload, s)
+            self.record_bytes(defs, self.RADIO, payload)
+        return rid
+
+    def field_codes(self, rd, defs):
+        codes = []
+        for f, is_str in zip(self.FIELDS, self.string_fields):
+            v = getattr(rd.ap if f == 'active' else rd, f)
+            if v is None:
+                codes.append(0)
+            elif is_str:
+                codes.append(self.string_id(v, defs) + 1)
+            else:
+                v = int(v)
+                codes.append(((v << 1) if v >= 0 else ((-v << 1) - 1)) + 1)
+        return tuple(codes)
+
+    # record a sample of 'radios' at time 'now'(seconds, default: current time),
+    # only changes since the last sample unless a keyframe is due
+    def record(self, radios, now=None):
+        start = time.time()
+        now_ms = int((start if now is None else now) * 1000)
+        out, defs = bytearray(), bytearray()
+        keyframe = self.keyframe_ms is None or now_ms - self.keyframe_ms >= self.keyframe_interval * 1000
+        if keyframe:
+            self.reset()
+            self.keyframe_ms = now_ms
+            self.record_bytes(out, self.BEGIN, bytearray())
+
+        sample = {}
+        w = self.smooth
+        for rd in radios:
+            nbrs = rd.nbrs      # replaced as a whole by the poller, see update_acsp_nbrs()
+            old, avg, links = self.rssi.get(rd.mac, {}), {}, {}
+            for mac, nbr in nbrs.items():
+                if nbr.rssi is not None:
+                    v = avg[mac] = nbr.rssi if mac not in old else old[mac] + w * (nbr.rssi - old[mac])
+                    links[self.radio_id(nbr.radio, defs)] = int(round(v))
+            self.rssi[rd.mac] = avg
+            sample[self.radio_id(rd, defs)] = (self.field_codes(rd, defs), links)
+
+        payload = bytearray()
+        if keyframe:
+            put_uvarint(payload, now_ms)
+            put_uvarint(payload, len(sample))
+            prev = 0
+            for rid in sorted(sample):
+                codes, links = sample[rid]
+                put_uvarint(payload, rid - prev)
+                prev = rid
+                for code in codes:
+                    put_uvarint(payload, code)
+                put_uvarint(payload, len(links))
+                prev_nid = 0
+                for nid in sorted(links):
+                    put_uvarint(payload, nid - prev_nid)
+                    put_svarint(payload, links[nid])
+                    prev_nid = nid
+            self.recorded = sample
+        else:
+            payload = self.delta_payload(sample, now_ms)
+
+        out.extend(defs)
+        self.record_bytes(out, self.KEYFRAME if keyframe else self.DELTA, payload)
+        self.last_ms = now_ms
+        offset = self.file.tell()
+        self.file.write(out)
+        self.file.flush()
+        if keyframe:
+            self.index.write(self.INDEX_ENTRY.pack(now_ms, offset))
+            self.index.flush()
+        self.samples += 1
+        self.bytes += len(out)
+        self.busy += time.time() - start
+
+    def delta_payload(self, sample, now_ms):
+        body = bytearray()
+        changed = 0
+        prev = 0
+        for rid in sorted(sample):
+            codes, links = sample[rid]
+            old_codes, old_links = self.recorded.get(rid, ((0,) * len(self.FIELDS), {}))
+            mask = 0
+            for i, code in enumerate(codes):
+                if code != old_codes[i]:
+                    mask |= 2 << i
+            upd = [(nid, rssi) for nid, rssi in links.items() 
+                   if nid not in old_links or abs(rssi - old_links[nid]) >= self.deadband]
+            gone = [nid for nid in old_links if nid not in links]
+            if upd or gone:
+                mask |= self.LINKS
+            if not mask:
+                continue
+
+            changed += 1
+            put_uvarint(body, rid - prev)
+            prev = rid
+            put_uvarint(body, mask)
+            for i, code in enumerate(codes):
+                if mask & (2 << i):
+                    put_uvarint(body, code)
+            new_links = old_links
+            if mask & self.LINKS:
+                new_links = dict(old_links)
+                put_uvarint(body, len(upd))
+                prev_nid = 0
+                for nid, rssi in sorted(upd):
+                    put_uvarint(body, nid - prev_nid)
+                    put_svarint(body, rssi - old_links.get(nid, 0))
+                    prev_nid = nid
+                    new_links[nid] = rssi
+                put_uvarint(body, len(gone))
+                prev_nid = 0
+                for nid in sorted(gone):
+                    put_uvarint(body, nid - prev_nid)
+                    prev_nid = nid
+                    del new_links[nid]
+            self.recorded[rid] = (codes, new_links)
+
+        payload = bytearray()
+        put_uvarint(payload, now_ms - self.last_ms)
+        put_uvarint(payload, changed)
+        payload.extend(body)
+        return payload
+
+    def close(self):
+        self.file.close()
+        self.index.close()
+
+def recorder_stats_report():
+    r = RECORDER
+    if r and r.samples:
+        LOG('INFO', 'ACSP recording: %d samples, %d bytes, %.1f bytes per sample, %.3fms per sample',
+            r.samples, r.bytes, float(r.bytes) / r.samples, r.busy * 1e3 / r.samples)
+
+
+# Reader of ACSP recordings, see ACSPRecorder. The radio states are rebuilt
+# sample by sample, indexed by radio mac, which is stable across epochs
+class ACSPRecordReader(object):
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:len(ACSPRecorder.MAGIC)] != ACSPRecorder.MAGIC:
+            raise ValueError('%s is not an ACSP recording' % path)
+        self.keyframes = self.read_index(path + '.idx')
+        self.pos = len(ACSPRecorder.MAGIC)
+        self.radios = {}        # key: radio mac, value: (AP ip, AP name, radio name)
+        self.states = {}        # key: radio mac, value: {field: value, 'nbrs': {nbr radio mac: rssi}}
+        self.epoch_reset()
+
+    def epoch_reset(self):
+        self.strings = {}       # key: id, value: string
+        self.macs = {}          # key: radio id, value: radio mac
+        self.time_ms = None
+
+    # list of (time(ms), offset) of keyframes, from the index file, or scanned
+    # from the recording if the index is missing or not in sync with it
+    def read_index(self, path):
+        try:
+            raw = open(path, 'rb').read()
+        except IOError:
+            raw = ''
+        size = ACSPRecorder.INDEX_ENTRY.size
+        entries = [ACSPRecorder.INDEX_ENTRY.unpack_from(raw, i) for i in range(0, len(raw) - size + 1, size)]
+        if entries and entries[-1][1] < len(self.data):
+            return entries
+
+        entries, pos = [], len(ACSPRecorder.MAGIC)
+        while pos < len(self.data):
+            rtype = self.data[pos]
+            n, start = get_uvarint(self.data, pos + 1)
+            if rtype == ACSPRecorder.BEGIN:
+                begin = pos
+            elif rtype == ACSPRecorder.KEYFRAME:
+                entries.append((get_uvarint(self.data, start)[0], begin))
+            pos = start + n
+        return entries
+
+    # move to the last keyframe at or before time 't'(seconds), or the first one
+    def seek(self, t):
+        i = bisect.bisect_right([ms for ms, offset in self.keyframes], int(t * 1000)) - 1
+        self.pos = self.keyframes[max(i, 0)][1] if self.keyframes else len(ACSPRecorder.MAGIC)
+        self.radios.clear()
+        self.states.clear()
+        self.epoch_reset()
+
+    def field_value(self, i, code):
+        if not code:
+            return None
+        if ACSPRecorder.FIELDS[i] in ACSPRecorder.STRING_FIELDS:
+            return self.strings[code - 1]
+        n = code - 1
+        v = (n >> 1) if not n & 1 else -((n + 1) >> 1)
+        return bool(v) if ACSPRecorder.FIELDS[i] == 'active' else v
+
+    # generator of (time(seconds), macs of the radios changed) of the samples from
+    # the current position, self.states is updated to each sample when yielded.
+    # A sample partially written(recording in progress) ends it
+    def samples(self):
+        data = self.data
+        while self.pos < len(data):
+            rtype = data[self.pos]
+            try:
+                n, start = get_uvarint(data, self.pos + 1)
+            except IndexError:
+                return
+            if start + n > len(data):
+                return
+            self.pos = start + n
+            if rtype == ACSPRecorder.BEGIN:
+                self.epoch_reset()
+            elif rtype == ACSPRecorder.STRING:
+                sid, pos = get_uvarint(data, start)
+                self.strings[sid] = get_bytes(data, pos)[0]
+            elif rtype == ACSPRecorder.RADIO:
+                rid, pos = get_uvarint(data, start)
+                ip, pos = get_bytes(data, pos)
+                apname, pos = get_bytes(data, pos)
+                name, pos = get_bytes(data, pos)
+                mac, pos = get_bytes(data, pos)
+                self.macs[rid] = mac
+                self.radios[mac] = (ip, apname, name)
+            elif rtype == ACSPRecorder.KEYFRAME:
+                yield self.read_keyframe(start)
+            elif rtype == ACSPRecorder.DELTA:
+                yield self.read_delta(start)
+
+    def read_keyframe(self, pos):
+        data, nfields = self.data, len(ACSPRecorder.FIELDS)
+        self.time_ms, pos = get_uvarint(data, pos)
+        num, pos = get_uvarint(data, pos)
+        rid = 0
+        changed = []
+        for i in range(num):
+            delta, pos = get_uvarint(data, pos)
+            rid += delta
+            state = {}
+            for f in range(nfields):
+                code, pos = get_uvarint(data, pos)
+                state[ACSPRecorder.FIELDS[f]] = self.field_value(f, code)
+            nlinks, pos = get_uvarint(data, pos)
+            nbrs, nid = {}, 0
+            for l in range(nlinks):
+                delta, pos = get_uvarint(data, pos)
+                nid += delta
+                nbrs[self.macs[nid]], pos = get_svarint(data, pos)
+            state['nbrs'] = nbrs
+            mac = self.macs[rid]
+            self.states[mac] = state
+            changed.append(mac)
+        return self.time_ms / 1000.0, changed
+
+    def read_delta(self, pos):
+        data, nfields = self.data, len(ACSPRecorder.FIELDS)
+        delta, pos = get_uvarint(data, pos)
+        self.time_ms += delta
+        num, pos = get_uvarint(data, pos)
+        rid = 0
+        changed = []
+        for i in range(num):
+            delta, pos = get_uvarint(data, pos)
+            rid += delta
+            mac = self.macs[rid]
+            state = self.states.setdefault(mac, dict.fromkeys(ACSPRecorder.FIELDS))
+            mask, pos = get_uvarint(data, pos)
+            for f in range(nfields):
+                if mask & (2 << f):
+                    code, pos = get_uvarint(data, pos)
+                    state[ACSPRecorder.FIELDS[f]] = self.field_value(f, code)
+            if mask & ACSPRecorder.LINKS:
+                nbrs = state['nbrs'] = dict(state.get('nbrs') or {})
+                nupd, pos = get_uvarint(data, pos)
+                nid = 0
+                for l in range(nupd):
+                    d, pos = get_uvarint(data, pos)
+                    nid += d
+                    rssi, pos = get_svarint(data, pos)
+                    nbrs[self.macs[nid]] = nbrs.get(self.macs[nid], 0) + rssi
+                ngone, pos = get_uvarint(data, pos)
+                nid = 0
+                for l in range(ngone):
+                    d, pos = get_uvarint(data, pos)
+                    nid += d
+                    del nbrs[self.macs[nid]]
+            elif 'nbrs' not in state:
+                state['nbrs'] = {}
+            changed.append(mac)
+        return self.time_ms / 1000.0, changed
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+
+# Replay of an ACSP recording(see ACSPRecorder) instead of polling APs by SSH:
+# APs and radios are set up as they appear in the recording, and each sample is
+# fed to them as if they were just polled, so that coords calculation, the GUI
+# and the state stream work the same. Samples are fed 'speed' times real time,
+# or as fast as possible if 0, from the keyframe at or before 'start'(seconds
+# since the recording starts)
+class ACSPReplay(object):
+    def __init__(self, path, speed=REPLAY_SPEED, start=0):
+        self.reader = ACSPRecordReader(path)
+        self.speed = speed
+        if start and self.reader.keyframes:
+            self.reader.seek(self.reader.keyframes[0][0] / 1000.0 + start)
+        self.samples = 0        # num of samples fed
+        self.busy = 0.0         # total time spent on feeding samples
+        self.lag = 0.0          # max time a sample is fed behind its time, if not as fast as possible
+        self.done = False
+
+    def start(self):
+        t = threading.Thread(target=self.run, name="acspReplayThread")
+        t.setDaemon(True)
+        t.start()
+
+    def run(self):
+        wall0 = t0 = None
+        for t, macs in self.reader.samples():
+            now = time.time()
+            if t0 is None:
+                wall0, t0 = now, t
+            elif self.speed:
+                due = wall0 + (t - t0) / self.speed
+                if due > now:
+                    time.sleep(due - now)
+                else:
+                    self.lag = max(self.lag, now - due)
+            start = time.time()
+            self.feed(t, macs)
+            self.busy += time.time() - start
+            self.samples += 1
+        self.done = True
+        self.report()
+
+    # the radio of 'mac', and its AP, are set up when first seen
+    def radio(self, mac):
+        rd = RADIOS.get(mac[:-1])
+        if rd:
+            return rd
+        ip, apname, name = self.reader.radios[mac]
+        ap = APS.get(ip)
+        if not ap:
+            ap = AP(ip)
+            ap.name, ap.mac, ap.active = apname, mac, True
+            APS_LOCK.acquire()
+            APS[ip] = ap
+            publish_fleet()
+            APS_LOCK.release()
+            LOG('DEBUG', 'AP %s added from the recording', ap)
+        ap.setup_radio(name, mac, Radio.STATE_UP, ap)
+        return ap.radios[name]
+
+    # feed the states of the radios of 'macs' at time 't' to them
+    def feed(self, t, macs):
+        states = self.reader.states
+        radios = [self.radio(mac) for mac in macs]
+        for rd in radios:
+            state = states[rd.mac]
+            was_run = rd.chnl_state == ACSP.CHNL_STATE_RUN
+            for f in ACSPRecorder.FIELDS:
+                if f == 'active':
+                    rd.ap.active = state[f] is not False
+                else:
+                    setattr(rd, f, state[f])
+            if rd.phymode:
+                rd.band = Radio.BAND_5 if 'a' in rd.phymode else Radio.BAND_2
+            if rd.chnl_state == ACSP.CHNL_STATE_RUN and not was_run:
+                rd.chnl_run_ts = datetime.fromtimestamp(t).strftime("%m-%d_%H:%M:%S")
+
+            # the rssi recorded is already smoothed, it's set as is
+            now = time.time()
+            links = NBR_LINKS.observer(rd)
+            nbrs = {}
+            for mac, rssi in state['nbrs'].items():
+                nbr = NBR_LINKS.link(links, self.radio(mac), now)
+                nbr.rssi = rssi
+                nbrs[mac] = nbr
+            rd.set_nbrs(nbrs)
+            NBR_LINKS.sweep(rd, now)
+        for rd in radios:
+            rd.stats_updated()
+
+    def report(self):
+        if self.samples:
+            LOG('INFO', 'Replay: %d samples%s, %.3fms per sample fed, max lag %.3fs', self.samples, 
+                ', done' if self.done else '', self.busy * 1e3 / self.samples, self.lag)
+
+
 # GUI coordinates
 class GUICircle(object):
     global CANVAS, CANVAS_FREEZE
@@ -229,7 +1985,7 @@ class GUICircle(object):
         self.color = 'black'        # fill color, black by default
         self.stipple = None         # fill color stipple bitmap
         self.outline = ''           # outline color, none by default
-        self.dash = None            # outline dash pattern
+        self.dash = ''              # outline dash pattern, '' for a solid outline
         self.width = 0
         self.text_id = None         # optional text item id
         self.text = None            # text to display
@@ -237,6 +1993,9 @@ class GUICircle(object):
         self.text_color = 'black'   # default text color
         self.cname_id = None        # optional name item id
         self.cname = None           # name to display, displayed at the center point
+        self.shown = False          # whether the circle is displayed(drawn and not erased)
+        self.posted = None          # state last posted to the renderer
+        self.rendered = {}          # key: item id attribute, value: (coords, options) last rendered
 
     def __str__(self):
         return 'GUICircle(%s)-%d-%s' % (self.c, self.r, self.color)
@@ -247,9 +2006,12 @@ class GUICircle(object):
     # text_side = UP or DOWN, specify where to put the text(which side of the circle)
     # active: True - actively draw/update the circle; 
     #         False - still display the circle but make it unfill and dashed and inactive(not updated)
+    # Only the circle's state is updated here, its canvas items are updated by the
+    # renderer in the Tk main loop, so it could be called from any thread
     def draw(self, c, r, color='black', stipple=None, text=None, text_loc=None, 
             text_color='black', cname=None, active=True):
         LOG('DEBUG', 'center %s, radius %d, color %s', c, r, color)
+        start = PERF.start()
         self.c = c
         self.r = r
         self.xy0[0], self.xy0[1] = c[0] - r, c[1] - r
@@ -258,6 +2020,8 @@ class GUICircle(object):
         self.stipple = stipple
         self.outline = ''
         self.width = 0
+        self.dash = ''              # not None, Tkinter drops None options so itemconfig would keep the dash
+        self.text_color = text_color
         if CANVAS_COLOR_TRANSP or not active:
             self.color = ''
             self.outline = 'black'
@@ -270,68 +2034,259 @@ class GUICircle(object):
             self.text_xy = [self.xy0[0]+r, self.xy0[1]]
         elif text_loc == self.DOWN:
             self.text_xy = [self.xy1[0]-r, self.xy1[1]]
-        self.text_color = text_color
         self.cname = cname if cname else self.cname
-
-        if CANVAS_FREEZE:
+        if HEADLESS:        # the radius is still needed by coords calculation, but nothing to draw
             return
+        self.shown = True
+        CANVAS_GRID.update(self)
+        state = self.render_state()
+        if state != self.posted:        # unchanged circles are not queued at all
+            self.posted = state
+            RENDERER.post(self, state)
+        PERF.stop('draw', start)
 
-        if not self.oval_id:
-            self.oval_id = CANVAS.create_oval(self.xy0[0], self.xy0[1], self.xy1[0], self.xy1[1], 
-                    width=self.width, fill=self.color, stipple=self.stipple)
-        else:
-            CANVAS.coords(self.oval_id, self.xy0[0], self.xy0[1], self.xy1[0], self.xy1[1])
-            CANVAS.itemconfig(self.oval_id, width=self.width, fill=self.color, 
-                    stipple=self.stipple, dash=self.dash)
+    # make the circle disappear
+    def erase(self):
+        CANVAS_GRID.remove(self)
+        self.shown = False
+        self.posted = None
+        RENDERER.post(self, None)
+
+    # the (coords, options) of each canvas item of the circle, None if the item shouldn't
+    # be displayed. It's a snapshot, later changes of the circle won't affect it
+    def render_state(self):
+        oval = ((self.xy0[0], self.xy0[1], self.xy1[0], self.xy1[1]), 
+                {'width': self.width, 'fill': self.color, 'stipple': self.stipple, 'dash': self.dash})
+        text = cname = None
+        if self.text:
+            text = ((self.text_xy[0], self.text_xy[1]), 
+                    {'text': self.text, 'font': ('arial', 7), 'fill': self.text_color})
+        if self.cname:
+            cname = ((self.c[0], self.c[1]), {'text': self.cname, 'font': ('arial', 7)})
+        return (oval, text, cname)
+
+    # Below are called by the renderer only, in the Tk main loop
+
+    # apply the posted state to the circle's canvas items, only the items whose geometry,
+    # color or text changed are touched. Return True if any item is created or moved
+    def render(self, state):
+        if not state:
+            self.delete_items()
+            return False
+        oval, text, cname = state
+        moved = self.render_item('oval_id', CANVAS.create_oval, oval)
+        moved = self.render_item('text_id', CANVAS.create_text, text) or moved
+        moved = self.render_item('cname_id', CANVAS.create_text, cname) or moved
+        return moved
+
+    # item: name of the item id attribute, state: (coords, options) of the item,
+    # or None if the item shouldn't be displayed
+    def render_item(self, item, create, state):
+        item_id = getattr(self, item)
+        if not state:
+            if item_id:
+                CANVAS.delete(item_id)
+                setattr(self, item, None)
+                RENDERER.ops += 1
+            return False
+        coords, opts = state
+        if not item_id:
+            setattr(self, item, create(*coords, **opts))
+            self.rendered[item] = state
+            RENDERER.ops += 1
+            return True
+        old_coords, old_opts = self.rendered[item]
+        if coords != old_coords:
+            CANVAS.coords(item_id, *coords)
+            RENDERER.ops += 1
+        changed = dict((k, v) for k, v in opts.items() if old_opts.get(k) != v)
+        if changed:
+            CANVAS.itemconfig(item_id, **changed)
+            RENDERER.ops += 1
+        self.rendered[item] = state
+        return coords != old_coords
+
+    # circles whose stacking order depends on this one, e.g. the radios of an AP
+    def stack_peers(self):
+        return [self]
+
+    # put the circle's items on top of all others
+    def restack(self):
+        for item_id in (self.oval_id, self.text_id, self.cname_id):
+            if item_id:
+                CANVAS.tag_raise(item_id)
+                RENDERER.ops += 1
+
+    def delete_items(self):
+        for item in ('oval_id', 'c_id', 'text_id', 'cname_id'):
+            if getattr(self, item):
+                CANVAS.delete(getattr(self, item))
+                setattr(self, item, None)
+                RENDERER.ops += 1
+        self.rendered.clear()
+
+
+# Batched filter of the RF signals: rssi, cu, crc and sta count of each nbr link,
+# and noise floor of each radio(in the rssi field). Each signal source owns a
+# slot, the last RF_SMOOTH_WINDOW_MAX samples of all slots are kept in one ring
+# matrix, so that all signals of a radio's poll cycle are filtered in one step,
+# by numpy at once(or in pure python if numpy isn't installed). Filters:
+#   avg:    average of the last RF_SMOOTH_WINDOW samples
+#   ewma:   exponentially weighted moving average, the latest sample weighs
+#           2/(RF_SMOOTH_WINDOW+1), i.e. the samples are as old as of 'avg'
+#   median: median of the last RF_SMOOTH_WINDOW samples, a sample far off(e.g.
+#           a beacon lost in a collision) is rejected instead of averaged in
+# The EWMA is kept up to date whichever filter is used, so switching filters
+# doesn't make the filtered values jump back to a few samples
+class SignalFilter(object):
+    FILTERS = ('avg', 'ewma', 'median')
+    FIELDS = 4                  # rssi, cu, crc, sta count
+
+    def __init__(self, capacity=1024):
+        self.lock = threading.Lock()    # slot allocation, and ring writes against growing
+        self.clear(capacity)
 
-        if self.oval_id:
-            '''
-            if not self.c_id:
-                self.c_id = CANVAS.create_oval(self.c[0]-1, self.c[1]-1, self.c[0]+1, self.c[1]+1, 
-                        width=1, fill=self.color)
-            else:
-                CANVAS.coords(self.c_id, self.c[0]-1, self.c[1]-1, self.c[0]+1, self.c[1]+1)
-                CANVAS.itemconfig(self.c_id, width=1, fill=self.color)
-            '''
+    def __str__(self):
+        return "SignalFilter(%s, %d slots, %d steps, %d signals filtered)" % \
+            (RF_FILTER, self.size - len(self.free), self.steps, self.filtered)
 
-            if self.text and not self.text_id:
-                self.text_id = CANVAS.create_text(self.text_xy, text=self.text, font=('arial', 7), 
-                        fill=self.text_color)
-            if self.text_id:
-                CANVAS.coords(self.text_id, self.text_xy[0], self.text_xy[1])
-                CANVAS.itemconfig(self.text_id, text=self.text, font=('arial', 7))
+    def __repr__(self):
+        return self.__str__()
+
+    def clear(self, capacity=1024):
+        self.free = []          # slots released, to be reused
+        self.size = 0           # num of slots ever allocated
+        self.capacity = 0
+        self.raw = None         # ring of the last samples of each slot
+        self.count = None       # num of samples put into each slot
+        self.ewma = None        # EWMA of each slot
+        self.steps = 0
+        self.filtered = 0
+        self.grow(capacity)
+
+    def grow(self, capacity):
+        W, F = RF_SMOOTH_WINDOW_MAX, self.FIELDS
+        if np:
+            raw = np.zeros((capacity, W, F), np.float32)
+            count = np.zeros(capacity, np.int64)
+            ewma = np.zeros((capacity, F))
+            if self.capacity:
+                raw[:self.capacity], count[:self.capacity], ewma[:self.capacity] = self.raw, self.count, self.ewma
+            self.raw, self.count, self.ewma = raw, count, ewma
+        else:
+            n = capacity - self.capacity
+            if not self.capacity:
+                self.raw, self.count, self.ewma = array('f'), array('l'), array('d')
+            self.raw.extend(array('f', [0]) * (n * W * F))
+            self.count.extend(array('l', [0]) * n)
+            self.ewma.extend(array('d', [0]) * (n * F))
+        self.capacity = capacity
+
+    def alloc(self):
+        self.lock.acquire()
+        if self.free:
+            slot = self.free.pop()
+        else:
+            if self.size == self.capacity:
+                self.grow(self.capacity * 2)
+            slot = self.size
+            self.size += 1
+        self.lock.release()
+        return slot
+
+    def release(self, slot):
+        self.lock.acquire()
+        self.count[slot] = 0
+        self.free.append(slot)
+        self.lock.release()
+
+    # put a sample(a tuple of FIELDS numbers) into each of 'slots', and return
+    # the filtered values of them, a list of FIELDS ints per slot
+    def update(self, slots, samples):
+        if not slots:
+            return []
+        window = min(max(int(RF_SMOOTH_WINDOW), 1), RF_SMOOTH_WINDOW_MAX)
+        alpha = 2.0 / (window + 1)
+        self.lock.acquire()
+        try:
+            self.steps += 1
+            self.filtered += len(slots)
+            if np:
+                return self.update_np(slots, samples, window, alpha)
+            return self.update_py(slots, samples, window, alpha)
+        finally:
+            self.lock.release()
+
+    def update_np(self, slots, samples, window, alpha):
+        W = RF_SMOOTH_WINDOW_MAX
+        s = np.array(slots)
+        x = np.array(samples, float)
+        count = self.count[s] + 1
+        self.raw[s, (count - 1) % W] = x
+        self.count[s] = count
+        ewma = self.ewma[s]
+        ewma = np.where((count == 1)[:, None], x, ewma + alpha * (x - ewma))
+        self.ewma[s] = ewma
+        if RF_FILTER == 'ewma':
+            out = ewma
+        else:
+            # age of each sample in the rings, 0 for the latest
+            n = np.minimum(count, window)
+            valid = ((count[:, None] - 1 - np.arange(W)) % W < n[:, None])[:, :, None]
+            rings = self.raw[s]
+            if RF_FILTER == 'median':
+                out = np.nanmedian(np.where(valid, rings, np.nan), axis=1)
+            else:
+                out = (rings * valid).sum(axis=1) / n[:, None]
+        return np.rint(out).astype(int).tolist()
+
+    def update_py(self, slots, samples, window, alpha):
+        W, F = RF_SMOOTH_WINDOW_MAX, self.FIELDS
+        raw, count, ewma = self.raw, self.count, self.ewma
+        out = []
+        for slot, x in zip(slots, samples):
+            c = count[slot] = count[slot] + 1
+            base = slot * W * F
+            i = base + (c - 1) % W * F
+            raw[i:i+F] = array('f', x)
+            e = slot * F
+            for f in range(F):
+                ewma[e+f] = x[f] if c == 1 else ewma[e+f] + alpha * (x[f] - ewma[e+f])
+            if RF_FILTER == 'ewma':
+                v = ewma[e:e+F]
+            else:
+                n = min(c, window)
+                rings = [raw[base + (c - 1 - k) % W * F:base + (c - 1 - k) % W * F + F] for k in range(n)]
+                if RF_FILTER == 'median':
+                    v = [median(col) for col in zip(*rings)]
+                else:
+                    v = [sum(col) / n for col in zip(*rings)]
+            out.append([int(round(f)) for f in v])
+        return out
 
-            if self.cname and not self.cname_id:
-                self.cname_id = CANVAS.create_text(self.c, text=self.cname, font=('arial', 7))
-            if self.cname_id:
-                CANVAS.coords(self.cname_id, self.c[0], self.c[1])
-                CANVAS.itemconfig(self.cname_id, text=self.cname, font=('arial', 7))
+def median(values):
+    values = sorted(values)
+    n = len(values)
+    return values[n // 2] if n % 2 else (values[n // 2 - 1] + values[n // 2]) / 2.0
 
-    # make the circle disappear
-    def erase(self):
-        if self.oval_id:
-            CANVAS.delete(self.oval_id)
-            self.oval_id = None
-        if self.c_id:
-            CANVAS.delete(self.c_id)
-            self.c_id = None
-        if self.text_id:
-            CANVAS.delete(self.text_id)
-            self.text_id = None
-        if self.cname_id:
-            CANVAS.delete(self.cname_id)
-            self.cname_id = None
+FILTER = SignalFilter()
 
 
-# Pack all ACSP neighbor info
+# Pack all ACSP neighbor info, a link from the radio hearing it(observer) to the
+# nbr radio. It's kept across poll cycles(see NbrLinkStore), its rssi, cu, crc
+# and sta count are filtered by FILTER from the samples of the last polls. They're
+# updated in place by the poller, readers without AP lock see either the old or
+# the new value of each
 class ACSPNbr(object):
+    __slots__ = ('radio', 'rssi', 'max_txpwr', 'mgmt_tpbo', 'data_tpbo', 'tot_cu', 'crc_err', 'sta_cnt',
+                 'slot', 'seen')
+
     def __init__(self, radio=None):
         # the Radio instance _reference_, easy to get mode, phymode, the belonging AP, etc.
         self.radio = radio          
 
         # the following are all numbers
         self.rssi = None            # the nbr's RSSI received by this radio
-        self.rssi_window = []       # the nbr's RSSI smooth window 
         self.max_txpwr = None       # max. tx power limit
         self.mgmt_tpbo = None       # tx power backoff for mgmt frames
         self.data_tpbo = None       # tx power backoff for data frames
@@ -342,22 +2297,127 @@ class ACSPNbr(object):
         self.sta_cnt = None         # total number of connected stations
         #self.nbr_cnt = None
 
+        self.slot = None            # slot of the link's signals in FILTER, see NbrLinkStore
+        self.seen = 0               # time the nbr was last heard, see NbrLinkStore
+
     def __str__(self):
-        return "nbr %s-%s-%s-%s: rssi=%s/stacnt=%s/crc=%s/txpwr=%s/mbo=%s/dbo=%s" % \
-            (self.radio.ap.name, self.radio.name, self.radio.mac, self.radio.ap.ip, self.rssi, \
+        return "nbr %s-%s-%s-%s: rssi=%s/cu=%s/stacnt=%s/crc=%s/txpwr=%s/mbo=%s/dbo=%s" % \
+            (self.radio.ap.name, self.radio.name, self.radio.mac, self.radio.ap.ip, self.rssi, self.tot_cu, \
             self.sta_cnt, self.crc_err, self.max_txpwr, self.mgmt_tpbo, self.data_tpbo)
 
     def __repr__(self):
         return self.__str__()
 
 
+# Persistent store of all nbr links, key: observer radio mac, then nbr radio mac,
+# so that a link(and its samples in FILTER) lives across poll cycles instead of
+# rebuilt by each. The links of an observer are only touched by its poller(or
+# the replay thread): links not heard for 'ttl' seconds are evicted(and their
+# FILTER slots released) by a sweep of the observer's own links at most once per
+# 'ttl', so the memory is bounded by the links heard recently(about 300 bytes
+# per link), and no slot is released while another thread still uses the link
+class NbrLinkStore(object):
+    def __init__(self, ttl=NBR_LINK_TTL):
+        self.ttl = ttl
+        self.links = {}         # key: observer radio mac, value: {nbr radio mac: ACSPNbr}
+        self.swept = {}         # key: observer radio mac, value: time its links were last swept
+        self.created = 0
+        self.evicted = 0
+
+    def __str__(self):
+        return "NbrLinkStore(%d observers, %d links, %d created, %d evicted)" % \
+            (len(self.links), self.size(), self.created, self.evicted)
+
+    def __repr__(self):
+        return self.__str__()
+
+    def size(self):
+        return sum(len(links) for links in self.links.values())
+
+    # the links heard by radio 'observer', key: nbr radio mac, value: ACSPNbr
+    def observer(self, observer):
+        links = self.links.get(observer.mac)
+        if links is None:
+            links = self.links.setdefault(observer.mac, {})
+        return links
+
+    # the link to nbr 'radio' in 'links'(see observer()), created if not yet
+    def link(self, links, radio, now):
+        nbr = links.get(radio.mac)
+        if nbr is None or nbr.radio is not radio:
+            if nbr:
+                FILTER.release(nbr.slot)
+            nbr = links[radio.mac] = ACSPNbr(radio)
+            nbr.slot = FILTER.alloc()
+            self.created += 1
+        nbr.seen = now
+        return nbr
+
+    # evict the links of radio 'observer' not heard for 'ttl', by its poller
+    def sweep(self, observer, now):
+        if now - self.swept.setdefault(observer.mac, now) < self.ttl:
+            return
+        self.swept[observer.mac] = now
+        links = self.observer(observer)
+        for nbr_mac, nbr in links.items():
+            if now - nbr.seen >= self.ttl:
+                del links[nbr_mac]
+                FILTER.release(nbr.slot)
+                self.evicted += 1
+
+    # forget all links of radio 'observer', which is discarded, by its poller
+    def drop(self, observer):
+        self.swept.pop(observer.mac, None)
+        for nbr in self.links.pop(observer.mac, {}).values():
+            FILTER.release(nbr.slot)
+            self.evicted += 1
+
+    def clear(self):
+        for links in self.links.values():
+            for nbr in links.values():
+                FILTER.release(nbr.slot)
+        self.links.clear()
+        self.swept.clear()
+
+NBR_LINKS = NbrLinkStore()
+
+
 PTN_ACSP = {
     'disabled_reason': re.compile(r'(\(.+?\))'),
     'nbr_rssi': re.compile(r'[ \t]+(-[0-9]+)[ \t]+'), 
     'nbrtabd_fmt1': re.compile(r'([ \t]+:[ \t]+)'), 
     'nbrtabd_fmt2': re.compile(r'([ \t]+:[0-9]+[ \t]+)'), 
+    # BSSID prefix, all VAPs of a radio share the same BSSID prefix(mac[:-1])
+    'nbr_bssid': re.compile(r'((?:[0-9a-fA-F]{4}[:.-]){2}[0-9a-fA-F]{3}|' + 
+                            r'(?:[0-9a-fA-F]{2}[:-]){5}[0-9a-fA-F])[0-9a-fA-F]'),
 }
 
+# Incremental parser of the lines of 'show acsp neighbor', VAP lines are indexed
+# by BSSID prefix as they arrive, could be used as sink of SSHOutputStream
+class NbrTab(object):
+    def __init__(self):
+        self.vaps_bymac = {}    # key: BSSID prefix, value: list of VAP lines of the radio
+
+    def __str__(self):
+        return "NbrTab(%d radios)" % len(self.vaps_bymac)
+
+    def __repr__(self):
+        return self.__str__()
+
+    def feed(self, vap):
+        for prefix in set(PTN_ACSP['nbr_bssid'].findall(vap)):
+            self.vaps_bymac.setdefault(prefix, []).append(vap)
+
+    def reset(self):
+        self.vaps_bymac = {}
+
+# parse the lines of 'show acsp neighbor' in one pass, return a NbrTab
+def parse_nbrtab(nbrtab):
+    tab = NbrTab()
+    for vap in nbrtab:
+        tab.feed(vap)
+    return tab
+
 # Pack all ACSP related info
 class ACSP(object):
     global APS, APS_LOCK
@@ -386,6 +2446,12 @@ class ACSP(object):
         self.nbrs_bydist = []   # all nbrs, ordered by distance(from near to far from this radio)
         self.nbrs_radios = []   # all nbrs' corresponding radios, same order as nbrs_bydist
 
+        # the nbr rssi(key: radio mac) and txpwr which the AP coordinates were
+        # last calculated from, and whether they changed beyond thresholds since
+        self.coord_links = {}
+        self.coord_txpwr = None
+        self.coord_dirty = True
+
     def __str__(self):
         return "ACSP chnl(%s/%s/%s)-pwr(%s/%s)" % \
             (self.chnl_state, self.chnl, self.width, self.pwr_state, self.txpwr)
@@ -394,91 +2460,145 @@ class ACSP(object):
         return self.__str__()
 
     # scan all detected AP radio neighbors, update their ACSP info heard by current AP
-    def update_acsp_nbrs(self, ssh):
-        def sort_nbr_bydist(n):
-            if not n.radio.txpwr:
-                n.radio.txpwr = 20
-            return n.radio.txpwr - n.rssi
-
-        nbrtab = ssh.ssh_cmd_lines('show acsp neighbor\n', delay=2)
+    # 'batch' is the outputs of the AP's poll cycle CLIs, indexed by CLI, see AP.poll_cmds()
+    def update_acsp_nbrs(self, ssh, batch):
+        vaps_bymac = batch['show acsp neighbor\n'].vaps_bymac
         '''
-        nbrtabd = ssh.ssh_cmd_lines('show acsp _nbr\n', delay=2)
+        vapsd_bymac = ssh.ssh_cmd_lines('show acsp _nbr\n', delay=2, sink=NbrTab()).vaps_bymac
         '''
 
-        self.nbrs = {}
-        APS_LOCK.acquire()
-        for ip, ap in APS.items():
-            if ap is self.ap:
+        # RADIOS is only inserted into, single lookups need no APS_LOCK
+        nbr_vaps = [(prefix, RADIOS.get(prefix), vaps) for prefix, vaps in vaps_bymac.items()]
+
+        # the nbr links are kept in NBR_LINKS across poll cycles, and updated in
+        # place, build the dict of the links heard aside and publish it at the end,
+        # so readers without AP lock(e.g. calc_ap_coord) never see it half updated
+        now = time.time()
+        links = NBR_LINKS.observer(self)
+        nbrs = {}
+        heard, samples = [], []     # the links heard and their samples, filtered at the end
+        for prefix, radio, vaps in nbr_vaps:
+            if not radio or radio.ap is self.ap:
                 continue
 
-            for name, radio in ap.radios.items():
-                nbr = ACSPNbr(radio)
-                vapsd = None    # for easy comment the vapsd block
-
-                vaps = [vap for vap in nbrtab if radio.mac[:-1] in vap]
-                LOG('DEBUG', '%s: vaps of acsp nbr %s:\n%s', self.ap, radio, vaps)
-                if vaps:
-                    tot_rssi = tot_sta = tot_crc = tot_cu = 0
-                    for vap in vaps:
-                        vap_cols = vap.split()
-                        try:
-                            tot_rssi += int(PTN_ACSP['nbr_rssi'].search(vap).group(1))
-                            tot_sta += int(vap_cols[-2])
-                            tot_crc += int(vap_cols[-3][-1])
-                            cu = vap_cols[-3][:3] if len(vap_cols[-3]) > 3 else vap_cols[-4]
-                            tot_cu += int(cu)
-                        except Exception:
-                            LOG('ALERT', '[%s]Failed to parse rssi/sta/crc/cu, from line:\n%s', ssh.ip, vap)
-                            raise
-                    nbr.rssi_window.append(tot_rssi / len(vaps))
-                    if len(nbr.rssi_window) > RF_SMOOTH_WINDOW:
-                        nbr.rssi_window.pop(0)
-                    nbr.rssi = sum(nbr.rssi_window) / len(nbr.rssi_window)
-                    nbr.sta_cnt = tot_sta
-                    nbr.crc_err = tot_crc / len(vaps)
-
-                '''
-                vapsd = [vap for vap in nbrtabd if radio.mac[:-1] in vap]
-                LOG('DEBUG', 'vapsd: %s', vapsd)
-                if vapsd:
-                    # latest products have different output format 
-                    if PTN_ACSP['nbrtabd_fmt1'].search(vapsd[0]):
-                        pwr_base = 12
-                    elif PTN_ACSP['nbrtabd_fmt2'].search(vapsd[0]):
-                        pwr_base = 11
-                    else:
-                        pwr_base = 10
-                    vap_cols = vapsd[0].split()  # power attributes are radio-specific
+            nbr = NBR_LINKS.link(links, radio, now)
+            vapsd = None    # for easy comment the vapsd block
+
+            LOG('DEBUG', '%s: vaps of acsp nbr %s:\n%s', self.ap, radio, vaps)
+            if vaps:
+                tot_rssi = tot_sta = tot_crc = tot_cu = 0
+                for vap in vaps:
+                    vap_cols = vap.split()
                     try:
-                        nbr.max_txpwr = int(vap_cols[pwr_base])
-                        nbr.mgmt_tpbo = int(vap_cols[pwr_base+1])
-                        nbr.data_tpbo = int(vap_cols[pwr_base+2])
+                        tot_rssi += int(PTN_ACSP['nbr_rssi'].search(vap).group(1))
+                        tot_sta += int(vap_cols[-2])
+                        tot_crc += int(vap_cols[-3][-1])
+                        cu = vap_cols[-3][:3] if len(vap_cols[-3]) > 3 else vap_cols[-4]
+                        tot_cu += int(cu)
                     except Exception:
-                        LOG('ALERT', '[%s]Failed to parse max_txpwr/tpbo, from line:\n%s', ssh.ip, vapsd[0])
+                        LOG('ALERT', '[%s]Failed to parse rssi/sta/crc/cu, from line:\n%s', ssh.ip, vap)
                         raise
+                n = float(len(vaps))
+                heard.append(nbr)
+                samples.append((tot_rssi / n, tot_cu / n, tot_crc / n, tot_sta))
+
+            '''
+            vapsd = vapsd_bymac.get(prefix)
+            LOG('DEBUG', 'vapsd: %s', vapsd)
+            if vapsd:
+                # latest products have different output format 
+                if PTN_ACSP['nbrtabd_fmt1'].search(vapsd[0]):
+                    pwr_base = 12
+                elif PTN_ACSP['nbrtabd_fmt2'].search(vapsd[0]):
+                    pwr_base = 11
+                else:
+                    pwr_base = 10
+                vap_cols = vapsd[0].split()  # power attributes are radio-specific
+                try:
+                    nbr.max_txpwr = int(vap_cols[pwr_base])
+                    nbr.mgmt_tpbo = int(vap_cols[pwr_base+1])
+                    nbr.data_tpbo = int(vap_cols[pwr_base+2])
+                except Exception:
+                    LOG('ALERT', '[%s]Failed to parse max_txpwr/tpbo, from line:\n%s', ssh.ip, vapsd[0])
+                    raise
 
-                    if nbr.max_txpwr > 20 or nbr.max_txpwr == 0:
-                        LOG('ALERT', '[%s]wrong max_txpwr %d, from line:\n%s', ssh.ip, nbr.max_txpwr, vapsd[0])
-                '''
-                    
-                if vaps or vapsd:
-                    self.nbrs[nbr.radio.mac] = nbr
+                if nbr.max_txpwr > 20 or nbr.max_txpwr == 0:
+                    LOG('ALERT', '[%s]wrong max_txpwr %d, from line:\n%s', ssh.ip, nbr.max_txpwr, vapsd[0])
+            '''
+                
+            if vaps or vapsd:
+                nbrs[nbr.radio.mac] = nbr
         
-        if self.nbrs:
-            #self.nbrs_bydist = sorted(self.nbrs.values(), key=lambda n: n.rssi, reverse=True)
-            self.nbrs_bydist = sorted(self.nbrs.values(), key=sort_nbr_bydist)
-            self.nbrs_radios = [n.radio for n in self.nbrs_bydist]
+        self.filter_signals(heard, samples)
+        self.set_nbrs(nbrs)
+        NBR_LINKS.sweep(self, now)
 
-        APS_LOCK.release()
         LOG('DEBUG', 'nbrs:\n%s', self.nbrs)
         LOG('DEBUG', 'nbrs_bydist:\n%s', self.nbrs_bydist)
         LOG('DEBUG', 'nbrs_radios:\n%s', self.nbrs_radios)
 
-    def update_acsp_stats(self, ssh):
+    # filter the samples of nbr 'links' of a poll cycle, and the noise floor sample
+    # of the radio(if any), in one step of FILTER
+    def filter_signals(self, links, samples):
+        start = PERF.start()
+        slots = [nbr.slot for nbr in links]
+        if self.nfloor_sample is not None:
+            slots.append(self.nfloor_slot)
+            samples.append((self.nfloor_sample, 0, 0, 0))
+        values = FILTER.update(slots, samples)
+        for nbr, (rssi, cu, crc, sta) in zip(links, values):
+            nbr.rssi, nbr.tot_cu, nbr.crc_err, nbr.sta_cnt = rssi, cu, crc, sta
+        if self.nfloor_sample is not None:
+            self.nfloor = values[-1][0]
+            self.nfloor_sample = None
+        PERF.stop('filter', start, self.ap)
+
+    # publish new nbr links(key: radio mac, value: ACSPNbr) as a whole, so readers
+    # without AP lock(e.g. calc_ap_coord) never see them half updated
+    def set_nbrs(self, nbrs):
+        def sort_nbr_bydist(n):
+            if not n.radio.txpwr:
+                n.radio.txpwr = 20
+            return n.radio.txpwr - n.rssi
+
+        if nbrs:
+            #nbrs_bydist = sorted(nbrs.values(), key=lambda n: n.rssi, reverse=True)
+            nbrs_bydist = sorted(nbrs.values(), key=sort_nbr_bydist)
+            self.nbrs, self.nbrs_bydist, self.nbrs_radios = nbrs, nbrs_bydist, [n.radio for n in nbrs_bydist]
+        else:
+            self.nbrs = nbrs
+
+        self.update_coord_dirty()
+
+    # mark the AP coordinates to be re-calculated if nbrs come/go, or any nbr
+    # rssi or the txpwr changed beyond thresholds since last calculation
+    def update_coord_dirty(self):
+        if self.coord_dirty:
+            return
+        links = self.coord_links
+        if self.coord_txpwr is None or abs(self.txpwr - self.coord_txpwr) >= COORD_TXPWR_THRESHOLD:
+            self.coord_dirty = True
+        elif len(self.nbrs) != len(links):
+            self.coord_dirty = True
+        else:
+            for mac, nbr in self.nbrs.items():
+                if mac not in links or abs(nbr.rssi - links[mac]) >= COORD_RSSI_THRESHOLD:
+                    self.coord_dirty = True
+                    break
+        if self.coord_dirty:
+            LOG('DEBUG', '%s: nbr links changed, coordinates to be re-calculated', self)
+
+    # the AP coordinates are calculated from current nbr links and txpwr
+    def coord_solved(self):
+        self.coord_links = dict((mac, nbr.rssi) for mac, nbr in self.nbrs.items())
+        self.coord_txpwr = self.txpwr
+        self.coord_dirty = False
+
+    def update_acsp_stats(self, ssh, batch):
         # some mode radio doesn't support ACSP
         if self.mode == 'access' or self.mode == 'backhaul' or self.mode == 'dual':
             self.acsp_supported = True
-            out = ssh.ssh_cmd_lines('show acsp\n')
+            out = batch['show acsp\n']
             line = 3 if self.name == IFNAME_WIFI0 else 4
 
             out[line] = fillwhite(out[line], '(', ')')
@@ -520,7 +2640,7 @@ class ACSP(object):
             LOG('DEBUG', '%s: ACSP state %s, chnl %s, width %s, pwr_state %s, txpwr %s', 
                 self.name, self.chnl_state, self.chnl, self.width, self.pwr_state, self.txpwr)
 
-            self.update_acsp_nbrs(ssh)
+            self.update_acsp_nbrs(ssh, batch)
         else:
             LOG('WARN', 'ACSP not supported on radio %s with mode %s', self, self.mode)
             self.acsp_supported = False
@@ -549,8 +2669,9 @@ class Radio(ACSP, GUICircle):
         self.mode = None 
         self.phymode = None     # 2.4GHz: 11b/g, 11ng; 5GHz: 11a, 11na, 11ac
         self.band = None        #2 for 2.4GHz band, or 5 for 5GHz band
-        self.nfloor = None      # noise floor detected by this radio
-        self.nfloor_window = [] # noise floor detected by this radio
+        self.nfloor = None      # noise floor detected by this radio, filtered
+        self.nfloor_sample = None   # noise floor of the last poll, to be filtered
+        self.nfloor_slot = FILTER.alloc()
         self.nbr_score = None   # neighbor score, radio with higher score calculates coords first
 
         self.ap = ap            # the belonging AP
@@ -558,6 +2679,13 @@ class Radio(ACSP, GUICircle):
     def __str__(self):
         return "%s-%s-%s-%s" % (self.name, self.mac, self.mode, self.phymode)
 
+    # the radio is replaced by 'radio'(e.g. the AP is detected again), release its
+    # FILTER slots, its links are kept for the new radio if it has the same mac
+    def discard(self, radio):
+        FILTER.release(self.nfloor_slot)
+        if radio.mac != self.mac:
+            NBR_LINKS.drop(self)
+
     def __repr__(self):
         return self.__str__()
 
@@ -602,6 +2730,8 @@ class Radio(ACSP, GUICircle):
 
     def show(self, c=[0, 0], apname=None):
         if RADIO_DISPLAYED != 'a' and RADIO_DISPLAYED != self.name[-1]:
+            if self.shown:
+                self.erase()
             return
 
         if self.mode == 'access' or self.mode == 'backhaul' or self.mode == 'dual':
@@ -632,6 +2762,10 @@ class Radio(ACSP, GUICircle):
             self.draw(c, r, color, stipple, text=text, text_loc=text_loc, text_color=text_color, 
                         cname=apname, active=self.ap.active)
 
+    # the radio with larger coverage radius is drawn below the other one of the AP
+    def stack_peers(self):
+        return self.ap.radios.values()
+
     def calc_nbr_score(self):
         # this radio's nbr score is higher when it has more nbrs, with higher rssi,
         # and more matured in ACSP state machine(in later states)
@@ -652,25 +2786,31 @@ class Radio(ACSP, GUICircle):
             score = -sys.maxint - 1     # the minimum integer
         return score
 
-    def update_radio_stats(self, ssh):
-        out = ssh.ssh_cmd('show interface '+self.name+'\n')
+    def update_radio_stats(self, ssh, batch):
+        out = '\n'.join(batch['show interface '+self.name+'\n'])
         try:
             self.mode = PTN_RADIO['mode'].search(out).group(1)
             self.phymode= PTN_RADIO['phymode'].search(out).group(1)
             self.band = Radio.BAND_5 if 'a' in self.phymode else Radio.BAND_2
-            self.nfloor_window.append(int(PTN_RADIO['nfloor'].search(out).group(1)))
-            if len(self.nfloor_window) > RF_SMOOTH_WINDOW:
-                self.nfloor_window.pop(0)
-            self.nfloor = sum(self.nfloor_window) / len(self.nfloor_window)
+            self.nfloor_sample = int(PTN_RADIO['nfloor'].search(out).group(1))
         except Exception:
             LOG('ALERT', "[%s]Failed to parse mode/phymode/band/nfloor, from output:\n%s", ssh.ip, out)
             raise
         LOG('DEBUG', '%s: mac %s, mode %s, phymode %s', self.name, self.mac, self.mode, self.phymode)
 
-        self.update_acsp_stats(ssh)
+        # the noise floor is filtered with the nbr rssi, or alone if ACSP isn't supported
+        self.update_acsp_stats(ssh, batch)
+        if self.nfloor_sample is not None:
+            self.filter_signals([], [])
+        self.stats_updated()
 
+    # after a poll cycle(or replay sample) updated the radio's stats: score it, and
+    # show it on the GUI or write it to the state stream
+    def stats_updated(self):
         self.nbr_score = self.calc_nbr_score()
         LOG('DEBUG', '%s, nbr_score %d', self, self.nbr_score)
+        if STATE_STREAM:
+            STATE_STREAM.radio(self)
 
         c = self.c  # initial value
         apname = self.ap.name + '/' + self.ap.mac
@@ -678,11 +2818,7 @@ class Radio(ACSP, GUICircle):
             if self.name != IFNAME_WIFI0:
                 c = self.ap.radios[IFNAME_WIFI0].c      # two radios have the same center
 
-            if not CANVAS_FREEZE:
-                self.ap.radios[IFNAME_WIFI0].erase()
-                self.ap.radios[IFNAME_WIFI1].erase()
-
-            # the radio with larger coverage radius draw first, thus it won't cover the other one
+            # the AP name is shown by the radio with smaller coverage radius, which is on top
             if self.ap.radios[IFNAME_WIFI0].r > self.ap.radios[IFNAME_WIFI1].r:
                 self.ap.radios[IFNAME_WIFI0].show(c)
                 self.ap.radios[IFNAME_WIFI1].show(c, apname=apname)
@@ -698,13 +2834,14 @@ class AP(SSHNode):
     def __init__(self, ip):
         SSHNode.__init__(self, ip)
 
-        self.lock = threading.Lock()        # lock to sync between info update and info get
+        self.lock = StatLock('ap_lock')     # lock to sync between info update and info get
 
         self.name = None
         self.mac = None         # invalid mac
         self.hive = None
 
         self.radios = {}        # Should be type Radio. key: name, value: Radio instance
+        self.coord_residual = None  # RMS error(m) of the AP's nbr links, by 'lsq' coord method
 
     def __str__(self):
         return "%s-%s-%s" % (self.name, self.mac, self.ip)
@@ -712,29 +2849,95 @@ class AP(SSHNode):
     def __repr__(self):
         return self.__str__()
 
+    # radios dict is copied on write, readers of FLEET may be iterating it
     def setup_radio(self, name, mac, state, ap):
-        self.radios[name] = Radio(name, mac, state, ap)
+        radio = Radio(name, mac, state, ap)
+        radios = dict(self.radios)
+        old = radios.get(name)
+        radios[name] = radio
+        APS_LOCK.acquire()
+        self.radios = radios
+        RADIOS[mac[:-1]] = radio
+        publish_fleet()
+        APS_LOCK.release()
+        if old:
+            old.discard(radio)
+
 
+    # CLIs whose outputs are needed by a poll cycle of all radios, return tuple
+    # (cmds, delays, sinks), see ssh_cmd_batch(). The large nbr table is parsed
+    # as its lines arrive, and shared by all radios
+    def poll_cmds(self):
+        cmds = ['show interface '+name+'\n' for name in sorted(self.radios.keys())]
+        delays = [SSH_CMD_DELAY_DEFAULT] * len(cmds)
+        return cmds + ['show acsp\n', 'show acsp neighbor\n'], delays + [SSH_CMD_DELAY_DEFAULT, 2], \
+            {'show acsp neighbor\n': NbrTab()}
 
     # Update AP info(e.g. Radio, GUI displaying, etc)
     def update_ap_stats(self):
+        # get all radios' CLI outputs in one pipelined SSH transaction
+        start = PERF.start()
+        cmds, delays, sinks = self.poll_cmds()
+        try:
+            outs = self.ssh_cmd_batch(cmds, delays, sinks)
+        except SSHLostException:
+            return
+        except Exception as e:
+            LOG('ERROR', 'parsing error: %s', e)
+            return
+        if not outs:
+            return
+        self.update_radios(dict(zip(cmds, outs)))
+        PERF.stop('poll', start, self)
+
+    # the AP is drawn offline once its SSH session is down
+    def set_state(self, state):
+        active = self.active
+        SSHNode.set_state(self, state)
+        if active and not self.active:
+            self.set_offline()
+
+    def set_offline(self):
+        for r in self.radios.values():
+            r.draw(r.c, r.r, active=False)
+            if STATE_STREAM:
+                STATE_STREAM.radio(r)
+        LOG('ALERT', 'AP %s offline', self)
+
+    # update all radios from 'batch', the outputs of poll_cmds(), indexed by CLI
+    def update_radios(self, batch):
+        start = PERF.start()
         for r in self.radios.values():
             try:
                 self.lock.acquire()
-                r.update_radio_stats(self)
-                self.lock.release()
-            except SSHLostException:
-                for r in self.radios.values():
-                    r.draw(r.c, r.r, active=False)
+                r.update_radio_stats(self, batch)
                 self.lock.release()
-                LOG('ALERT', 'AP %s offline', self)
             except Exception as e:
                 self.lock.release()
                 LOG('ERROR', 'parsing error: %s', e)
+        PERF.stop('parse', start, self)
+
 
+# Publish a new FleetSnapshot of APS, must be called with APS_LOCK held
+def publish_fleet():
+    global FLEET
 
-# Check whether an active node is AP or not
+    aps = tuple(APS.values())
+    FLEET = FleetSnapshot(FLEET.version + 1, aps, tuple(r for a in aps for r in a.radios.values()))
+    LOG('DEBUG', 'Fleet snapshot v%d published, %d APs', FLEET.version, len(aps))
+
+
+# Check whether an active node is AP or not, and monitor it if so
 def detect_ap(node):
+    if setup_ap(node):
+        while True:
+            node.update_ap_stats()
+            # a lost SSH session is reconnected when it's due, not every poll
+            time.sleep(max(AP_POLL_INTERVAL, node.retry_at - time.time() if not node.shell else 0))
+
+# Check whether an active node is AP or not, return True if it's added(or back
+# online) to the AP monitor list and its radios are set up
+def setup_ap(node):
     global NODES, NODES_LOCK, APS, APS_LOCK
 
     if not node.ssh_open():
@@ -742,17 +2945,18 @@ def detect_ap(node):
         NODES_LOCK.acquire()
         del NODES[node.ip]
         NODES_LOCK.release()
+        return False
     else:
         out = node.ssh_cmd_lines("show interface | in " + IFNAME_WIFI0 + "\n")
         if not out or len(out) == 0 or 'Wifi0' not in ''.join(out):
             NODES_LOCK.acquire()
             del NODES[node.ip]
             NODES_LOCK.release()
+            return False
         else:
             LOG('INFO', "Node %s added to node list", node)
 
-            node.ssh_cmd("console timeout 0\n")
-            node.ssh_cmd("console page 0\n")
+            node.ssh_setup()
             try:
                 tmp = node.ssh_cmd_lines("show interface | in mgt0\n")
                 node.mac = tmp[0].split()[1]
@@ -764,6 +2968,7 @@ def detect_ap(node):
                 NODES_LOCK.acquire()
                 del NODES[node.ip]
                 NODES_LOCK.release()
+                return False
 
             if node.name[:2] == 'SR':
                 LOG('ALERT', 'Treat SR switch as AP by mistake, out:\n%s', out)
@@ -773,12 +2978,13 @@ def detect_ap(node):
                 if node.active:
                     LOG('WARN', 'Try to add duplicated AP %s, ignore', node)
                     APS_LOCK.release()
-                    return
+                    return False
                 else:
                     node.active = True
                     LOG('INFO', 'AP %s back online', node)
             else:
                 APS[node.ip] = node
+                publish_fleet()
                 LOG('INFO', '%s added to AP monitor list', node)
             APS_LOCK.release()
 
@@ -786,40 +2992,545 @@ def detect_ap(node):
             out = node.ssh_cmd_lines("show interface | in " + IFNAME_WIFI1 + "\n")
             if out and len(out) > 0:
                 node.setup_radio(IFNAME_WIFI1, out[0].split()[1], out[0].split()[3], node)
+            return True
 
-            while True:
-                node.update_ap_stats()
-                time.sleep(0.5)
+
+# An AP's poll cycle driven by PollEngine, a poll cycle is done by one or more
+# SSH transactions(list of pipelined cmds)
+class PollSession(object):
+    def __init__(self, ap):
+        self.ap = ap
+        self.poll_cmds = None   # all cmds of the poll cycle
+        self.outs = []          # outputs of the done cmds of the poll cycle
+        self.txns = []          # remaining transactions of the poll cycle
+        self.sinks = None       # sinks of the poll cycle cmds, see SSHOutputStream
+        self.cmds = None        # cmds of the in-flight transaction, None if idle
+        self.stream = None      # SSHOutputStream of the in-flight transaction
+        self.error = None       # the first exception raised by sinks in the poll cycle
+        self.start = 0          # start time of the in-flight transaction
+        self.poll_start = 0     # start time of the poll cycle, if timed, see PerfStats
+        self.last_recv = 0      # last time any output is received
+        self.deadline = 0       # overall deadline of the in-flight transaction
+        self.next_poll = 0      # time to start next poll cycle
+        self.ticket = None      # PollScheduler ticket while waiting to start a poll cycle
+        self.busy = False       # SSH is being opened by a worker thread
+
+    def __str__(self):
+        return "PollSession(%s)-%s" % (self.ap, 'busy' if self.busy else self.cmds)
+
+    def __repr__(self):
+        return self.__str__()
+
+# Event loop polling engine, it drives poll cycles of all APs from one thread,
+# by non-blocking SSH I/O on all AP shells multiplexed by poll()/select(),
+# instead of a blocking thread per AP. The blocking SSH connection setup is 
+# done by a small pool of worker threads. Only 'prompt' SSH read mode is supported
+class PollEngine(object):
+    def __init__(self, workers=POLL_ENGINE_WORKERS):
+        self.workers = workers
+        self.jobs = Queue.Queue()           # blocking jobs for worker threads
+        self.new_sessions = Queue.Queue()   # sessions to be added to the event loop
+        self.sessions = []                  # only accessed by the event loop thread
+        self.due = collections.deque()      # sessions waiting for scheduler to start poll cycle
+
+    def start(self):
+        for i in range(self.workers):
+            t = threading.Thread(target=self.worker, name="pollWorkerThread_"+str(i))
+            t.setDaemon(True)
+            t.start()
+        t = threading.Thread(target=self.loop, name="pollLoopThread")
+        t.setDaemon(True)
+        t.start()
+
+    def worker(self):
+        while True:
+            job = self.jobs.get()
+            try:
+                job()
+            except Exception as e:
+                LOG('ERROR', 'poll engine job error: %s', e)
+
+    # check whether 'node' is AP, and poll it in the event loop if so
+    def detect(self, node):
+        self.jobs.put(functools.partial(self.setup, node))
+
+    def setup(self, node):
+        if setup_ap(node):
+            self.new_sessions.put(PollSession(node))
+
+    def reopen(self, session):
+        ap = session.ap
+        ap.ssh_reconnect()
+        session.next_poll = time.time() if ap.shell else ap.retry_at
+        session.busy = False
+
+    # wait at most 'timeout' seconds until any of 'fds' is readable
+    @staticmethod
+    def wait(fds, timeout):
+        if not fds:
+            time.sleep(timeout)
+            return []
+        if hasattr(select, 'poll'):     # no FD_SETSIZE limit
+            p = select.poll()
+            for fd in fds:
+                p.register(fd, select.POLLIN)
+            return [fd for fd, event in p.poll(timeout * 1000)]
+        return select.select(fds, [], [], timeout)[0]
+
+    def loop(self):
+        while True:
+            while not self.new_sessions.empty():
+                self.sessions.append(self.new_sessions.get())
+
+            now = time.time()
+            inflight = {}   # key: shell fileno, value: PollSession
+            for s in self.sessions:
+                try:
+                    if s.busy or s.ticket:
+                        continue
+                    if s.cmds is None and now >= s.next_poll:
+                        if not s.ap.shell:
+                            # connection lost and due to reconnect, try to open
+                            # SSH in a worker thread
+                            s.busy = True
+                            self.jobs.put(functools.partial(self.reopen, s))
+                            continue
+                        s.ticket = SCHEDULER.enqueue(PollScheduler.CMD)
+                        self.due.append(s)
+                    elif s.cmds is not None:
+                        if now - s.last_recv >= SSH_LOST_TIMEOUT:
+                            self.txn_lost(s)
+                        elif now >= s.deadline:
+                            self.txn_end(s, truncated=True)
+                        else:
+                            inflight[s.ap.shell.fileno()] = s
+                except Exception as e:
+                    LOG('ERROR', '%s poll error: %s', s, e)
+
+            # start poll cycles in FIFO order, as many as the scheduler allows
+            while self.due and SCHEDULER.try_grant(self.due[0].ticket):
+                s = self.due.popleft()
+                s.ticket = None
+                try:
+                    self.poll_begin(s)
+                    if s.cmds is not None:
+                        inflight[s.ap.shell.fileno()] = s
+                except Exception as e:
+                    LOG('ERROR', '%s poll error: %s', s, e)
+
+            for fd in PollEngine.wait(inflight.keys(), POLL_ENGINE_TICK):
+                s = inflight[fd]
+                try:
+                    self.txn_recv(s)
+                except Exception as e:
+                    LOG('ERROR', '%s poll error: %s', s, e)
+
+    # start a poll cycle, the scheduler cmd slot is already granted
+    def poll_begin(self, s):
+        ap = s.ap
+        if not ap.shell or not ap.ssh_lock.acquire(False):
+            # SSH is lost or used by others(e.g. CLIs from GUI), try next time
+            SCHEDULER.release(PollScheduler.CMD)
+            return
+
+        s.poll_start = PERF.start()
+        s.poll_cmds, delays, s.sinks = ap.poll_cmds()
+        s.outs = []
+        s.error = None
+        s.txns = [s.poll_cmds] if ap.pipelined else [[cmd] for cmd in s.poll_cmds]
+        self.txn_begin(s)
+
+    def txn_begin(self, s):
+        ap = s.ap
+        s.cmds = s.txns.pop(0)
+        s.stream = SSHOutputStream(ap, s.cmds, s.sinks)
+        s.start = s.last_recv = time.time()
+        s.deadline = s.start + SSH_CMD_TIMEOUT * len(s.cmds)
+        try:
+            ap.ssh_drain()  # ready out whatever garbage that left last time
+            ap.shell.sendall(''.join(s.cmds))
+            ap.shell.settimeout(0)
+        except Exception:
+            self.txn_lost(s)
+
+    def txn_recv(self, s):
+        try:
+            data = s.ap.shell.recv(SSH_RECV_CHUNK_LEN)
+        except socket.timeout:
+            return
+        except Exception:
+            self.txn_lost(s)
+            return
+        if not data:
+            self.txn_lost(s)    # channel closed
+            return
+        s.last_recv = time.time()
+        if s.stream.feed(data):
+            self.txn_end(s)
+
+    def txn_end(self, s, truncated=False):
+        ap = s.ap
+        if truncated:
+            if not s.stream.size:
+                self.txn_lost(s)
+                return
+            LOG('WARN', 'Node %s no prompt in %ss, output might be truncated', ap.ip,
+                s.deadline - s.start)
+        txn = ' + '.join([cmd.strip() for cmd in s.cmds])
+        ap.ssh_cmd_stat(txn, time.time() - s.start)
+        LOG('DEBUG', '%s: %d chars output of "%s"', ap.ip, s.stream.size, txn)
+
+        if s.stream.misordered:
+            # can't be pipelined, redo the cmds one per transaction
+            LOG('WARN', 'Node %s echoes cmds out of order, stop pipelining cmds', ap.ip)
+            ap.pipelined = False
+            s.stream.reset()
+            s.txns = [[cmd] for cmd in s.cmds] + s.txns
+        else:
+            s.outs += s.stream.outs()
+            s.error = s.error or s.stream.error
+        if s.txns:
+            self.txn_begin(s)
+            return
+
+        s.cmds = None
+        ap.shell.settimeout(SSH_LOST_TIMEOUT)
+        ap.ssh_lock.release()
+        SCHEDULER.release(PollScheduler.CMD)
+        ap.ssh_up()
+        s.next_poll = time.time() + AP_POLL_INTERVAL
+        if s.error:
+            LOG('ERROR', 'parsing error: %s', s.error)
+            return
+        ap.update_radios(dict(zip(s.poll_cmds, s.outs)))
+        PERF.stop('poll', s.poll_start, ap)
+
+    def txn_lost(self, s):
+        cmds = s.cmds
+        s.cmds = None
+        try:
+            # release ssh_lock and scheduler cmd slot
+            s.ap.ssh_lost(' + '.join([cmd.strip() for cmd in cmds]))
+        except SSHLostException:
+            pass
+        s.next_poll = s.ap.retry_at
+
+
+# Addresses of 'subnet': 'x.y.z.n/mask'(without the network and broadcast
+# addresses), a single 'x.y.z.n', or a list of addresses. At most 'limit' of them
+def subnet_addrs(subnet, limit=DISCOVERY_MAX_ADDRS):
+    if isinstance(subnet, list):
+        addrs = subnet
+    elif '/' in subnet:
+        ip, bits = subnet.split('/')
+        bits = int(bits)
+        mask = (0xffffffff << (32 - bits)) & 0xffffffff
+        net = struct.unpack('!I', inet_aton(ip))[0] & mask
+        first, last = net, net | (~mask & 0xffffffff)
+        if bits < 31:
+            first, last = first + 1, last - 1
+        if last - first + 1 > limit:
+            LOG('ERROR', 'Subnet %s has %d addresses, only the first %d are probed', subnet, 
+                last - first + 1, limit)
+            last = first + limit - 1
+        addrs = [inet_ntoa(struct.pack('!I', n)) for n in xrange(first, last + 1)]
+    else:
+        addrs = [subnet]
+    return addrs[:limit]
+
+# Detect new APs in a subnet incrementally: each address is probed when it's
+# due, known nodes are skipped, and an address which doesn't answer the SSH
+# port(or answers, but isn't an AP) is probed again after exponential backoff,
+# from NEW_NODE_DETECT_INTERVAL up to DISCOVERY_MAX_BACKOFF seconds. Probes are
+# rate limited and capped in flight, the thread sleeps until the next address
+# is due. Nodes are probed by TCP SYN by scapy if running as root, or by
+# non-blocking TCP connect otherwise
+class NodeDiscovery(object):
+    def __init__(self, subnet, probe=DISCOVERY_PROBE):
+        if probe == 'auto':
+            probe = 'syn' if sr and os.geteuid() == 0 else 'connect'
+        if probe == 'syn' and not sr:
+            LOG('WARN', 'Probing nodes by TCP SYN requires python module scapy, use TCP connect instead')
+            probe = 'connect'
+        self.probe = probe
+        self.addrs = subnet_addrs(subnet)
+        self.due = [(0, i, ip) for i, ip in enumerate(self.addrs)]   # heap of (due time, order, ip)
+        self.fails = {}         # key: ip, value: num of probes since the node was known
+        self.probes = 0         # num of probes sent
+        self.answers = 0        # num of probes answered
+
+    def __str__(self):
+        return "NodeDiscovery(%d addresses by %s, %d probes, %d answered)" % \
+            (len(self.addrs), self.probe, self.probes, self.answers)
+
+    def __repr__(self):
+        return self.__str__()
+
+    def start(self):
+        LOG('INFO', 'Probing %d addresses for new APs, by TCP %s', len(self.addrs), self.probe)
+        t = threading.Thread(target=self.loop_syn if self.probe == 'syn' else self.loop_connect, 
+                name="apsDetectThread")
+        t.setDaemon(True)
+        t.start()
+
+    # pop at most 'limit' unknown addresses due at 'now', known nodes are only
+    # checked again later whether they're still known(e.g. not an AP). A node
+    # still being set up is checked again soon, as it's dropped if the setup fails
+    def take(self, now, limit):
+        ips = []
+        while self.due and self.due[0][0] <= now and len(ips) < limit:
+            t, i, ip = heapq.heappop(self.due)
+            if ip in NODES:
+                self.fails.pop(ip, None)
+                delay = DISCOVERY_MAX_BACKOFF if ip in APS else NEW_NODE_DETECT_INTERVAL
+                heapq.heappush(self.due, (now + delay, i, ip))
+            else:
+                ips.append((i, ip))
+        return ips
+
+    # the probe of 'ip' is done, monitor the node if answered, and probe it
+    # again after backoff, unless it becomes a known AP meanwhile
+    def done(self, i, ip, answered):
+        fails = self.fails[ip] = self.fails.get(ip, 0) + 1
+        if answered:
+            self.answers += 1
+            monitor_node(ip)
+        delay = min(NEW_NODE_DETECT_INTERVAL * 2 ** min(fails - 1, 16), DISCOVERY_MAX_BACKOFF)
+        heapq.heappush(self.due, (time.time() + delay * uniform(0.75, 1.25), i, ip))
+
+    # sleep until the next address is due
+    def wait_due(self):
+        wait = self.due[0][0] - time.time() if self.due else DISCOVERY_MAX_BACKOFF
+        if wait > 0:
+            if SCHEDULER.depth(PollScheduler.HANDSHAKE) or SCHEDULER.depth(PollScheduler.CMD):
+                LOG('INFO', 'Poll scheduler: %s', SCHEDULER)
+            time.sleep(min(wait, DISCOVERY_MAX_BACKOFF))
+
+    # probe due addresses in batches by TCP SYN, sent at DISCOVERY_RATE
+    def loop_syn(self):
+        while True:
+            batch = self.take(time.time(), DISCOVERY_INFLIGHT)
+            if not batch:
+                self.wait_due()
+                continue
+            self.probes += len(batch)
+            ans, unans = sr(IP(dst=[ip for i, ip in batch])/TCP(dport=SSH_PORT), 
+                    timeout=SSH_NODE_PROBE_TIMEOUT, inter=1.0 / DISCOVERY_RATE, verbose=0)
+            # the SSH port is open if answered by SYN-ACK, rather than RST
+            opened = set(r[IP].src for s, r in ans if r[TCP].flags & 0x12 == 0x12)
+            for i, ip in batch:
+                self.done(i, ip, ip in opened)
+
+    # probe due addresses by non-blocking TCP connect, a new probe starts as soon
+    # as one is done, at DISCOVERY_RATE
+    def loop_connect(self):
+        inflight = {}   # key: socket fileno, value: (socket, order, ip, deadline)
+        next_send = 0
+        while True:
+            now = time.time()
+            batch = self.take(now, 1) if now >= next_send and len(inflight) < DISCOVERY_INFLIGHT else []
+            if batch:
+                i, ip = batch[0]
+                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                sock.setblocking(0)
+                err = sock.connect_ex((ip, SSH_PORT))
+                self.probes += 1
+                if err in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+                    inflight[sock.fileno()] = (sock, i, ip, now + SSH_NODE_PROBE_TIMEOUT)
+                else:
+                    sock.close()
+                    self.done(i, ip, False)
+                # bursts of up to 1 second of probes
+                next_send = max(next_send, now - 1) + 1.0 / DISCOVERY_RATE
+                continue
+            if not inflight:
+                if not self.due or self.due[0][0] > now:
+                    self.wait_due()
+                elif now < next_send:
+                    time.sleep(next_send - now)
+                continue
+
+            timeout = min(v[3] for v in inflight.values()) - now
+            if self.due and len(inflight) < DISCOVERY_INFLIGHT:
+                timeout = min(timeout, max(self.due[0][0], next_send) - now)
+            for fd in NodeDiscovery.wait_writable(inflight.keys(), max(timeout, 0)):
+                sock, i, ip, deadline = inflight.pop(fd)
+                self.done(i, ip, sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0)
+                sock.close()
+            now = time.time()
+            for fd, (sock, i, ip, deadline) in inflight.items():
+                if now >= deadline:
+                    del inflight[fd]
+                    sock.close()
+                    self.done(i, ip, False)
+
+    # wait at most 'timeout' seconds until any of 'fds' is writable(connected or failed)
+    @staticmethod
+    def wait_writable(fds, timeout):
+        if hasattr(select, 'poll'):     # no FD_SETSIZE limit
+            p = select.poll()
+            for fd in fds:
+                p.register(fd, select.POLLOUT)
+            return [fd for fd, event in p.poll(timeout * 1000)]
+        return select.select([], fds, [], timeout)[1]
+
+def discovery_stats_report():
+    if DISCOVERY:
+        LOG('INFO', 'Node discovery: %s', DISCOVERY)
 
 
-# Detect new APs in a subnet, and open a SSH shell channel to them respectively
-def detect_new_aps(subnet):
+# Check whether the node at 'ip' is AP and monitor it if so, unless it's known
+def monitor_node(ip):
     global NODES, NODES_LOCK
 
-    while True:
-        # 'ping' port 22 of all nodes in the subnet, to check if they have SSH service
-        ans,unans = sr(IP(dst=subnet)/TCP(dport=22), timeout=SSH_NODE_PROBE_TIMEOUT)
-        if len(ans) > 0:
-            for (s, r) in ans:     # a list of all alive IP strings
-                ip = r[IP].src
+    # Ignore exisitng node, rely on node's IP not changing
+    NODES_LOCK.acquire()
+    if ip in NODES:
+        NODES_LOCK.release()
+        return
+    node = AP(ip)
+    NODES[node.ip] = node
+    NODES_LOCK.release()
 
-                # Ignore exisitng node, rely on node's IP not changing
-                NODES_LOCK.acquire()
-                if ip in NODES:
-                    NODES_LOCK.release()
-                    continue
+    if POLL_ENGINE:
+        POLL_ENGINE.detect(node)
+        return
 
-                node = AP(ip)
-                NODES[node.ip] = node
-                NODES_LOCK.release()
+    # AP connection and verification is timing consuming, and might make us
+    # miss the ACSP starting procedure if there are many APs in the subnet.
+    # So we start a thread for each node to do the work concurrently
+    t = threading.Thread(target=detect_ap, args=(node,), name="apDetectThread_"+str(node.ip))
+    t.setDaemon(True)
+    t.start()
+
+
+# CLIs sent to a list of APs in the background, see CLIJobEngine. The APs are
+# started on in waves of 'wave' APs(all in one wave if 0), a wave starts after
+# the previous one is done, and only if no AP failed in it. At most 'rate' APs
+# are started on per second(no limit if 0). The outputs or error are collected per AP
+class CLIJob(object):
+    count = 0
+
+    def __init__(self, clis, aps, rate=CLI_JOB_RATE, wave=CLI_JOB_WAVE):
+        CLIJob.count += 1
+        self.id = CLIJob.count
+        self.clis = clis
+        self.aps = list(aps)
+        self.rate = rate
+        self.wave = wave or len(self.aps)
+        self.cond = threading.Condition()   # to wait for the APs of a wave done
+        self.results = {}       # key: AP, value: tuple (ok, output lines of all CLIs or error)
+        self.skipped = []       # APs not started on, because an AP failed in an earlier wave
+        self.start = None
+        self.end = None
 
-                # AP connection and verification is timing consuming, and might make us
-                # miss the ACSP starting procedure if there are many APs in the subnet.
-                # So we start a thread for each node to do the work concurrently
-                t = threading.Thread(target=detect_ap, args=(node,), name="apDetectThread_"+str(node.ip))
-                t.setDaemon(True)
-                t.start()
-        time.sleep(NEW_NODE_DETECT_INTERVAL)
+    def __str__(self):
+        return 'CLI job #%d "%s" to %d APs' % (self.id, ';'.join(self.clis), len(self.aps))
+
+    def __repr__(self):
+        return self.__str__()
+
+    def failed(self):
+        return [ap for ap, (ok, out) in self.results.items() if not ok]
+
+    # run all CLIs on 'ap', by a worker thread
+    def run_ap(self, ap):
+        lines = []
+        try:
+            for cli in self.clis:
+                out = ap.ssh_cmd_lines(cli+'\n')
+                if out is None:
+                    raise SSHLostException('Node '+ap.ip+' not connected')
+                errors = [PTN_SSH['cli_error'].search(l) for l in out]
+                errors = [e.group(1).strip() for e in errors if e]
+                if errors:
+                    raise Exception('CLI "%s": %s' % (cli, errors[0]))
+                lines += out
+            result = (True, lines)
+            LOG('INFO', 'CLI "%s" issued to %s', ';'.join(self.clis), ap)
+        except Exception as e:
+            result = (False, str(e))
+            LOG('ERROR', 'CLI "%s" failed to issue to %s: %s', ';'.join(self.clis), ap, e)
+        self.cond.acquire()
+        self.results[ap] = result
+        self.cond.notify()
+        self.cond.release()
+
+    # start on the APs wave by wave, by the job's own thread
+    def run(self, engine):
+        self.start = time.time()
+        for i in range(0, len(self.aps), self.wave):
+            wave = self.aps[i:i+self.wave]
+            if self.failed():
+                self.skipped = self.aps[i:]
+                LOG('WARN', '%s: %d APs failed, %d APs left are skipped', self, len(self.failed()),
+                    len(self.skipped))
+                break
+            for n, ap in enumerate(wave):
+                if self.rate and n:
+                    time.sleep(1.0 / self.rate)
+                engine.jobs.put(functools.partial(self.run_ap, ap))
+            self.cond.acquire()
+            while len(self.results) < i + len(wave):
+                self.cond.wait(1)
+            self.cond.release()
+        self.end = time.time()
+        LOG('INFO', '%s done in %.1fs, %d succeeded, %d failed, %d skipped', self, self.end - self.start,
+            len(self.results) - len(self.failed()), len(self.failed()), len(self.skipped))
+
+# Background engine of bulk CLIs, so that neither the GUI thread nor the AP
+# pollers wait for them. CLIs are sent to 'workers' APs in parallel, the SSH
+# transactions are still capped by the PollScheduler. Worker threads are started
+# by the first job
+class CLIJobEngine(object):
+    def __init__(self, workers=CLI_JOB_WORKERS):
+        self.workers = workers
+        self.jobs = Queue.Queue()   # CLIs to be run on an AP, by worker threads
+        self.history = []           # all submitted CLIJob instances
+        self.started = False
+
+    def __len__(self):
+        return len(self.history)
+
+    def start(self):
+        for i in range(self.workers):
+            t = threading.Thread(target=self.worker, name="cliJobWorkerThread_"+str(i))
+            t.setDaemon(True)
+            t.start()
+        self.started = True
+
+    def worker(self):
+        while True:
+            job = self.jobs.get()
+            try:
+                job()
+            except Exception as e:
+                LOG('ERROR', 'CLI job error: %s', e)
+
+    # send 'clis'(list of CLI strings) to 'aps' in the background, return the CLIJob
+    def submit(self, clis, aps, rate=CLI_JOB_RATE, wave=CLI_JOB_WAVE):
+        if not self.started:
+            self.start()
+        job = CLIJob(clis, aps, rate, wave)
+        self.history.append(job)
+        t = threading.Thread(target=job.run, args=(self,), name="cliJobThread_"+str(job.id))
+        t.setDaemon(True)
+        t.start()
+        LOG('INFO', '%s submitted', job)
+        return job
+
+def cli_jobs_report():
+    if not CLI_JOBS.history:
+        return
+    LOG('INFO', 'CLI jobs summary(%d workers):', CLI_JOBS.workers)
+    for job in CLI_JOBS.history:
+        took = '%.1fs' % ((job.end or time.time()) - (job.start or time.time()))
+        LOG('INFO', '  %s: %s %s, %d failed, %d skipped', job, 'done in' if job.end else 'running for',
+            took, len(job.failed()), len(job.skipped))
+        for ap in job.failed():
+            LOG('INFO', '    %s: %s', ap, job.results[ap][1])
+
+CLI_JOBS = CLIJobEngine()
 
 
 # Calculate the distance between point p1(x1, y1) and p2(x2, y2), a and b are tuples
@@ -842,7 +3553,7 @@ def distance(p1, p2):
 #   1) & 4), or d < |r1 - r2| but not compensated: (-1, None)
 #   2) d < |r1 - r2| & compensated: (0, [(x, y)])
 #   3): (1, [(x, y)])
-#   4): (2, [(x1, y1), (x2, y2)])
+#   4): (2, [(x1, y1), (x2, y2)]), the point with smaller y(i.e. the upper one on canvas) first
 # The caller should check the return code of this function's return value to tell which case
 #
 def circles_cpoints(c1, r1, c2, r2, compensate=False):
@@ -859,13 +3570,17 @@ def circles_cpoints(c1, r1, c2, r2, compensate=False):
             has_compensated = True
 
         if d >= abs(r1 - r2) and d <= r1 + r2:
-            try:
-                p1 = (((y1 - y2)*(-x1**2*y1 - x1**2*y2 + 2*x1*x2*y1 + 2*x1*x2*y2 - x2**2*y1 - x2**2*y2 - y1**3 + y1**2*y2 + y1*y2**2 + y1*r1**2 - y1*r2**2 - y2**3 - y2*r1**2 + y2*r2**2 + sqrt((x1 - x2)**2*(-x1**2 + 2*x1*x2 - x2**2 - y1**2 + 2*y1*y2 - y2**2 + r1**2 + 2*r1*r2 + r2**2)*(x1**2 - 2*x1*x2 + x2**2 + y1**2 - 2*y1*y2 + y2**2 - r1**2 + 2*r1*r2 - r2**2))) + (x1**2 - x2**2 + y1**2 - y2**2 - r1**2 + r2**2)*(x1**2 - 2*x1*x2 + x2**2 + y1**2 - 2*y1*y2 + y2**2))/(2*(x1 - x2)*(x1**2 - 2*x1*x2 + x2**2 + y1**2 - 2*y1*y2 + y2**2)), (sqrt((x1 - x2)**2*(-x1**2 + 2*x1*x2 - x2**2 - y1**2 + 2*y1*y2 - y2**2 + r1**2 + 2*r1*r2 + r2**2)*(x1**2 - 2*x1*x2 + x2**2 + y1**2 - 2*y1*y2 + y2**2 - r1**2 + 2*r1*r2 - r2**2))*(-x1**2 + 2*x1*x2 - x2**2 - y1**2 + 2*y1*y2 - y2**2) + (x1**2 - 2*x1*x2 + x2**2 + y1**2 - 2*y1*y2 + y2**2)*(x1**2*y1 + x1**2*y2 - 2*x1*x2*y1 - 2*x1*x2*y2 + x2**2*y1 + x2**2*y2 + y1**3 - y1**2*y2 - y1*y2**2 - y1*r1**2 + y1*r2**2 + y2**3 + y2*r1**2 - y2*r2**2))/(2*(x1**2 - 2*x1*x2 + x2**2 + y1**2 - 2*y1*y2 + y2**2)**2)) 
-                p2 = (-((y1 - y2)*(x1**2*y1 + x1**2*y2 - 2*x1*x2*y1 - 2*x1*x2*y2 + x2**2*y1 + x2**2*y2 + y1**3 - y1**2*y2 - y1*y2**2 - y1*r1**2 + y1*r2**2 + y2**3 + y2*r1**2 - y2*r2**2 + sqrt((x1 - x2)**2*(-x1**2 + 2*x1*x2 - x2**2 - y1**2 + 2*y1*y2 - y2**2 + r1**2 + 2*r1*r2 + r2**2)*(x1**2 - 2*x1*x2 + x2**2 + y1**2 - 2*y1*y2 + y2**2 - r1**2 + 2*r1*r2 - r2**2))) - (x1**2 - x2**2 + y1**2 - y2**2 - r1**2 + r2**2)*(x1**2 - 2*x1*x2 + x2**2 + y1**2 - 2*y1*y2 + y2**2))/(2*(x1 - x2)*(x1**2 - 2*x1*x2 + x2**2 + y1**2 - 2*y1*y2 + y2**2)), (x1**2*y1 + x1**2*y2 - 2*x1*x2*y1 - 2*x1*x2*y2 + x2**2*y1 + x2**2*y2 + y1**3 - y1**2*y2 - y1*y2**2 - y1*r1**2 + y1*r2**2 + y2**3 + y2*r1**2 - y2*r2**2 + sqrt((x1 - x2)**2*(-x1**2 + 2*x1*x2 - x2**2 - y1**2 + 2*y1*y2 - y2**2 + r1**2 + 2*r1*r2 + r2**2)*(x1**2 - 2*x1*x2 + x2**2 + y1**2 - 2*y1*y2 + y2**2 - r1**2 + 2*r1*r2 - r2**2)))/(2*(x1**2 - 2*x1*x2 + x2**2 + y1**2 - 2*y1*y2 + y2**2)))
-            except Exception:
-                LOG('ERROR', 'Failed to compute cpoints of (%s, %s) + (%s, %s) + comp %s', \
-                        c1, r1, c2, r2, compensate)
-                raise
+            # the cross points are on the line perpendicular to c1->c2, which
+            # crosses c1->c2 at 'a' from c1, and 'h' away from c1->c2 at each side
+            a = (r1**2 - r2**2 + d**2) / (2.0 * d)
+            h = sqrt(max(r1**2 - a**2, 0))
+            ux, uy = (x2 - x1) / d, (y2 - y1) / d
+            mx, my = x1 + a * ux, y1 + a * uy
+            ox, oy = -h * uy, h * ux
+            if oy > 0 or (oy == 0 and ox > 0):  # the cross point with smaller y(then x) first
+                ox, oy = -ox, -oy
+            p1 = (mx + ox, my + oy)
+            p2 = (mx - ox, my - oy)
 
             if d == r1 + r2 or d == abs(r1 - r2):
                 points = (0 if has_compensated else 1, [p1])
@@ -874,6 +3589,44 @@ def circles_cpoints(c1, r1, c2, r2, compensate=False):
 
     return points
 
+# Vectorized circles_cpoints() of N circle pairs, c1/c2 are Nx2 arrays of the
+# centers, r1/r2 are arrays of N radiuses. Return tuple (codes, points), codes is
+# an array of N return codes, the same as circles_cpoints(), points is a Nx2x2
+# array of the cross points, both are p1 if only 1 point, nan if none
+def circles_cpoints_batch(c1, r1, c2, r2, compensate=False):
+    c1, c2 = np.asarray(c1, float), np.asarray(c2, float)
+    r1, r2 = np.array(r1, float), np.array(r2, float)
+    delta = c2 - c1
+    d = np.sqrt((delta**2).sum(axis=1))
+    nonzero = d != 0
+
+    compensated = np.zeros(len(d), bool)
+    if compensate:
+        compensated = nonzero & (d < abs(r1 - r2))
+        small1 = compensated & (r1 < r2)
+        small2 = compensated & ~(r1 < r2)
+        r1[small1] += r2[small1] - r1[small1] - d[small1]
+        r2[small2] += r1[small2] - r2[small2] - d[small2]
+
+    cross = nonzero & (d >= abs(r1 - r2)) & (d <= r1 + r2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        a = (r1**2 - r2**2 + d**2) / (2.0 * d)
+        h = np.sqrt(np.maximum(r1**2 - a**2, 0))
+        u = delta / d[:, None]
+    m = c1 + a[:, None] * u
+    o = np.column_stack((-h * u[:, 1], h * u[:, 0]))
+    flip = (o[:, 1] > 0) | ((o[:, 1] == 0) & (o[:, 0] > 0))
+    o[flip] = -o[flip]
+
+    tangent = (d == r1 + r2) | (d == abs(r1 - r2))
+    codes = np.where(tangent, np.where(compensated, 0, 1), 2)
+    codes[~cross] = -1
+    points = np.empty((len(d), 2, 2))
+    points[:, 0] = m + o
+    points[:, 1] = np.where(tangent[:, None], m + o, m - o)
+    points[~cross] = np.nan
+    return codes, points
+
 
 # Get a reference nbr radio, and calculate its path loss to this radio. 
 # If ref1_rd or ref2_rd is given, the returned reference radio should not be on 
@@ -947,23 +3700,264 @@ def get_ref_nbr(ref_nbrs0, rref_nbrs0, ref_nbrs1, rref_nbrs1,
     return (ref_rd, fspl, ghz)
 
 
+# Least-squares multilateration of all APs at once('lsq' coord method), which
+# minimizes sum(w * (|c_i - c_j| - d_ij)^2) over all nbr links of 'aps', where
+# d_ij is the FSPL distance of a link, and w its weight: SNR / d_ij^2, since the
+# FSPL distance error grows with the distance, and weak signals jitter more.
+# Located APs start from their current coordinates, so the layout doesn't jump
+# between calculations, see lsq_place_new() for APs never located.
+# Output: num of Gauss-Newton iterations done, AP.coord_residual is set
+def calc_ap_coord_lsq(aps):
+    index = dict((ap, i) for i, ap in enumerate(aps))
+    src, dst, fspl, ghz, snr = [], [], [], [], []
+    for i, ap in enumerate(aps):
+        for rd in ap.radios.values():
+            for nbr in rd.nbrs.values():
+                j = index.get(nbr.radio.ap)
+                if j is None or j == i or not nbr.radio.txpwr or not nbr.radio.chnl:
+                    continue
+                src.append(i)
+                dst.append(j)
+                fspl.append(nbr.radio.txpwr - nbr.rssi)
+                ghz.append(Radio.ieee2ghz(nbr.radio.chnl))
+                snr.append(nbr.rssi - RF_AVR_NFLOOR)
+    if not src:
+        return 0
+
+    n = len(aps)
+    src, dst = np.array(src), np.array(dst)
+    dist = np.power(10, (np.array(fspl, float) - 32.44 - 20*np.log10(ghz)) / 20) / CANVAS_METER_PER_DOT
+    dist = np.maximum(dist, 1)
+    w = np.maximum(np.array(snr, float), 1) / dist**2
+
+    # links between the same 2 APs(both directions, both radios) are merged into
+    # one of the weighted average length, which has the same least squares
+    pairs, link = np.unique(np.minimum(src, dst) * n + np.maximum(src, dst), return_inverse=True)
+    src, dst = pairs // n, pairs % n
+    wsum = np.bincount(link, w)
+    dist = np.bincount(link, w * dist) / wsum
+    w = wsum / wsum.max()
+
+    c = np.array([ap.radios[IFNAME_WIFI0].c for ap in aps], float)
+    new = ~c.any(axis=1)    # never located yet
+    if new.all():
+        c = lsq_landmark_init(n, src, dst, dist)
+    elif new.any():
+        lsq_place_new(c, new, src, dst, dist, w)
+    it = lsq_refine(c, src, dst, dist, w, COORD_LSQ_MAX_ITER)
+
+    # keep the fleet at the center of the canvas
+    c += [CANVAS_WIDTH/2, CANVAS_HEIGHT/2] - c.mean(axis=0)
+
+    ends, w2 = np.concatenate((src, dst)), np.concatenate((w, w))
+    res = np.sqrt(((c[src] - c[dst])**2).sum(axis=1)) - dist
+    rms = np.sqrt(np.bincount(ends, w2 * np.tile(res**2, 2), n) /
+                  np.maximum(np.bincount(ends, w2, n), 1e-12)) * CANVAS_METER_PER_DOT
+    for i, ap in enumerate(aps):
+        xy = [c[i, 0], c[i, 1]]
+        for rd in ap.radios.values():
+            rd.c = xy
+        ap.coord_residual = rms[i]
+    LOG('DEBUG', 'lsq located %d APs by %d links in %d iterations, residual(m) avg %.2f max %.2f',
+        n, len(dist), it, rms.mean(), rms.max())
+    return it
+
+# Refine coords 'c'(in place) of all APs together to fit links src->dst of
+# length 'dist' and weight 'w', by at most 'iters' Gauss-Newton iterations. The
+# normal equations are solved by conjugate gradient on numpy arrays of all
+# links, i.e. each iteration is linear to the num of links. Return iterations
+def lsq_refine(c, src, dst, dist, w, iters):
+    n = len(c)
+    if not len(src):
+        return 0
+    ends, w2 = np.concatenate((src, dst)), np.concatenate((w, w))
+
+    def jac_dot(v):         # J * v, J: d(link length)/d(coords)
+        dv = v[src] - v[dst]
+        return ux*dv[:, 0] + uy*dv[:, 1]
+
+    def jac_t_dot(y):       # J' * W * y, a link contributes to APs of both ends
+        wy = w * y
+        return np.column_stack((np.bincount(ends, np.concatenate((wy*ux, -wy*ux)), n),
+                                np.bincount(ends, np.concatenate((wy*uy, -wy*uy)), n)))
+
+    def cost(c):
+        return (w * (np.sqrt(((c[src] - c[dst])**2).sum(axis=1)) - dist)**2).sum()
+
+    cur = cost(c)
+    for it in range(1, iters + 1):
+        diff = c[src] - c[dst]
+        norm = np.maximum(np.sqrt((diff**2).sum(axis=1)), 1e-6)
+        ux, uy = diff[:, 0] / norm, diff[:, 1] / norm
+
+        # solve (J'WJ + damp) * step = -J'W * r by Jacobi preconditioned conjugate
+        # gradient, damped so APs with links all in one direction don't fly away
+        diag = np.column_stack((np.bincount(ends, w2 * np.tile(ux*ux, 2), n),
+                                np.bincount(ends, w2 * np.tile(uy*uy, 2), n)))
+        damp = 1e-3 * diag.mean() + 1e-12
+        diag += damp
+        step = np.zeros_like(c)
+        res = -jac_t_dot(norm - dist)
+        z = res / diag
+        p = z.copy()
+        rz = rz0 = (res * z).sum()
+        for k in range(COORD_LSQ_CG_ITER):
+            if rz <= 1e-4 * rz0:    # approximate step is good enough
+                break
+            q = jac_t_dot(jac_dot(p)) + damp * p
+            alpha = rz / (p * q).sum()
+            step += alpha * p
+            res -= alpha * q
+            z = res / diag
+            rz, rz_prev = (res * z).sum(), rz
+            p = z + (rz / rz_prev) * p
+
+        # halve the step until the cost doesn't increase
+        for k in range(8):
+            nxt = cost(c + step)
+            if nxt <= cur:
+                break
+            step /= 2
+        else:
+            break
+        c += step
+        cur = nxt
+        if np.abs(step).max() < COORD_LSQ_TOL:
+            break
+    return it
+
+# Initial coords of all APs when none is located: landmark MDS, i.e. classical
+# multidimensional scaling of the shortest path lengths between a few landmark
+# APs far from each other, and others are placed from their path lengths to the
+# landmarks. Rough but never folded, Gauss-Newton refines it later
+def lsq_landmark_init(n, src, dst, dist):
+    # all links in both directions, grouped by end AP for vectorized Bellman-Ford
+    a, b, d = np.concatenate((src, dst)), np.concatenate((dst, src)), np.concatenate((dist, dist))
+    order = np.argsort(b, kind='mergesort')
+    a, b, d = a[order], b[order], d[order]
+    starts = np.concatenate(([0], np.nonzero(np.diff(b))[0] + 1))
+    ends = b[starts]
+
+    def path_lengths(root):
+        lens = np.full(n, np.inf)
+        lens[root] = 0
+        for k in range(n):
+            nxt = lens.copy()
+            nxt[ends] = np.minimum(lens[ends], np.minimum.reduceat(lens[a] + d, starts))
+            if (nxt == lens).all():
+                break
+            lens = nxt
+        return lens
+
+    landmarks, lens = [0], [path_lengths(0)]
+    nearest = lens[0].copy()
+    for k in range(min(n, COORD_LSQ_LANDMARKS) - 1):
+        # the next landmark is the AP farthest from all landmarks
+        far = np.argmax(np.where(np.isfinite(nearest), nearest, -1))
+        if nearest[far] <= 0:
+            break
+        landmarks.append(far)
+        lens.append(path_lengths(far))
+        nearest = np.minimum(nearest, lens[-1])
+    sq = np.array(lens).T
+    sq[~np.isfinite(sq)] = sq[np.isfinite(sq)].max()    # APs not linked to others
+    sq **= 2                            # n x landmarks
+
+    lsq = sq[landmarks]
+    m = len(landmarks)
+    center = np.eye(m) - 1.0 / m
+    vals, vecs = np.linalg.eigh(-center.dot(lsq).dot(center) / 2)
+    top = np.argsort(vals)[::-1][:2]
+    vals = np.maximum(vals[top], 1e-9)
+    pinv = vecs[:, top] / np.sqrt(vals)     # landmarks x 2
+    c = -(sq - lsq.mean(axis=0)).dot(pinv) / 2
+    if len(top) < 2:
+        c = np.column_stack((c, np.zeros(n)))
+    return c + [CANVAS_WIDTH/2, CANVAS_HEIGHT/2]
+
+# Place APs which are never located('new' of coords 'c'), the one with most
+# located nbrs first: by linear least squares of its distances to 3+ located
+# nbrs, or away from the located APs if less nbrs. Errors would accumulate as
+# the located area grows, so all located APs are refined together each time
+# their num grows by a quarter
+def lsq_place_new(c, new, src, dst, dist, w):
+    nbrs = [[] for i in range(len(c))]
+    for i, j, d in zip(src, dst, dist):
+        nbrs[i].append((j, d))
+        nbrs[j].append((i, d))
+    located = ~new
+    if not located.any():
+        first = max(range(len(c)), key=lambda i: len(nbrs[i]))
+        c[first] = [CANVAS_WIDTH/2, CANVAS_HEIGHT/2]
+        located[first] = True
+    nlocated = np.zeros(len(c), int)     # num of located nbrs of each AP
+    for i in np.nonzero(located)[0]:
+        for j, d in nbrs[i]:
+            nlocated[j] += 1
+
+    refine_at = max(8, located.sum() * 5 / 4)
+    for k in range(int((~located).sum())):
+        i = np.argmax(np.where(located, -1, nlocated))
+        refs = {}
+        for j, d in nbrs[i]:
+            if located[j]:
+                refs.setdefault(j, []).append(d)
+        if len(refs) >= 3:
+            ref = np.array(refs.keys())
+            d = np.array([sum(v) / len(v) for v in refs.values()])
+            a = 2 * (c[ref[1:]] - c[ref[0]])
+            b = d[0]**2 - d[1:]**2 + (c[ref[1:]]**2).sum(axis=1) - (c[ref[0]]**2).sum()
+            c[i] = np.linalg.lstsq(a, b, rcond=None)[0]
+        elif refs:
+            j, d = refs.keys()[0], refs.values()[0][0]
+            away = c[j] - c[located].mean(axis=0)
+            if not away.any():
+                away = np.random.uniform(-1, 1, 2)
+            c[i] = c[j] + d * away / np.sqrt((away**2).sum())
+        else:   # not heard by any located AP yet
+            c[i] = [CANVAS_WIDTH/2, CANVAS_HEIGHT/2] + np.random.uniform(-1, 1, 2) * np.median(dist)
+        located[i] = True
+        for j, d in nbrs[i]:
+            nlocated[j] += 1
+
+        if located.sum() >= refine_at:
+            links = located[src] & located[dst]
+            lsq_refine(c, src[links], dst[links], dist[links], w[links], 5)
+            refine_at = located.sum() * 5 / 4
+
+# write positions of the APs which moved, in the headless mode
+def stream_positions(aps):
+    if STATE_STREAM:
+        for ap in aps:
+            STATE_STREAM.position(ap)
+
 # Calculate each AP's GUI coordinate related to others
 def calc_ap_coord():
-    global APS, APS_LOCK, RF_AVR_NFLOOR
+    global RF_AVR_NFLOOR
+
+    # AP whose coordinates are calculated -> the APs it's located from. Only APs
+    # whose nbr links changed(see ACSP.update_coord_dirty) and APs located from
+    # them are re-calculated, other APs keep their coordinates
+    located = {}
+    located_by = None   # the settings located APs are calculated by
+
+    def coord_solved(ap, ref_rds):
+        aps.append(ap)
+        located[ap] = set(r.ap for r in ref_rds)
+        for r in ap.radios.values():
+            r.coord_solved()
 
     while True:
         # Calculate average noise floor from all APs
         tot_nfloor = tot_radios = 0
-        APS_LOCK.acquire()
-        if APS:
-            for ip, ap in APS.items():
-                for name, radio in ap.radios.items():
-                    if radio.nfloor:
-                        tot_nfloor += radio.nfloor 
-                        tot_radios += 1
+        fleet = FLEET   # snapshot taken once a round, no AP lock is held while calculating
+        if fleet:
+            for radio in fleet.radios:
+                if radio.nfloor:
+                    tot_nfloor += radio.nfloor 
+                    tot_radios += 1
             if tot_radios > 0:
                 RF_AVR_NFLOOR = tot_nfloor / tot_radios
-        APS_LOCK.release()
 
         # "3-point locating' method:
         # An AP could be located by other 3 APs. Normally, 2 of the 3 APs have 2
@@ -989,19 +3983,52 @@ def calc_ap_coord():
         # calculated by the first 2 APs. After all APs done, the whole canvus
         # could be rotate/mirror to match the real layout
         #
-        # TODO: rssi/nfloor sometimes has jitters, so need to smooth them in a 
-        # time window(e.g. average of the last 5 times)
+        # rssi/nfloor sometimes has jitters, they're filtered over the last polls
+        # by the pollers(see SignalFilter)
         
-        APS_LOCK.acquire()
         # get a list of APs with wifi0 nbr score in ascending order
-        aps_nscore = [a for a in APS.values() if a.radios and a.radios[IFNAME_WIFI0].nbr_score]
+        aps_nscore = [a for a in fleet.aps if a.radios and a.radios[IFNAME_WIFI0].nbr_score]
         if APS_COORD_NBRSCORE_ORDER:
             aps_nscore = sorted(aps_nscore, key=lambda a: a.radios[IFNAME_WIFI0].nbr_score, reverse=True)
         LOG('DEBUG', 'aps_nscore: %s',  aps_nscore)
         LOG('DEBUG', 'nbr scores: %s', [a.radios[IFNAME_WIFI0].nbr_score for a in aps_nscore])
         # now each AP in aps_nscore have at least wifi0 with valid acsp nbrs
 
-        aps, aps_delayed = [], []
+        settings = (APS_COORD_METHOD, APS_COORD_NBRSCORE_ORDER, CANVAS_METER_PER_DOT)
+        if settings != located_by:
+            located.clear()
+            located_by = settings
+        dirty = set(a for a in aps_nscore
+                    if a not in located or [r for r in a.radios.values() if r.coord_dirty])
+        dependents = {}
+        for a, refs in located.items():
+            for ref in refs:
+                dependents.setdefault(ref, []).append(a)
+        todo = list(dirty)
+        while todo:
+            for a in dependents.get(todo.pop(), []):
+                if a not in dirty:
+                    dirty.add(a)
+                    todo.append(a)
+        if not dirty:
+            time.sleep(NEW_NODE_DETECT_INTERVAL)
+            continue
+        LOG('DEBUG', 'APs to re-calculate coordinates: %s', dirty)
+        for a in dirty:
+            located.pop(a, None)
+
+        start = PERF.start()
+        aps, aps_delayed = [a for a in aps_nscore if a in located], []
+        if APS_COORD_METHOD == 'lsq':
+            # all APs are located together, from all nbr links
+            calc_ap_coord_lsq(aps_nscore)
+            for ap in aps_nscore:
+                coord_solved(ap, [])
+            PERF.stop('coord', start)
+            stream_positions(aps_nscore)
+            time.sleep(NEW_NODE_DETECT_INTERVAL)
+            continue
+
         for ap in aps_nscore:
             LOG('DEBUG', 'aps: %s\nap: %s', aps, ap)
 
@@ -1060,7 +4087,7 @@ def calc_ap_coord():
                 if rd1:
                     rd1.c = rd0.c
                 LOG('DEBUG', 'the 1st AP %s fixed to %s', ap, rd0.c)
-                aps.append(ap)
+                coord_solved(ap, [])
                 continue
 
             # the 2nd AP is always put to straight right of the 1st AP
@@ -1080,7 +4107,7 @@ def calc_ap_coord():
                     if rd1:
                         rd1.c = rd0.c
                     LOG('DEBUG', 'the 2nd AP %s fixed to right of the 1st AP by distance %d', ap, d1)
-                    aps.append(ap)
+                    coord_solved(ap, [ref1_rd])
                     continue
 
             # the 3rd AP is always put to the above cross point of the first 2 APs
@@ -1109,7 +4136,7 @@ def calc_ap_coord():
                         if rd1:
                             rd1.c = rd0.c
                         LOG('DEBUG', 'the 3rd AP %s put to the cpoint %s of the first 2 APs', ap, rd0.c)
-                        aps.append(ap)
+                        coord_solved(ap, [ref1_rd, ref2_rd])
                     continue
                 
             # other APs are calc according to the '3-point locating' method
@@ -1137,7 +4164,7 @@ def calc_ap_coord():
                     if rd1:
                         rd1.c = rd0.c
                     LOG('DEBUG', 'AP %s put to %s', ap, rd0.c)
-                    aps.append(ap)
+                    coord_solved(ap, [ref1_rd, ref2_rd, ref3_rd])
                 else:
                     # the 3rd ref AP determines the best cross point of first 2 ref APs
                     n1 = distance(ref1_rd.c, ref3_rd.c)
@@ -1149,13 +4176,14 @@ def calc_ap_coord():
                     if rd1:
                         rd1.c = rd0.c
                     LOG('DEBUG', 'AP %s put to %s', ap, rd0.c)
-                    aps.append(ap)
+                    coord_solved(ap, [ref1_rd, ref2_rd, ref3_rd])
 
-        APS_LOCK.release()
+        PERF.stop('coord', start)
+        stream_positions(aps_nscore)
         time.sleep(NEW_NODE_DETECT_INTERVAL)
 
+# redraw all APs at once, e.g. after a display option is changed
 def update_gui():
-    global APS, APS_LOCK
 
     def sort_ap_coverage(ap):
         if len(ap.radios) == 1:
@@ -1166,85 +4194,90 @@ def update_gui():
             else:
                 return ap.radios[IFNAME_WIFI1].r
 
-    if not APS or CANVAS_FREEZE:
+    fleet = FLEET
+    if not fleet or CANVAS_FREEZE:
         return
 
     # display all APs, larger radio coverage first so that it won't cover other
     # smaller coverage APs
-    APS_LOCK.acquire()
-    aps = sorted(APS.values(), key=sort_ap_coverage, reverse=True)
+    aps = sorted([a for a in fleet.aps if a.radios], key=sort_ap_coverage, reverse=True)
 
     for ap in aps:
         apname = ap.name + '/' + ap.mac
+        c = ap.radios[IFNAME_WIFI0].c       # two radios have the same center
         if len(ap.radios) == 1:
-            ap.radios[IFNAME_WIFI0].show(apname=apname)
+            ap.radios[IFNAME_WIFI0].show(c, apname=apname)
         else:
-            # two radios have the same center
-            ap.radios[IFNAME_WIFI1].c = ap.radios[IFNAME_WIFI0].c
-
-            ap.radios[IFNAME_WIFI0].erase()
-            ap.radios[IFNAME_WIFI1].erase()
-
-            # the radio with larger coverage radius draw first, thus it won't cover the other one
+            # the AP name is shown by the radio with smaller coverage radius, which is on top
             if ap.radios[IFNAME_WIFI0].r > ap.radios[IFNAME_WIFI1].r:
-                ap.radios[IFNAME_WIFI0].show()
-                ap.radios[IFNAME_WIFI1].show(apname=apname)
+                ap.radios[IFNAME_WIFI0].show(c)
+                ap.radios[IFNAME_WIFI1].show(c, apname=apname)
             else:
-                ap.radios[IFNAME_WIFI1].show()
-                ap.radios[IFNAME_WIFI0].show(apname=apname)
-    APS_LOCK.release()
+                ap.radios[IFNAME_WIFI1].show(c)
+                ap.radios[IFNAME_WIFI0].show(c, apname=apname)
 
 
 def quit_safe(code):
-    APS_LOCK.acquire()
-    if APS:
-        for ap in APS.values():
-            ap.ssh_close()
-    APS_LOCK.release()
+    ssh_cmd_stats_report()
+    ssh_sessions_report()
+    lock_stats_report()
+    gui_stats_report()
+    recorder_stats_report()
+    cli_jobs_report()
+    discovery_stats_report()
+    perf_stats_report()
+    log_stats_report()
+    if PROFILER.running:
+        PROFILER.stop()
+    if REPLAY and not REPLAY.done:
+        REPLAY.report()
+    for ap in FLEET.aps:
+        ap.ssh_close()
+    if STATE_STREAM:
+        STATE_STREAM.flush()
+    LOGGER.stop()
     exit(code)
 
 def quit_callback(signum, stack):
     quit_safe(254)
 
-# find the AP under given location (x, y)
+# find the AP under given location (x, y), the one with the smallest radio
+# circle if there are multiple under it
 def find_ap_at_xy(x, y):
-    ap_found = None
-
-    APS_LOCK.acquire()
-    if APS:
-        for ap in APS.values():
-            if len(ap.radios) == 0:
-                continue
-            elif len(ap.radios) == 1:
-                rd = ap.radios[IFNAME_WIFI0]
-            else:
-                # the smaller radio is sensitive to mouse
-                if ap.radios[IFNAME_WIFI0].r > ap.radios[IFNAME_WIFI1].r and ap.radios[IFNAME_WIFI1].r:
-                    rd = ap.radios[IFNAME_WIFI1]
-                else:
-                    rd = ap.radios[IFNAME_WIFI0]
-
-            if sqrt((x - rd.c[0])**2 + (y - rd.c[1])**2) < rd.r:
-                # randomly select one AP if there are multiple under the mouse
-                ap_found = ap
-                break
-    APS_LOCK.release()
-
-    return ap_found
-
-class CLIDialog(tkSimpleDialog.Dialog):
-    def body(self, master):
-        Label(master, text="CLI:").grid(row=0)
-        self.e1 = Entry(master, width=42)
-        self.e1.grid(row=0, column=1)
-        Label(master, text="Delay between APs:").grid(row=1)
-        self.e2 = Entry(master, width=32)
-        self.e2.grid(row=1, column=1)
-        return self.e1  # initial focus
-
-    def apply(self):
-        self.result = (str(self.e1.get()), str(self.e2.get()))
-        return self.result
+    for circle in CANVAS_GRID.query_point(x, y):
+        if isinstance(circle, Radio):
+            return circle.ap
+    return None
+
+# Tkinter is imported only when the GUI is started, so the headless mode doesn't
+# need it, nor pay for its start-up. The dialogs are defined with it
+def import_tk():
+    global Tk, Canvas, Menu, Label, Entry, YES, BOTH, LEFT, DISABLED, tkSimpleDialog, \
+        CLIDialog, HelpDialog
+    from Tkinter import Tk, Canvas, Menu, Label, Entry, YES, BOTH, LEFT, DISABLED
+    import tkSimpleDialog
+
+    class CLIDialog(tkSimpleDialog.Dialog):
+        def body(self, master):
+            Label(master, text="CLI:").grid(row=0)
+            self.e1 = Entry(master, width=42)
+            self.e1.grid(row=0, column=1)
+            Label(master, text="Delay between APs:").grid(row=1)
+            self.e2 = Entry(master, width=32)
+            self.e2.grid(row=1, column=1)
+            Label(master, text="APs per wave:").grid(row=2)
+            self.e3 = Entry(master, width=32)
+            self.e3.grid(row=2, column=1)
+            return self.e1  # initial focus
+
+        def apply(self):
+            self.result = (str(self.e1.get()), str(self.e2.get()), str(self.e3.get()))
+            return self.result
+
+    class HelpDialog(tkSimpleDialog.Dialog):
+        def body(self, master):
+            Label(master, text=SHORTCUT_KEYS_HELP, justify=LEFT).grid(row=0)
+            return None
 
 PRESSED_AP = None
 MENU = None
@@ -1266,33 +4299,19 @@ TARGET_APS = []
 def mouse_menu_callback(event):
     global PRESSED_AP, MENU, USER_CLIS, TARGET_APS
 
-    # multiple CLI could be specified in 'clis' string, separated by ';'
-    def cli_cmd(clis, ap_delay=0):
+    # multiple CLI could be specified in 'clis' string, separated by ';'. CLIs are
+    # sent by CLI_JOBS in the background, 'ap_delay' seconds apart between APs
+    def cli_cmd(clis, ap_delay=0, wave=CLI_JOB_WAVE):
         clis = clis.split(';')
 
         if PRESSED_AP:  # menu of the AP
-            try:
-                for cli in clis:
-                    PRESSED_AP.ssh_cmd(cli+'\n')
-                    LOG('INFO', 'CLI "%s" issued to %s', cli, PRESSED_AP)
-            except Exception:
-                LOG('ERROR', 'CLI "%s" failed to issue to %s', clis, PRESSED_AP)
-        else:   # menu of all APs
-            if TARGET_APS:
-                aps = TARGET_APS
-            else:
-                aps = APS.values()
-            APS_LOCK.acquire()
-            if aps:
-                for ap in aps:
-                    try:
-                        for cli in clis:
-                            ap.ssh_cmd(cli+'\n')
-                            LOG('INFO', 'CLI "%s" issued to %s', cli, ap)
-                    except Exception:
-                        LOG('ERROR', 'CLI "%s" failed to issue to %s', clis, ap)
-                    time.sleep(ap_delay)
-            APS_LOCK.release()
+            aps = [PRESSED_AP]
+        elif TARGET_APS:
+            aps = TARGET_APS
+        else:   # menu of all APs, APs detected meanwhile are not included
+            aps = FLEET.aps
+        if aps:
+            CLI_JOBS.submit(clis, aps, rate=1.0 / ap_delay if ap_delay > 0 else CLI_JOB_RATE, wave=wave)
 
     def menu_add_cli(menu, cli, callback):
         menu.add_command(label='CLI: '+cli, command=functools.partial(callback, cli))
@@ -1307,9 +4326,13 @@ def mouse_menu_callback(event):
             ap_delay = float(result[1])
         else:
             ap_delay = 0
+        if result[2]:
+            wave = int(result[2])
+        else:
+            wave = CLI_JOB_WAVE
 
         cli = result[0].strip()
-        cli_cmd(cli, ap_delay=ap_delay)
+        cli_cmd(cli, ap_delay=ap_delay, wave=wave)
         if cli not in USER_CLIS:
             if True:
                 USER_CLIS.append(cli)
@@ -1344,7 +4367,9 @@ def mouse_menu_callback(event):
 
     MENU.delete(0)
     if PRESSED_AP:
-        target = PRESSED_AP
+        target = str(PRESSED_AP)
+        if APS_COORD_METHOD == 'lsq' and PRESSED_AP.coord_residual is not None:
+            target += ' (residual %.1fm)' % PRESSED_AP.coord_residual
     elif TARGET_APS:
         target = 'All selected APs'
     else:
@@ -1368,12 +4393,25 @@ def mouse_selection_callback(event):
         LOG('INFO', '%s selected', ap)
 
 
+# motion events come much faster than the AP could be redrawn, so only the
+# latest location is drawn, when Tk is idle
+DRAG_XY = None
 def mouse_move_callback(event):
-    global SELECTED_AP
+    global DRAG_XY
 
     if SELECTED_AP and not CANVAS_FREEZE:
-        SELECTED_AP.radios[IFNAME_WIFI0].show(c=(event.x, event.y))
-        SELECTED_AP.radios[IFNAME_WIFI1].show(c=(event.x, event.y))
+        if not DRAG_XY:
+            CANVAS.after_idle(mouse_drag_draw)
+        DRAG_XY = (event.x, event.y)
+
+def mouse_drag_draw():
+    global DRAG_XY
+
+    if SELECTED_AP and DRAG_XY and not CANVAS_FREEZE:
+        for rd in SELECTED_AP.radios.values():
+            rd.show(c=DRAG_XY)
+        RENDERER.flush()        # follow the mouse without waiting for the next frame
+    DRAG_XY = None
 
 def mouse_release_callback(event):
     global SELECTED_AP
@@ -1381,6 +4419,7 @@ def mouse_release_callback(event):
     if SELECTED_AP and not CANVAS_FREEZE:
         SELECTED_AP.radios[IFNAME_WIFI0].show(c=(event.x, event.y))
         SELECTED_AP.radios[IFNAME_WIFI1].show(c=(event.x, event.y))
+        RENDERER.flush()
         LOG('INFO', '%s put to %s', SELECTED_AP, SELECTED_AP.radios[IFNAME_WIFI0].c)
         SELECTED_AP = None
 
@@ -1393,11 +4432,13 @@ def win_resize_callback(event):
 
 SHORTCUT_KEYS_HELP = '''
 a     -- Toggle which radio of an AP is shown on the GUI: wifi0, wifi1, all\n
-c X   -- Set AP coordinates calculation method to X, X could be 'a'(auto), 'm'(manual), or 'r'(random)(default: auto)\n
+c X   -- Set AP coordinates calculation method to X, X could be 'a'(auto), 'l'(lsq), 'm'(manual), or 'r'(random)(default: auto)\n
 d     -- Toggle to disable/enable debugging output(default: Disabled)\n
 e NUM -- Set SSH command extra delay(s) to NUM(default: 0)\n
 f     -- Toggle to freeze/unfreeze GUI updating(default: unfreezed)\n
 h     -- Toggle to show/hide this help\n
+i     -- Toggle to show/hide the hot path stats(p50/p99/max latency of each stage) overlay, stats are collected while shown\n
+P     -- Toggle to start/stop profiling all threads, the profile is written as folded stacks for flame graph viewers\n
 m NUM -- Set noise floor margin(dBm) to NUM(default: 50)\n
 p NUM -- Set 'number of meters per dot'(m) to NUM(default: 0.1)\n
 r     -- Toggle to show/hide the timestamp that when a radio's ACSP becomes RUN\n
@@ -1405,15 +4446,11 @@ t     -- Toggle to fill/unfill radio circle color(default: fill)\n
 s     -- Toggle to calculate AP coords in the order of occurrence or nbr score(default: occurrence)\n
 t     -- Toggle to fill/unfill radio circle color(default: fill)\n
 w NUM -- Set RF signal sample smoothing window to NUM(default: 3)\n
+w X   -- Set RF signal filter to X, X could be 'a'(avg), 'e'(ewma), or 'm'(median)(default: avg)\n
 x     -- Toggle to select/unselect APs which are used as the CLIs target in the 'right-click' menu\n
 \n
 Note: For any shortcut key with value NUM, it must be closed by 'Enter' key, +/- key could be used instead of NUM\n
 '''
-class HelpDialog(tkSimpleDialog.Dialog):
-    def body(self, master):
-        Label(master, text=SHORTCUT_KEYS_HELP, justify=LEFT).grid(row=0)
-        return None
-
 RADIO_DISPLAYED_LIST = ['a', '0', '1']
 radio_displayed = 0
 shortcut_key = ''
@@ -1422,13 +4459,14 @@ TARGET_APS_SELECTION = False
 def key_press_callback(event):
     global APS_COORD_METHOD, DEBUG_ENABLE, CANVAS_FREEZE, CANVAS_COLOR_TRANSP, \
         SSH_CMD_DELAY_EXTRA, RF_AVR_NFLOOR_MARGIN, CANVAS_METER_PER_DOT, RF_SMOOTH_WINDOW, \
-        ACSP_RUN_TIMESTAMP, RADIO_DISPLAYED, TARGET_APS_SELECTION, TARGET_APS, \
+        ACSP_RUN_TIMESTAMP, RADIO_DISPLAYED, TARGET_APS_SELECTION, TARGET_APS, RF_FILTER, \
         coords_methods, coords_methods_turn, shortcut_key, shortcut_num, radio_displayed
 
-    if event.keysym == 'a':
+    if event.keysym == 'a' and not shortcut_key:     # 'c a', 'w a' are handled below
         radio_displayed = (radio_displayed + 1) % len(RADIO_DISPLAYED_LIST)
         RADIO_DISPLAYED = RADIO_DISPLAYED_LIST[radio_displayed]
         LOG('INFO', 'RADIO_DISPLAYED: %s', RADIO_DISPLAYED)
+        update_gui()
     if event.keysym == 'd':
         DEBUG_ENABLE = bool(True - DEBUG_ENABLE)
         LOG('INFO', 'DEBUG_ENABLE: %s', DEBUG_ENABLE)
@@ -1436,11 +4474,16 @@ def key_press_callback(event):
         CANVAS_FREEZE = bool(True - CANVAS_FREEZE)
         LOG('INFO', 'CANVAS_FREEZE: %s', CANVAS_FREEZE)
     elif event.keysym == 'h':
-        #tkMessageBox.showinfo('Shortcut key help', SHORTCUT_KEYS_HELP)
         dia = HelpDialog(CANVAS, title='Shortcut key help')
+    elif event.keysym == 'i':
+        PERF.toggle_overlay()
+        LOG('INFO', 'Hot path stats overlay: %s', PERF.overlay)
+    elif event.keysym == 'P':
+        PROFILER.toggle()
     elif event.keysym == 't':
         CANVAS_COLOR_TRANSP = bool(True - CANVAS_COLOR_TRANSP)
         LOG('INFO', 'CANVAS_COLOR_TRANSP: %s', CANVAS_COLOR_TRANSP)
+        update_gui()
     elif event.keysym in 'cempw':
         if not shortcut_key:
             shortcut_key = event.keysym
@@ -1450,10 +4493,17 @@ def key_press_callback(event):
                 APS_COORD_METHOD = 'manual'
                 LOG('INFO', 'APS_COORD_METHOD: %s', APS_COORD_METHOD)
                 shortcut_key = ''
+            elif shortcut_key == 'w' and event.keysym in 'em':
+                RF_FILTER = 'ewma' if event.keysym == 'e' else 'median'
+                LOG('INFO', 'RF_FILTER: %s', RF_FILTER)
+                shortcut_key = ''
     elif event.keysym == 'a':
         if shortcut_key == 'c': 
             APS_COORD_METHOD = 'auto'
             LOG('INFO', 'APS_COORD_METHOD: %s', APS_COORD_METHOD)
+        elif shortcut_key == 'w':
+            RF_FILTER = 'avg'
+            LOG('INFO', 'RF_FILTER: %s', RF_FILTER)
     elif event.keysym == 'r':
         if shortcut_key == 'c': 
             APS_COORD_METHOD = 'random'
@@ -1461,6 +4511,13 @@ def key_press_callback(event):
         else:
             ACSP_RUN_TIMESTAMP = bool(True - ACSP_RUN_TIMESTAMP)
             LOG('INFO', 'ACSP_RUN_TIMESTAMP: %s', ACSP_RUN_TIMESTAMP)
+    elif event.keysym == 'l':
+        if shortcut_key == 'c':
+            if np:
+                APS_COORD_METHOD = 'lsq'
+                LOG('INFO', 'APS_COORD_METHOD: %s', APS_COORD_METHOD)
+            else:
+                LOG('WARN', 'Coord method "lsq" requires python module numpy')
     elif event.keysym == 's':
         APS_COORD_NBRSCORE_ORDER = bool(True - APS_COORD_NBRSCORE_ORDER)
         LOG('INFO', 'APS_COORD_NBRSCORE_ORDER: %s', APS_COORD_NBRSCORE_ORDER)
@@ -1516,20 +4573,36 @@ if __name__ == '__main__':
         choices=['0', '1', 'a'],
         help='Set which radio of an AP is shown on the GUI, "0": wifi0, "1": wifi1, "a": all')
     p.add_option('-c', '--coord_method', action='store', type='choice', dest='coord_method', 
-        choices=['auto', 'manual', 'random'],
+        choices=['auto', 'lsq', 'manual', 'random'],
         help='Set the method by which APs relative location coordinates are calculated, ' + 
-             'supported methods are "auto", "random", and "manual"')
+             'supported methods are "auto", "lsq"(least squares of all nbrs, requires numpy), ' +
+             '"random", and "manual"')
     p.add_option('-d', '--debug', action='store_true', dest='debug', default=False, 
         help='Enable verbose debug log')
     p.add_option('-e', '--ext_delay', action='store', type='float', dest='ext_delay', default=None, 
         help='Set the extra SSH command transaction delay time')
     p.add_option('-f', '--freeze_gui', action='store_true', dest='freeze_gui', default=False, 
         help='Freeze GUI updating')
+    p.add_option('-g', '--frame_rate', action='store', type='float', dest='frame_rate', default=None, 
+        help='Set max num of frames per second the GUI is redrawn, changes of APs in between ' +
+             'are merged into one frame(default: %d)' % GUI_FRAME_RATE)
+    p.add_option('-j', '--max_concurrency', action='store', type='string', dest='max_concurrency', 
+        default=None, help='Set max num of concurrent SSH handshakes and in-flight SSH cmd ' +
+             'transactions of all APs(separated by ":", or one for both)(default: %d:%d)' % 
+             (SCHED_MAX_HANDSHAKES, SCHED_MAX_INFLIGHT))
+    p.add_option('-l', '--poll_engine', action='store', type='choice', dest='poll_engine', 
+        choices=['thread', 'event'],
+        help='Set how APs are polled, "thread": a thread per AP, "event": all APs by an event ' +
+             'loop with non-blocking SSH I/O, requires "prompt" SSH read mode(default: thread)')
     p.add_option('-m', '--nfloor_margin', action='store', type='int', dest='nfloor_margin', default=None, 
         help='Set the safe margin to noise floor, within which signal is considered unusable')
     p.add_option('-n', '--subnet', action='store', type='string', dest='subnet', default=None, 
         help='Set the subnet(x.y.z.n/mask, or x.y.z.0 for 24 mask bits, or x.y.z.n:m for m ' + 
              'consequential ips starting from n) in which APs are monitored')
+    p.add_option('-o', '--ssh_read_mode', action='store', type='choice', dest='ssh_read_mode',
+        choices=['prompt', 'delay'],
+        help='Set how SSH command output is read, "prompt": read until the AP shell prompt is back, ' +
+             '"delay": read once after a fixed delay(default: prompt)')
     p.add_option('-p', '--meters_per_dot', action='store', type='int', dest='meters_per_dot', default=None, 
         help='Set how many radio RF coverage meters(radius) per dot when drawn on canvas')
     p.add_option('-r', '--acsp_run_ts', action='store_true', dest='acsp_run_ts', default=False, 
@@ -1541,14 +4614,76 @@ if __name__ == '__main__':
     p.add_option('-u', '--userpass', action='store_true', dest='userpass', default=None, 
         help='Set username and password(separated by ":") for all APs to be monitored')
     p.add_option('-w', '--smooth_window', action='store', type='int', dest='smooth_window', default=None, 
-        help='Set the RF signal smooth window size(num of samples which average is done on)')
+        help='Set the RF signal smooth window size(num of samples which average is done on, default: %d, max: %d)' % 
+            (RF_SMOOTH_WINDOW, RF_SMOOTH_WINDOW_MAX))
+    p.add_option('--rf_filter', action='store', type='choice', dest='rf_filter', 
+        choices=list(SignalFilter.FILTERS),
+        help='Set the RF signal(nbr rssi/cu/crc/sta count, noise floor) filter, "avg"(moving average), ' + 
+             '"ewma"(exponentially weighted moving average), or "median"(outliers rejected)(default: %s)' % RF_FILTER)
+    p.add_option('--cli_workers', action='store', type='int', dest='cli_workers', default=None, 
+        help='Set the num of APs CLIs sent from the menu are run on in parallel(default: %d)' % 
+             CLI_JOB_WORKERS)
+    p.add_option('--cli_rate', action='store', type='float', dest='cli_rate', default=None, 
+        help='Set max num of APs per second CLIs sent from the menu are started on, 0 for no limit' +
+             '(default: 0), the delay between APs given with the CLI overrides it')
+    p.add_option('--cli_wave', action='store', type='int', dest='cli_wave', default=None, 
+        help='Send CLIs from the menu to the num of APs per wave, the next wave starts only if all ' +
+             'APs of the previous one succeeded, 0 for all APs in one wave(default: 0)')
+    p.add_option('--probe', action='store', type='choice', dest='probe', choices=['auto', 'syn', 'connect'], 
+        help='Set how nodes in the subnet are probed for SSH service, "syn": TCP SYN by scapy, requires ' +
+             'root, "connect": TCP connect, "auto": "syn" if running as root(default: auto)')
+    p.add_option('--probe_rate', action='store', type='float', dest='probe_rate', default=None, 
+        help='Set max num of nodes probed per second, a node which doesn\'t answer is probed again ' +
+             'after exponential backoff up to %d seconds(default: %d)' % (DISCOVERY_MAX_BACKOFF, DISCOVERY_RATE))
+    p.add_option('--ssh_port', action='store', type='int', dest='ssh_port', default=None, 
+        help='Set the SSH port of all APs, e.g. of a simulated AP fleet(default: %d)' % SSH_PORT)
+    p.add_option('--headless', action='store_true', dest='headless', default=False, 
+        help='Run without GUI, write radio state changes and AP position updates as JSON ' +
+             'lines to the stream file instead')
+    p.add_option('--stream_file', action='store', type='string', dest='stream_file', default='-', 
+        help='Set the file JSON lines are appended to in the headless mode, "-" for stdout(default: -)')
+    p.add_option('--stream_interval', action='store', type='float', dest='stream_interval', 
+        default=None, help='Set the interval(seconds) the buffered JSON lines are written in the ' +
+             'headless mode(default: %.1f)' % STREAM_FLUSH_INTERVAL)
+    p.add_option('--replay', action='store', type='string', dest='replay', default=None, 
+        help='Replay the recording file(see --record) instead of monitoring APs in a subnet')
+    p.add_option('--replay_speed', action='store', type='float', dest='replay_speed', default=None, 
+        help='Set the replay speed, N times of real time, 0 for as fast as possible(default: 1)')
+    p.add_option('--replay_start', action='store', type='float', dest='replay_start', default=0, 
+        help='Replay from the keyframe at or before the num of seconds since the recording starts')
+    p.add_option('--record', action='store', type='string', dest='record', default=None, 
+        help='Record radio states and nbr rssi of the session to the file(appended if existing), ' +
+             'sampled every %.0f seconds' % RECORD_INTERVAL)
+    p.add_option('--log_file', action='store', type='string', dest='log_file', default=None, 
+        help='Write all logs also to the file, in full and with timestamps and thread names, rotated at ' + 
+             '%dMB, %d rotated files are kept(FILE.1...)' % (LOG_FILE_MAX / 1024 / 1024, LOG_FILE_BACKUPS))
+    p.add_option('--perf', action='store', type='string', dest='perf', default=None, 
+        help='Collect the hot path stats(latency histograms of SSH cmds, poll cycles, parsing, locks, ' +
+             'drawing and coords calculation) and dump them as JSON to the file every %.0f seconds ' % 
+             PERF_DUMP_INTERVAL + 'and on quit, see also shortcut key "i"')
     opts, args = p.parse_args()
 
-    if not opts.subnet:
+    if not opts.subnet and not opts.replay:
         LOG('ERROR', "Subnet must be provided, see usage.")
         p.print_help()
         p.exit(255)
 
+    if opts.max_concurrency:
+        limits = opts.max_concurrency.split(':')
+        try:
+            limits = [int(l) for l in limits]
+        except ValueError:
+            limits = []
+        if len(limits) == 1:
+            limits *= 2
+        if len(limits) != 2 or min(limits) <= 0:
+            p.error('-j/--max_concurrency must be HANDSHAKES:INFLIGHT or N, positive integers, not "%s"' % 
+                opts.max_concurrency)
+        SCHEDULER.limits[PollScheduler.HANDSHAKE], SCHEDULER.limits[PollScheduler.CMD] = limits
+
+    # from now on, logs are written by the log writer thread
+    LOGGER.start(opts.log_file)
+
     if opts.userpass:
         HIVEAP_USERNAME = opts.userpass.split(':')[0]
         HIVEAP_PASSWORD = opts.userpass.split(':')[1]
@@ -1556,23 +4691,40 @@ if __name__ == '__main__':
     if opts.radio_displayed:
         RADIO_DISPLAYED = opts.radio_displayed
 
-    subnet = opts.subnet
+    subnet = opts.subnet or ''
     if ':' in subnet:
-        ipstr = subnet.split(':')[0]
-        start_ip = int(ipstr.split('.')[3])
-        num_ip = int(subnet.split(':')[1])
-        subnet_prefix = ipstr[:ipstr.rfind('.')] + '.'
-        subnet = [subnet_prefix + str(ip) for ip in range(start_ip, start_ip+num_ip)]
-    else:
+        # the range could go across the last byte, e.g. 10.0.0.1:1000
+        start_ip = struct.unpack('!I', inet_aton(subnet.split(':')[0]))[0]
+        num_ip = min(int(subnet.split(':')[1]), DISCOVERY_MAX_ADDRS)
+        subnet = [inet_ntoa(struct.pack('!I', ip)) for ip in xrange(start_ip, start_ip+num_ip)]
+    elif subnet:
         if subnet.split('.')[3] == '0':
             subnet += '/24'
 
     DEBUG_ENABLE = opts.debug
     CANVAS_COLOR_TRANSP = opts.color_trans
     CANVAS_FREEZE = opts.freeze_gui
-    APS_COORD_METHOD = opts.coord_method
+    if opts.coord_method:
+        APS_COORD_METHOD = opts.coord_method
+    if APS_COORD_METHOD == 'lsq' and not np:
+        LOG('WARN', 'Coord method "lsq" requires python module numpy, use "auto" instead')
+        APS_COORD_METHOD = 'auto'
     APS_COORD_NBRSCORE_ORDER = opts.nbrscore_order
 
+    if opts.ssh_read_mode:
+        SSH_CMD_READ_MODE = opts.ssh_read_mode
+    if opts.ssh_port:
+        SSH_PORT = opts.ssh_port
+    if opts.probe:
+        DISCOVERY_PROBE = opts.probe
+    if opts.probe_rate and opts.probe_rate > 0:
+        DISCOVERY_RATE = opts.probe_rate
+    if opts.cli_workers and opts.cli_workers > 0:
+        CLI_JOBS.workers = opts.cli_workers
+    if opts.cli_rate is not None and opts.cli_rate >= 0:
+        CLI_JOB_RATE = opts.cli_rate
+    if opts.cli_wave is not None and opts.cli_wave >= 0:
+        CLI_JOB_WAVE = opts.cli_wave
     if opts.ext_delay:
         SSH_CMD_DELAY_EXTRA = opts.ext_delay
     if opts.meters_per_dot:
@@ -1581,22 +4733,60 @@ if __name__ == '__main__':
         RF_AVR_NFLOOR_MARGIN = opts.nfloor_margin
     if opts.smooth_window:
         RF_SMOOTH_WINDOW = opts.smooth_window
+    if opts.rf_filter:
+        RF_FILTER = opts.rf_filter
+    if opts.frame_rate and opts.frame_rate > 0:
+        GUI_FRAME_RATE = opts.frame_rate
+    if opts.stream_interval and opts.stream_interval > 0:
+        STREAM_FLUSH_INTERVAL = opts.stream_interval
+    if opts.headless:
+        HEADLESS = True
+        STATE_STREAM = StateStream(opts.stream_file, STREAM_FLUSH_INTERVAL)
+        STATE_STREAM.start()
+    if opts.record:
+        try:
+            RECORDER = ACSPRecorder(opts.record)
+        except (ValueError, IOError) as e:
+            p.error('--record: %s' % e)
+        RECORDER.start()
+    if opts.perf:
+        PERF.start_dump(opts.perf)
+    if opts.replay_speed is not None and opts.replay_speed >= 0:
+        REPLAY_SPEED = opts.replay_speed
+    if opts.replay:
+        REPLAY = ACSPReplay(opts.replay, REPLAY_SPEED, opts.replay_start)
+
+    if opts.poll_engine == 'event':
+        if SSH_CMD_READ_MODE == 'prompt':
+            POLL_ENGINE = PollEngine()
+            POLL_ENGINE.start()
+        else:
+            LOG('WARN', 'Event loop poll engine requires "prompt" SSH read mode, use thread per AP')
 
-    
     # Quit when user press 'Ctrl+C'
     signal(SIGINT, quit_callback)
+    signal(SIGUSR1, lambda signum, stack: PROFILER.toggle())
 
-    # Keep detecting new APs when they're online
-    t1 = threading.Thread(target=detect_new_aps, args=(subnet,), name="apsDetectThread")
-    t1.setDaemon(True)  # This is needed to allow the main thread response to any interrupt
-    t1.start()
+    if REPLAY:
+        # APs are set up from the recording instead
+        REPLAY.start()
+    else:
+        # Keep detecting new APs when they're online
+        DISCOVERY = NodeDiscovery(subnet, DISCOVERY_PROBE)
+        DISCOVERY.start()
 
     # Calculate each AP's location coordinate related to others
     t2 = threading.Thread(target=calc_ap_coord, args=(), name="apCoordCalThread")
     t2.setDaemon(True)
     t2.start()
 
+    if HEADLESS:
+        # wait for 'Ctrl+C', signals are only handled by the main thread
+        while True:
+            time.sleep(1)
+
     # Start GUI
+    import_tk()
     root = Tk()
     root.title('ACSPmon GUI')
     CANVAS = Canvas(root, width=CANVAS_WIDTH, height=CANVAS_HEIGHT, bg=CANVAS_COLOR)
@@ -1607,6 +4797,7 @@ if __name__ == '__main__':
     CANVAS.bind('<ButtonRelease-1>', mouse_release_callback)
     root.bind('<Configure>', win_resize_callback)
     root.bind('<KeyPress>', key_press_callback)
+    RENDERER.start(root)
 
     # GUI event handler
     root.mainloop()
@@ -0,0 +1,426 @@
+#!/usr/bin/env python
+#
+# Simulated Aerohive AP fleet, to test and benchmark acspmon without real APs
+# Note:
+#   (1) Each AP is an SSH server emulating the HiveOS CLIs acspmon polls, on its
+#       own IP address, all APs listen on the same port. The default addresses
+#       are loopback ones(127.1.0.1 ~), usable on Linux without setup
+#   (2) APs are placed on a jittered grid, a radio hears the nearest radios of
+#       the same band with FSPL rssi plus noise, once they're beaconing
+#   (3) Radios go through ACSP states Init, Scanning, Listening(or DFS_CAC) and
+#       Enable in a random time, and change channel at random times after that
+# Usage:
+#   ./hivesim.py -n 100 -p 2222 -l 0.05
+#   ssh -p 2222 admin@127.1.0.1
+#
+
+
+import sys, optparse, socket, select, threading, time, random, heapq, resource, logging
+import paramiko
+from socket import inet_aton, inet_ntoa
+from struct import pack, unpack
+from math import log10, sqrt, ceil
+
+
+
+SIM_ADDR = '127.1.0.1'          # IP address of the 1st AP, the others follow it
+SIM_PORT = 2222                 # SSH port of all APs
+SIM_USERNAME = 'admin'
+SIM_PASSWORD = 'aerohive'
+SIM_SESSION_TIMEOUT = 20        # max seconds a client takes to open the shell after connected
+SIM_LATENCY = 0.05              # seconds an AP takes to run a CLI
+SIM_NBR_LATENCY = 0.2           # seconds an AP takes to run 'show acsp neighbor'
+SIM_LATENCY_JITTER = 0.5        # max random extra latency, in ratio of the latency
+SIM_SPACING = 12.0              # meters between 2 neighboring APs on the grid
+SIM_NBRS = 24                   # max num of nbr radios a radio hears
+SIM_VAPS = 2                    # num of VAPs(SSIDs) per radio, one nbr table line each
+SIM_RSSI_NOISE = 2.0            # standard deviation(dB) of the nbr rssi noise
+SIM_RSSI_MIN = -95              # nbr rssi(dBm) below which a nbr is not heard
+SIM_CONVERGE = 60.0             # max seconds a radio takes from Init to Enable state
+SIM_CHNL_CHANGES = 2.0          # num of channel changes per radio per hour after Enable
+
+CHNLS = {
+    2: [1, 6, 11],
+    5: [36, 40, 44, 48, 52, 56, 60, 64, 100, 104, 108, 112, 116, 132, 136, 149, 153, 157, 161, 165],
+}
+DFS_CHNLS = range(52, 145)
+
+
+
+# Log to stderr, stdout is left to the ready line read by the benchmark
+def LOG(fmt, *args):
+    print >>sys.stderr, '[hivesim]: ' + fmt % args
+
+def ieee2ghz(chnl):
+    return (2407 + chnl*5 if chnl <= 14 else 5000 + chnl*5) / 1000.0
+
+
+# Radio of a simulated AP, ACSP states are advanced lazily by the time they're read
+class SimRadio(object):
+    def __init__(self, ap, name, mac, band):
+        self.ap = ap
+        self.name = name
+        self.mac = mac
+        self.band = band
+        self.phymode = '11ng' if band == 2 else '11ac'
+        self.width = 20 if band == 2 else 80
+        self.nfloor = random.randint(-97, -92)
+        self.nbrs = []          # list of (SimRadio, distance in meters) heard, nearest first
+        self.chnl_state = None
+        self.pwr_state = None
+        self.chnl = 0
+        self.txpwr = 20
+        self.phases = []        # list of (time, state) the radio is going through
+        self.updated = time.time()
+        self.restart(self.updated, random.uniform(0, SIM_CONVERGE))
+
+    def __str__(self):
+        return "%s-%s-%s/%s" % (self.name, self.mac, self.chnl_state, self.chnl)
+
+    def __repr__(self):
+        return self.__str__()
+
+    # select a new channel and tx power in 'converge' seconds from 'now'
+    def restart(self, now, converge):
+        self.chnl = random.choice(CHNLS[self.band])
+        self.txpwr = random.randint(10, 20)
+        listen = 'DFS_CAC' if self.chnl in DFS_CHNLS else 'Listening'
+        self.chnl_state = self.pwr_state = 'Init'
+        self.phases = [(now + converge * 0.1, 'Scanning'), (now + converge * 0.6, listen),
+                       (now + converge, 'Enable')]
+
+    def update(self, now):
+        while self.phases and self.phases[0][0] <= now:
+            self.chnl_state = self.phases.pop(0)[1]
+            self.pwr_state = 'Enable' if self.chnl_state == 'Enable' else 'Init'
+        if self.chnl_state == 'Enable' and \
+                random.random() < SIM_CHNL_CHANGES * (now - self.updated) / 3600:
+            self.restart(now, random.uniform(0, SIM_CONVERGE / 4))
+        self.updated = now
+
+    # whether the radio sends beacons, to be heard by its nbrs
+    def beaconing(self):
+        return self.chnl_state in ('Listening', 'Enable')
+
+    def rssi(self, dist):
+        fspl = 32.44 + 20*log10(ieee2ghz(self.chnl)) + 20*log10(max(dist, 1))
+        return int(round(self.txpwr - fspl + random.gauss(0, SIM_RSSI_NOISE)))
+
+
+# A simulated AP, outputs of its CLIs are built from its radios' current states
+class SimAP(object):
+    def __init__(self, ip, index, xy):
+        self.ip = ip
+        self.xy = xy
+        self.mac = '0019:77%02x:%02x00' % ((index >> 8) & 255, index & 255)
+        self.name = 'AP230'
+        self.hive = 'hive0'
+        self.prompt = 'AH-%s#' % self.mac.replace(':', '')[-6:]
+        self.radios = [SimRadio(self, 'wifi0', self.mac[:-2] + '10', 2),
+                       SimRadio(self, 'wifi1', self.mac[:-2] + '20', 5)]
+
+    def __str__(self):
+        return "%s-%s-%s" % (self.name, self.mac, self.ip)
+
+    def __repr__(self):
+        return self.__str__()
+
+    @staticmethod
+    def vap_mac(rd, vap):
+        return rd.mac[:-1] + '%x' % vap
+
+    def show_interface(self):
+        out = ['State=Operational state; Chan=Channel;',
+               'Radio=Radio profile; U=up; D=down;',
+               '',
+               'Name       MAC addr        Mode     State Chan(Width) VLAN  Radio   Hive     SSID',
+               '---------- --------------  -------- ----- ----------- ----- ------- -------- --------',
+               'Mgt0       %s  -        U     -           1     -       %-8s -' % (self.mac, self.hive)]
+        for rd in self.radios:
+            out.append('%-10s %s  access   U     %-11s -     %-7s %-8s -' %
+                (rd.name.capitalize(), rd.mac, '%d(%d)' % (rd.chnl, rd.width), rd.name, self.hive))
+            for v in range(1, SIM_VAPS + 1):
+                out.append('%-10s %s  access   U     %-11d 1     %-7s %-8s ssid%d' %
+                    ('%s.%d' % (rd.name.capitalize(), v), SimAP.vap_mac(rd, v - 1), rd.chnl,
+                     rd.name, self.hive, v))
+        return out
+
+    def show_radio(self, rd):
+        return ['Name=%s; MAC addr=%s;' % (rd.name, rd.mac),
+                'Mode=access; Radio profile=radio_%s0;' % rd.phymode[2:],
+                'Phymode=%s; Channel=%d; Channel width=%d;' % (rd.phymode, rd.chnl, rd.width),
+                'Tx power=%ddBm; Noise floor=%ddBm;' % (rd.txpwr, rd.nfloor),
+                'Operational state=up;']
+
+    def show_version(self):
+        return ['Aerohive Networks Inc.',
+                'Copyright (c) 2006-2018 Aerohive Networks, Inc.',
+                '',
+                'Version:              HiveOS 8.1r2a build-191018',
+                'Platform:             %s' % self.name,
+                'Uptime:               0 weeks, 0 days, 1 hours, 0 minutes, 0 seconds']
+
+    def show_acsp(self):
+        out = ['',
+               'Interface  Channel select state  Primary channel  Channel width  ' +
+               'Power ctrl state  Tx power(dbm)',
+               '---------  --------------------  ---------------  -------------  ' +
+               '----------------  -------------']
+        for rd in self.radios:
+            out.append('%-10s %-21s %-16d %-14d %-17s %d' %
+                (rd.name.capitalize(), rd.chnl_state, rd.chnl, rd.width, rd.pwr_state, rd.txpwr))
+        return out
+
+    def show_acsp_nbr(self):
+        out = ['Bssid           Mode    Ssid/Hive  Chan  Rssi(dBm)  Aerohive AP  Chan-width  ' +
+               'CU  CRC  STA  Channel-utilization']
+        for rd in self.radios:
+            for nrd, dist in rd.nbrs:
+                if not nrd.beaconing():
+                    continue
+                rssi = nrd.rssi(dist)
+                if rssi < SIM_RSSI_MIN:
+                    continue
+                for v in range(SIM_VAPS):
+                    cu = random.randint(0, 60)
+                    out.append('%s  Access  %-10s %4d  %4d       yes          %-11d %2d  %d    %2d   %d' %
+                        (SimAP.vap_mac(nrd, v), 'ssid%d' % (v + 1), nrd.chnl, rssi, nrd.width,
+                         cu, random.randint(0, 3), random.randint(0, 20), cu))
+        return out
+
+    # run CLI 'cmd', return its output lines, an output filter('| in') is supported
+    def run(self, cmd, now):
+        for rd in self.radios:
+            rd.update(now)
+        for nrd, dist in self.radios[0].nbrs + self.radios[1].nbrs:
+            nrd.update(now)
+
+        pattern = None
+        if '|' in cmd:
+            cmd, filt = [s.strip() for s in cmd.split('|', 1)]
+            if filt.split()[0] not in ('in', 'include') or len(filt.split()) < 2:
+                return ['        ^-- unknown keyword or invalid input']
+            pattern = filt.split(None, 1)[1].lower()
+
+        cmd = ' '.join(cmd.split())
+        if cmd in ('', 'console timeout 0', 'console page 0'):
+            out = []
+        elif cmd == 'show interface':
+            out = self.show_interface()
+        elif cmd in ('show interface wifi0', 'show interface wifi1'):
+            out = self.show_radio(self.radios[int(cmd[-1])])
+        elif cmd == 'show version':
+            out = self.show_version()
+        elif cmd == 'show acsp':
+            out = self.show_acsp()
+        elif cmd == 'show acsp neighbor':
+            out = self.show_acsp_nbr()
+        elif cmd in ('interface wifi0 radio channel auto', 'interface wifi1 radio channel auto'):
+            # channel selection starts over
+            self.radios[int(cmd[len('interface wifi')])].restart(now, random.uniform(0, SIM_CONVERGE))
+            out = []
+        elif cmd.startswith('interface ') or cmd.startswith('no interface '):
+            out = []    # other interface configuration is accepted, without effect
+        else:
+            out = ['        ^-- unknown keyword or invalid input']
+
+        if pattern:
+            out = [line for line in out if pattern in line.lower()]
+        return out
+
+
+# paramiko server side of an AP's SSH connection, only password auth and shell
+class SimServer(paramiko.ServerInterface):
+    def __init__(self):
+        self.shell = threading.Event()
+
+    def check_auth_password(self, username, password):
+        if username == SIM_USERNAME and password == SIM_PASSWORD:
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_pty_request(self, channel, term, width, height, pixelwidth, pixelheight, modes):
+        return True
+
+    def check_channel_shell_request(self, channel):
+        self.shell.set()
+        return True
+
+
+# The simulated AP fleet, serves SSH connections to all APs from their listening
+# sockets by one thread, a thread per connection
+class SimFleet(object):
+    def __init__(self, num, addr=SIM_ADDR, port=SIM_PORT):
+        self.port = port
+        self.lock = threading.Lock()    # lock to serialize radio state updates
+        self.aps = {}                   # indexed by IP
+        self.sessions = 0               # num of SSH sessions opened
+        self.cmds = 0                   # num of CLIs run
+        self.bytes = 0                  # num of output bytes sent
+
+        # place APs on a jittered grid, a radio hears the nearest ones of its band
+        side = int(ceil(sqrt(num)))
+        aps = []
+        for i, ip in enumerate(sim_ips(num, addr)):
+            xy = ((i % side + random.uniform(-0.25, 0.25)) * SIM_SPACING,
+                  (i // side + random.uniform(-0.25, 0.25)) * SIM_SPACING)
+            ap = SimAP(ip, i, xy)
+            self.aps[ap.ip] = ap
+            aps.append(ap)
+        for ap in aps:
+            dists = [(sqrt((ap.xy[0] - o.xy[0])**2 + (ap.xy[1] - o.xy[1])**2), o) for o in aps if o is not ap]
+            for dist, o in heapq.nsmallest(SIM_NBRS, dists, key=lambda d: d[0]):
+                for rd, nrd in zip(ap.radios, o.radios):
+                    rd.nbrs.append((nrd, dist))
+        self.host_key = paramiko.RSAKey.generate(2048)
+
+    def __str__(self):
+        ips = sorted(self.aps.keys(), key=inet_aton)
+        return "SimFleet(%d APs, %s ~ %s port %d)" % (len(ips), ips[0], ips[-1], self.port)
+
+    def __repr__(self):
+        return self.__str__()
+
+    def start(self):
+        self.socks = {}     # key: fileno, value: (listening socket, SimAP)
+        for ap in self.aps.values():
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind((ap.ip, self.port))
+            sock.listen(16)
+            self.socks[sock.fileno()] = (sock, ap)
+        t = threading.Thread(target=self.loop, name="simAcceptThread")
+        t.setDaemon(True)
+        t.start()
+
+    def loop(self):
+        p = select.poll()   # no FD_SETSIZE limit
+        for fd in self.socks:
+            p.register(fd, select.POLLIN)
+        while True:
+            for fd, event in p.poll():
+                sock, ap = self.socks[fd]
+                conn, addr = sock.accept()
+                t = threading.Thread(target=self.serve, args=(ap, conn), name="simSessionThread")
+                t.setDaemon(True)
+                t.start()
+
+    def serve(self, ap, conn):
+        transport = paramiko.Transport(conn)
+        transport.add_server_key(self.host_key)
+        server = SimServer()
+        try:
+            transport.start_server(server=server)
+            chan = transport.accept(SIM_SESSION_TIMEOUT)
+            if chan and server.shell.wait(SIM_SESSION_TIMEOUT):
+                self.shell(ap, chan)
+        except (socket.error, EOFError):
+            pass        # closed by the client
+        except Exception as e:
+            LOG('%s session error: %s', ap, e)
+        transport.close()
+
+    # HiveOS shell: each input line is echoed when it's read, followed by the
+    # CLI output and the prompt, so type-ahead CLIs are answered one by one
+    def shell(self, ap, chan):
+        with self.lock:
+            self.sessions += 1
+        chan.sendall('\r\n\r\nAerohive Networks Inc.\r\nCopyright (c) 2006-2018\r\n\r\n' + ap.prompt)
+        pending = ''
+        while True:
+            data = chan.recv(4096)
+            if not data:
+                return
+            pending += data.replace('\r\n', '\n').replace('\r', '\n')
+            while '\n' in pending:
+                line, pending = pending.split('\n', 1)
+                cmd = line.strip()
+                if cmd in ('exit', 'quit'):
+                    return
+                if cmd:
+                    latency = SIM_NBR_LATENCY if cmd == 'show acsp neighbor' else SIM_LATENCY
+                    time.sleep(latency * (1 + random.uniform(0, SIM_LATENCY_JITTER)))
+                with self.lock:
+                    out = ap.run(cmd, time.time())
+                    self.cmds += 1
+                text = line + '\r\n' + ''.join([l + '\r\n' for l in out]) + ap.prompt
+                chan.sendall(text)
+                with self.lock:
+                    self.bytes += len(text)
+
+    def stats_report(self):
+        LOG('%d SSH sessions, %d CLIs run, %.1fMB output sent', self.sessions, self.cmds,
+            self.bytes / 1024.0 / 1024)
+
+
+# IP addresses of 'num' APs, starting from 'addr'
+def sim_ips(num, addr=SIM_ADDR):
+    base = unpack('!I', inet_aton(addr))[0]
+    return [inet_ntoa(pack('!I', base + i)) for i in range(num)]
+
+# Raise the open files limit, each AP connection takes a file descriptor
+def raise_nofile_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, resource.error):
+            pass
+
+
+# Main entry
+if __name__ == '__main__':
+    p = optparse.OptionParser(description='Simulated Aerohive AP fleet, SSH servers emulating the ' +
+        'HiveOS CLIs polled by acspmon')
+    p.add_option('-a', '--addr', action='store', type='string', dest='addr', default=SIM_ADDR,
+        help='Set the IP address of the 1st AP, the others follow it(default: %s)' % SIM_ADDR)
+    p.add_option('-c', '--chnl_changes', action='store', type='float', dest='chnl_changes', default=None,
+        help='Set the num of channel changes per radio per hour(default: %.1f)' % SIM_CHNL_CHANGES)
+    p.add_option('-g', '--converge', action='store', type='float', dest='converge', default=None,
+        help='Set max seconds a radio takes to go from Init to Enable state(default: %.0f)' % SIM_CONVERGE)
+    p.add_option('-l', '--latency', action='store', type='string', dest='latency', default=None,
+        help='Set seconds an AP takes to run a CLI, and "show acsp neighbor"(separated by ":")' +
+             '(default: %s:%s)' % (SIM_LATENCY, SIM_NBR_LATENCY))
+    p.add_option('-n', '--num_aps', action='store', type='int', dest='num_aps', default=10,
+        help='Set the num of APs(default: 10)')
+    p.add_option('-p', '--port', action='store', type='int', dest='port', default=SIM_PORT,
+        help='Set the SSH port of all APs(default: %d)' % SIM_PORT)
+    p.add_option('-r', '--rssi_noise', action='store', type='float', dest='rssi_noise', default=None,
+        help='Set the standard deviation(dB) of the nbr rssi noise(default: %.1f)' % SIM_RSSI_NOISE)
+    p.add_option('-s', '--nbrs', action='store', type='int', dest='nbrs', default=None,
+        help='Set max num of nbr radios a radio hears(default: %d)' % SIM_NBRS)
+    opts, args = p.parse_args()
+
+    if opts.latency:
+        SIM_LATENCY = float(opts.latency.split(':')[0])
+        SIM_NBR_LATENCY = float(opts.latency.split(':')[-1])
+    if opts.chnl_changes is not None:
+        SIM_CHNL_CHANGES = opts.chnl_changes
+    if opts.converge is not None:
+        SIM_CONVERGE = opts.converge
+    if opts.rssi_noise is not None:
+        SIM_RSSI_NOISE = opts.rssi_noise
+    if opts.nbrs is not None:
+        SIM_NBRS = opts.nbrs
+
+    # sessions dropped by clients are normal, paramiko needn't complain
+    logging.getLogger('paramiko').addHandler(logging.NullHandler())
+    raise_nofile_limit()
+    fleet = SimFleet(opts.num_aps, opts.addr, opts.port)
+    fleet.start()
+    print 'ready: %s' % fleet
+    sys.stdout.flush()
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        fleet.stats_report()